@@ -4,55 +4,83 @@ from mangum import Mangum
 import basicauth
 from starlette import status
 from starlette.applications import Starlette
-from starlette.responses import Response
-from starlette_graphene3 import GraphQLApp, make_graphiql_handler
+from starlette.responses import PlainTextResponse, Response
+from starlette_graphene3 import make_graphiql_handler
 from starlette.middleware import Middleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 import graphene
+import src.metrics
+import src.settings
+from src.compression import CompressionMiddleware
+from src.graphql_app import InstrumentedGraphQLApp
 from src.queries import Query
+from src.server import RequestLimitMiddleware
+from src.streaming import make_stream_handler
 
-class CustomHeaderMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        unauthenticated_response = Response("Incorrect email or password", status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Basic"})
+# Plain ASGI rather than BaseHTTPMiddleware, which passes every response through an extra task and memory stream
+class BasicAuthMiddleware():
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.unauthenticated_response = Response("Incorrect email or password", status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Basic"})
 
-        # Respond as unauthenticated when failing to parse header
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] == "http" and not self.is_authenticated(scope)):
+            await self.unauthenticated_response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def is_authenticated(scope: Scope) -> bool:
+        authorization = next((value for name, value in scope["headers"] if name == b"authorization"), b"")
+
+        # Unauthenticated when failing to parse header
         try:
-            username, password = basicauth.decode(request.headers.get("authorization", ""))
+            username, password = basicauth.decode(authorization.decode("latin-1"))
         except Exception:
-            return unauthenticated_response
-        
-        # Check username/password if successfully parsed
-        if (not (username == "dev" and password == "uIES33LgtXTPObDu3RbM6sotDE70xGq7")):
-            return unauthenticated_response
+            return False
 
-        response = await call_next(request)
-        return response
+        return username == "dev" and password == "uIES33LgtXTPObDu3RbM6sotDE70xGq7"
 
+settings = src.settings.Settings()
+
+# CORS goes first, so preflight requests (which carry no credentials) are answered before authentication
 middleware = [
-    Middleware(CustomHeaderMiddleware),
-    Middleware(CORSMiddleware, allow_origins=['*'])
+    Middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]),
+    Middleware(RequestLimitMiddleware, max_requests=settings.SERVER_MAX_REQUESTS),
+    Middleware(BasicAuthMiddleware)
 ]
 
 app = Starlette(middleware=middleware)
 schema = graphene.Schema(query=Query)
+graphql_app: ASGIApp = InstrumentedGraphQLApp(schema, on_get=make_graphiql_handler())
 
-app.mount("/", GraphQLApp(schema, on_get=make_graphiql_handler()))  # Graphiql IDE
+# Only the GraphQL app is compressed: the middleware buffers whole responses, and /stream has to flush each line
+if (settings.RESPONSE_COMPRESSION_MINIMUM_SIZE is not None):
+    graphql_app = CompressionMiddleware(graphql_app, minimum_size=settings.RESPONSE_COMPRESSION_MINIMUM_SIZE)
 
-origins = ["*"]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_route("/stream", make_stream_handler(schema), methods=["POST"])  # NDJSON, one line per resource
+# Behind the same BasicAuth as the rest: the numbers give away how many templates and resources are scanned, and
+# Prometheus scrape configs take basic_auth credentials
+app.add_route("/metrics", lambda request: PlainTextResponse(src.metrics.registry.prometheus_text(), media_type="text/plain; version=0.0.4"), methods=["GET"])  # Prometheus
+app.mount("/", graphql_app)  # Graphiql IDE
 
 lambda_handler = Mangum(app)
 
 if __name__ == "__main__":
 
     # Run as a local service (instead of having AWS Lambda invoke the "lambda_handler" method)
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8100)
+    import argparse
+    import logging
+    from src.server import serve
+
+    parser = argparse.ArgumentParser(description="Serve the GraphQL API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS, help="Worker processes forked after preloading the artifact")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    serve(app, args.host, args.port, args.workers)
     
\ No newline at end of file
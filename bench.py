@@ -0,0 +1,214 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Scan results must be computed, not served from cache, for the numbers to mean anything
+os.environ["SCAN_CACHE_SIZE"] = "0"
+os.environ.pop("SCAN_CACHE_DIR", None)
+
+import src.artifact
+from src.capability_index import CapabilityMatch
+from src.cfn_lint import CfnTemplate
+
+BASELINE_PATH = "bench_baseline.json"
+
+# Synthetic templates. Properties are drawn from the property paths of the resource type's implementations in the
+# capability artifact, so matching and implementation plans do realistic work. Refs go from regular resources to a
+# pool of hub resources, sized so each hub is referenced by about fan_in resources.
+def generate_template(resource_count: int, depth: int, fan_in: int, fan_out: int, type_weights: Dict[str, float], seed: int = 0) -> Dict[str, Any]:
+    generator = random.Random(seed)
+    artifact = src.artifact.load_artifact()
+    resource_types = list(type_weights.keys())
+    weights = [type_weights[resource_type] for resource_type in resource_types]
+    property_paths: Dict[str, List[List[str]]] = {}
+
+    for resource_type in resource_types:
+        paths = {node[1] for edge in artifact.get_capability_index(resource_type).edge_ids for node in edge if node[0] and node[1].startswith(f"{resource_type}-")}
+        property_paths[resource_type] = [path[len(resource_type) + 1:].split("-") for path in sorted(paths)] or [["Name"]]
+
+    hub_count = max(1, (resource_count * fan_out) // max(fan_in, 1)) if fan_out else 0
+    hub_count = min(hub_count, max(resource_count - 1, 0))
+    resources: Dict[str, Any] = {}
+
+    for position in range(resource_count):
+        resource_type = generator.choices(resource_types, weights)[0]
+        properties: Dict[str, Any] = {}
+
+        for path in generator.sample(property_paths[resource_type], min(len(property_paths[resource_type]), generator.randint(1, 8))):
+            # Pad paths out to the requested nesting depth with synthetic sub-properties
+            path = path + [f"Nested{level}" for level in range(max(0, generator.randint(1, depth) - len(path)))]
+            node = properties
+
+            for name in path[:-1]:
+                child = node.get(name)
+                node[name] = child if isinstance(child, dict) else {}
+                node = node[name]
+
+            node[path[-1]] = f"value{position}"
+
+        if (position >= hub_count):
+            for reference in range(fan_out if hub_count else 0):
+                properties[f"Reference{reference}"] = {"Ref": f"Resource{(position + reference) % hub_count}"}
+
+        resources[f"Resource{position}"] = {"Type": resource_type, "Properties": properties}
+
+    return {"AWSTemplateFormatVersion": "2010-09-09", "Resources": resources}
+
+def parse_type_weights(mix: Optional[str]) -> Dict[str, float]:
+    # "AWS::S3::Bucket=3,AWS::EC2::Instance=1", defaulting to every type in the artifact with the same weight
+    if (not mix):
+        return {resource_type: 1.0 for resource_type in src.artifact.load_artifact().resource_types}
+
+    return {resource_type: float(weight) for resource_type, weight in (entry.rsplit("=", 1) if "=" in entry else (entry, "1") for entry in mix.split(","))}
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def measure(run: Callable[[], Any], iterations: int, resources: int) -> Dict[str, float]:
+    durations: List[float] = []
+
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - started)
+
+    # Peak memory comes from a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": percentile(durations, 0.50) * 1000,
+        "p99_ms": percentile(durations, 0.99) * 1000,
+        "mean_ms": statistics.mean(durations) * 1000,
+        "resources_per_second": resources / statistics.mean(durations),
+        "peak_memory_kb": peak / 1024}
+
+def run_benchmarks(template: Dict[str, Any], iterations: int) -> Dict[str, Dict[str, float]]:
+    from starlette.applications import Starlette
+    from starlette.testclient import TestClient
+    import app
+
+    template_json = json.dumps(template)
+    parsed_template = CfnTemplate.parse_raw(template_json)
+    logical_names = list(parsed_template.Resources.keys())
+    resource_count = len(logical_names)
+    artifact = src.artifact.load_artifact()
+
+    def build_graphs():
+        # Parsing is measured on its own, only the template's graph caches are dropped between iterations
+        for cache in CfnTemplate.__slots__:
+            if (hasattr(parsed_template, cache)):
+                object.__delattr__(parsed_template, cache)
+
+        return [parsed_template.resource_graph(logical_name) for logical_name in logical_names]
+
+    resource_graphs = build_graphs()
+
+    def match():
+        return [CapabilityMatch(artifact.get_capability_index(parsed_template.Resources[logical_name].Type), artifact.get_capability_index(parsed_template.Resources[logical_name].Type).present_edge_ids(resource_graph)) for logical_name, resource_graph in zip(logical_names, resource_graphs)]
+
+    capability_matches = match()
+
+    def implementation_plans():
+        # Fresh matches, so plans aren't served from the ones memoized by earlier runs
+        return [[capability_match.implementation_plan(position) for position, _ in capability_match.not_implemented()] for capability_match in [CapabilityMatch(existing.capability_index, existing.present_edge_ids) for existing in capability_matches]]
+
+    # The GraphQL request path without the authentication middleware, which would need credentials
+    client = TestClient(Starlette(routes=list(app.app.router.routes)))
+    query = "query($t: String!) { scanCloudformationTemplate(template: $t) { logicalName currentlyImplements { id title } supportsButDoesNotCurrentlyImplement { capability { id } implementations { resources { type action properties { name value } } } } } }"
+
+    def end_to_end():
+        response = client.post("/", json={"query": query, "variables": {"t": template_json}})
+
+        if (response.status_code != 200 or response.json().get("errors")):
+            raise Exception(f"GraphQL query failed: {response.text[:500]}")
+
+    return {
+        "parse": measure(lambda: CfnTemplate.parse_raw(template_json), iterations, resource_count),
+        "property_graph": measure(build_graphs, iterations, resource_count),
+        "capability_matching": measure(match, iterations, resource_count),
+        "implementation_plans": measure(implementation_plans, iterations, resource_count),
+        "graphql_end_to_end": measure(end_to_end, iterations, resource_count)}
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    regressions: List[str] = []
+
+    for phase, metrics in results.items():
+        if (phase not in baseline):
+            continue
+
+        for metric in ["p50_ms", "p99_ms"]:
+            if (metrics[metric] > baseline[phase][metric] * (1 + tolerance)):
+                regressions.append(f"{phase} {metric}: {metrics[metric]:.2f} vs baseline {baseline[phase][metric]:.2f}")
+
+        if (metrics["peak_memory_kb"] > baseline[phase]["peak_memory_kb"] * (1 + tolerance)):
+            regressions.append(f"{phase} peak_memory_kb: {metrics['peak_memory_kb']:.0f} vs baseline {baseline[phase]['peak_memory_kb']:.0f}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark template scanning against synthetic templates")
+    parser.add_argument("--resources", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4, help="Maximum property nesting depth")
+    parser.add_argument("--fan-in", type=int, default=8, help="Resources referencing each referenced resource")
+    parser.add_argument("--fan-out", type=int, default=2, help="Refs from each referencing resource")
+    parser.add_argument("--types", help="Resource type mix, e.g. AWS::S3::Bucket=3,AWS::EC2::Instance=1 (default: every type in the artifact)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline, as a fraction")
+    parser.add_argument("--template-out", help="Also write the generated template to this file")
+    args = parser.parse_args()
+
+    template = generate_template(args.resources, args.depth, args.fan_in, args.fan_out, parse_type_weights(args.types), args.seed)
+
+    if (args.template_out):
+        with open(args.template_out, "w") as file:
+            json.dump(template, file, indent=2)
+
+    results = run_benchmarks(template, args.iterations)
+    print(f"{'phase':<24}{'p50 ms':>10}{'p99 ms':>10}{'resources/s':>14}{'peak KiB':>12}")
+
+    for phase, metrics in results.items():
+        print(f"{phase:<24}{metrics['p50_ms']:>10.2f}{metrics['p99_ms']:>10.2f}{metrics['resources_per_second']:>14.0f}{metrics['peak_memory_kb']:>12.0f}")
+
+    # The baseline is only comparable for the same template, so the generator parameters are stored along with it
+    parameters = {"resources": args.resources, "depth": args.depth, "fan_in": args.fan_in, "fan_out": args.fan_out, "types": args.types, "seed": args.seed, "artifact": src.artifact.load_artifact().digest}
+
+    if (args.save_baseline):
+        with open(args.baseline, "w") as file:
+            json.dump({"parameters": parameters, "results": results}, file, indent=2)
+
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if (not os.path.exists(args.baseline)):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    if (baseline["parameters"] != parameters):
+        sys.exit(f"{args.baseline} was recorded with different parameters: {baseline['parameters']}")
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+
+    if (regressions):
+        sys.exit("Regressions over the baseline:\n  " + "\n  ".join(regressions))
+
+    print(f"No regressions over {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
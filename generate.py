@@ -1,22 +1,160 @@
 from __future__ import annotations
-from src.querybuilder import ResourceQueryGenerator, CapabilityQueryGenerator
-from gomboctypes.models import CfnResource, Capability
-import pickle
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from contextvars import copy_context
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import argparse
+import logging
+import sys
+import time
+from src.querybuilder import Query, ResourceQueryGenerator, CapabilityQueryGenerator
+from src.capability_index import CapabilityIndex
+from src.artifact import ARTIFACT_PATH, ArtifactError, CapabilityArtifact, write_artifact
+from src.offline_graph import OfflineGraph, write_graph_dump
+from src.resource_fingerprints import resource_fingerprints
+from gomboctypes.models import Capability
 
-capabilities_implementations = {resource.id:ResourceQueryGenerator.get_capabilities_implementations(resource.id) for resource in ResourceQueryGenerator(column_name="resource").asQuery("resource").parse_column_as_model("resource", CfnResource)}
-capabilities = []
+if (TYPE_CHECKING):
+    import networkx
 
-for capability in Capability.load_all():
-    parent_response = CapabilityQueryGenerator(id=capability.id).provides_capability(capability_column="dest_c").asQuery("last(collect(dest_c)) as result").parse_column_as_model("result", Capability)
+logger = logging.getLogger("generate")
 
-    if (len(parent_response)):
-        capabilities.append((capability, parent_response[0]))
-    
-    else:
-        capabilities.append((capability, None))
+def batches(items: List[str], batch_size: int) -> List[List[str]]:
+    return [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
 
-with open('implementations.pkl', "wb") as file:
-    pickle.dump(capabilities_implementations, file)
+def load_previous_artifact(path: str) -> Optional[CapabilityArtifact]:
+    try:
+        return CapabilityArtifact(path)
+    except (OSError, ArtifactError) as error:
+        logger.info(f"Not re-using {path}, regenerating every resource type: {error}")
+        return None
 
-with open('capabilities.pkl', 'wb') as file:
-    pickle.dump(capabilities, file)
\ No newline at end of file
+def implementation_key(implementation: Tuple[Capability, networkx.DiGraph]):
+    capability, graph = implementation
+    return (capability.id, tuple(sorted((source, target, data["label"].value) for source, target, data in graph.edges(data=True))), tuple(sorted((node, data["label"].value) for node, data in graph.nodes(data=True))))
+
+def cross_check(graph: OfflineGraph, batch_size: int) -> int:
+    # Runs the generation queries against both the dump and Neo4j, returns the number of differences found. Rows come
+    # back in no particular order from either, so implementations are compared as multisets.
+    differences = 0
+
+    def both(run):
+        with graph.activate():
+            offline = run()
+
+        return (offline, run())
+
+    offline_resources, online_resources = both(lambda: sorted(resource.id for resource in ResourceQueryGenerator.all_resources()))
+
+    if (offline_resources != online_resources):
+        differences += 1
+        logger.error(f"Resource types differ: {sorted(set(offline_resources) ^ set(online_resources))}")
+
+    for batch in batches(sorted(set(offline_resources) & set(online_resources)), batch_size):
+        offline_batch, online_batch = both(lambda: ResourceQueryGenerator.get_capabilities_implementations_batch(batch))
+
+        for resource_id in batch:
+            offline_keys = Counter(implementation_key(implementation) for implementation in offline_batch[resource_id])
+            online_keys = Counter(implementation_key(implementation) for implementation in online_batch[resource_id])
+
+            if (offline_keys != online_keys):
+                differences += 1
+                logger.error(f"{resource_id}: {sum((offline_keys - online_keys).values())} implementations only in the dump, {sum((online_keys - offline_keys).values())} only in Neo4j")
+
+    capability_ids = [capability.id for capability in CapabilityQueryGenerator.all_capabilities()]
+
+    for batch in batches(capability_ids, batch_size):
+        offline_ancestors, online_ancestors = both(lambda: CapabilityQueryGenerator.ancestor_capabilities(batch))
+
+        for capability_id in batch:
+            if ([ancestor.id for ancestor in offline_ancestors[capability_id]] != [ancestor.id for ancestor in online_ancestors[capability_id]]):
+                differences += 1
+                logger.error(f"{capability_id}: ancestor capabilities differ")
+
+    logger.info(f"Cross-checked {len(offline_resources)} resource types and {len(capability_ids)} capabilities against Neo4j: {differences} differences")
+    return differences
+
+def generate(args: argparse.Namespace):
+    started = time.perf_counter()
+
+    resource_ids = sorted(resource.id for resource in ResourceQueryGenerator.all_resources())
+    # Reading the whole graph for fingerprints is only worth it when they're compared or kept for a later run
+    fingerprints = resource_fingerprints(*Query.graph_content()) if args.incremental or args.write_fingerprints else {}
+    capability_indexes: Dict[str, CapabilityIndex] = {}
+    previous = load_previous_artifact(args.output) if args.incremental else None
+
+    if (previous):
+        for resource_id in resource_ids:
+            if (resource_id in previous.resource_types and fingerprints.get(resource_id) and previous.get_fingerprint(resource_id) == fingerprints[resource_id]):
+                capability_indexes[resource_id] = previous.get_capability_index(resource_id)
+
+        logger.info(f"Re-using {len(capability_indexes)} of {len(resource_ids)} resource types from {args.output}")
+
+    pending = [resource_id for resource_id in resource_ids if resource_id not in capability_indexes]
+
+    all_capabilities = CapabilityQueryGenerator.all_capabilities()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        # Submitted with the caller's context, which carries the active dump when there is one
+        ancestor_futures = [executor.submit(copy_context().run, CapabilityQueryGenerator.ancestor_capabilities, batch) for batch in batches([capability.id for capability in all_capabilities], args.batch_size)]
+
+        def query_batch(batch: List[str]):
+            batch_started = time.perf_counter()
+            return (ResourceQueryGenerator.get_capabilities_implementations_batch(batch), time.perf_counter() - batch_started)
+
+        # Implementations are compiled here as each batch comes back, while the other batches are still being queried
+        for future in as_completed([executor.submit(copy_context().run, query_batch, batch) for batch in batches(pending, args.batch_size)]):
+            implementations_by_resource, query_seconds = future.result()
+
+            for resource_id, implementations in implementations_by_resource.items():
+                compile_started = time.perf_counter()
+                capability_indexes[resource_id] = CapabilityIndex.compile(implementations)
+                logger.info(f"[{len(capability_indexes)}/{len(resource_ids)}] {resource_id}: {len(implementations)} implementations, queried in {query_seconds:.2f}s (batch of {len(implementations_by_resource)}), compiled in {time.perf_counter() - compile_started:.2f}s")
+
+        ancestors: Dict[str, List[Capability]] = {}
+
+        for future in ancestor_futures:
+            ancestors.update(future.result())
+
+    capabilities = []
+
+    # Full PROVIDES_CAPABILITY ancestor chain, nearest first, so the root capability is the last one
+    for capability in all_capabilities:
+        capabilities.append((capability, ancestors[capability.id]))
+
+    write_artifact(args.output, capabilities, capability_indexes, fingerprints)
+    logger.info(f"Wrote {args.output} with {len(capability_indexes)} resource types ({len(pending)} regenerated) in {time.perf_counter() - started:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the capability artifact from the Neo4j graph")
+    parser.add_argument("--workers", type=int, default=8, help="Queries running concurrently")
+    parser.add_argument("--batch-size", type=int, default=16, help="Resources or capabilities per query")
+    parser.add_argument("--incremental", action="store_true", help=f"Re-use resource types from the existing {ARTIFACT_PATH} whose part of the graph is unchanged")
+    parser.add_argument("--write-fingerprints", action="store_true", help="Record the fingerprint of each resource type's part of the graph, for later --incremental runs (always done with --incremental)")
+    parser.add_argument("--output", default=ARTIFACT_PATH)
+    parser.add_argument("--graph-dump", help="Read the graph from this apoc.export.json.all (or .csv) export instead of Neo4j")
+    parser.add_argument("--export-graph-dump", help="Export the Neo4j graph to this file, for --graph-dump, and exit")
+    parser.add_argument("--cross-check", action="store_true", help="Compare what --graph-dump and Neo4j return for every resource type and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if (args.export_graph_dump):
+        write_graph_dump(args.export_graph_dump, *Query.graph_content())
+        logger.info(f"Wrote {args.export_graph_dump}")
+        return
+
+    graph = OfflineGraph.load(args.graph_dump) if args.graph_dump else None
+
+    if (args.cross_check):
+        if (graph is None):
+            sys.exit("--cross-check needs --graph-dump")
+
+        sys.exit(1 if cross_check(graph, args.batch_size) else 0)
+
+    with (graph.activate() if graph else nullcontext()):
+        generate(args)
+
+if __name__ == "__main__":
+    main()
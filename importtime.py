@@ -0,0 +1,68 @@
+from __future__ import annotations
+from typing import Dict, Tuple
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Cold-start check for the Lambda image: imports app in a fresh interpreter with `python -X importtime`, fails when
+# the cumulative import time goes over budget or when a module that should only load on first use gets imported.
+# tests/test_importtime.py runs the same check with the unit tests.
+DEFAULT_BUDGET_MS = 1500
+DEFERRED_MODULES = ["neo4j", "networkx", "uvicorn"]
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def budget_ms() -> float:
+    return float(os.environ.get("IMPORT_TIME_BUDGET_MS", DEFAULT_BUDGET_MS))
+
+def import_times(module: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    # Self and cumulative import time, in microseconds, of every module imported along with module
+    environment = {**os.environ, "DATASOURCE": "pickle"}
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=environment, cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE, universal_newlines=True)
+
+    if (process.returncode != 0):
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr}")
+
+    self_us: Dict[str, int] = {}
+    cumulative_us: Dict[str, int] = {}
+
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+
+        if (match):
+            self_us[match.group(4)] = int(match.group(1))
+            cumulative_us[match.group(4)] = int(match.group(2))
+
+    return (self_us, cumulative_us)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how long importing the Lambda handler takes")
+    parser.add_argument("--budget-ms", type=float, default=budget_ms())
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    args = parser.parse_args()
+
+    try:
+        self_us, cumulative_us = import_times(args.module)
+    except RuntimeError as error:
+        sys.exit(str(error))
+
+    total_ms = cumulative_us[args.module] / 1000
+
+    for module in sorted(self_us, key=lambda module: self_us[module], reverse=True)[:args.top]:
+        print(f"{self_us[module] / 1000:8.1f} ms  {module}")
+
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    eagerly_imported = [module for module in DEFERRED_MODULES if module in cumulative_us]
+
+    if (eagerly_imported):
+        sys.exit(f"{', '.join(eagerly_imported)} should only be imported on first use")
+
+    if (total_ms > args.budget_ms):
+        sys.exit(f"import {args.module} took {total_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from typing import List
+import argparse
+import logging
+import os
+import sys
+import time
+from src.scan_index import ScanIndex, StackTemplate
+import src.settings
+
+logger = logging.getLogger("index_stacks")
+
+def read_stack_template(argument: str, account: str) -> StackTemplate:
+    # STACK_ID=PATH, or just PATH with the file name (without extension) as the stack id
+    stack_id, separator, path = argument.partition("=")
+
+    if (not separator):
+        path = argument
+        stack_id = os.path.splitext(os.path.basename(path))[0]
+
+    with open(path) as file:
+        return StackTemplate(stack_id=stack_id, account=account, template=file.read())
+
+def main():
+    parser = argparse.ArgumentParser(description="Add stack templates to the scan index queried by resourcesLackingCapability and capabilityCoverage")
+    parser.add_argument("templates", nargs="*", help="Template files, as PATH (stack id from the file name) or STACK_ID=PATH")
+    parser.add_argument("--account", help="Account the stacks belong to")
+    parser.add_argument("--index", default=src.settings.Settings().SCAN_INDEX_PATH)
+    parser.add_argument("--processes", type=int, help="Scan worker processes (default: SCAN_PROCESSES)")
+    parser.add_argument("--remove", nargs="*", default=[], metavar="STACK_ID", help="Stacks to drop from the index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    started = time.perf_counter()
+    scan_index = ScanIndex(args.index)
+
+    if (args.remove):
+        scan_index.remove(args.remove)
+        logger.info(f"Removed {len(args.remove)} stacks from {args.index}")
+
+    stacks: List[StackTemplate] = [read_stack_template(argument, args.account) for argument in args.templates]
+    result = scan_index.ingest(stacks, args.processes)
+
+    logger.info(f"Indexed {result.indexed} stacks into {args.index} ({result.unchanged} unchanged, {len(result.errors)} failed) in {time.perf_counter() - started:.2f}s")
+
+    # Stacks failing from earlier runs, not given this time, keep failing the run until they're fixed or removed
+    errors = scan_index.errors()
+
+    for stack_id, error in errors.items():
+        logger.error(f"{stack_id}: {error}")
+
+    if (errors):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
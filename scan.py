@@ -0,0 +1,236 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+import src.artifact
+from src.cfn_lint import scan_templates
+
+logger = logging.getLogger("scan")
+
+TEMPLATE_EXTENSIONS = (".json", ".yaml", ".yml", ".template")
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+# Exit codes: policy violations, and templates that couldn't be scanned (unless --allow-errors)
+EXIT_VIOLATIONS = 1
+EXIT_ERRORS = 2
+
+# Directories never searched for templates, besides hidden ones (.git, the default result cache, ...)
+SKIPPED_DIRECTORIES = frozenset(["node_modules", "__pycache__", "venv", "cdk.out"])
+
+def find_templates(arguments: List[str], excluded_directories: Tuple[str, ...] = ()) -> List[str]:
+    # Files as given, directories searched recursively for templates, anything else expanded as a glob
+    paths = set()
+    excluded = {os.path.realpath(directory) for directory in excluded_directories}
+
+    for argument in arguments:
+        if (os.path.isdir(argument)):
+            for directory, directory_names, names in os.walk(argument):
+                # Pruned in place, so os.walk doesn't descend into them
+                directory_names[:] = [name for name in directory_names if not name.startswith(".") and name not in SKIPPED_DIRECTORIES and os.path.realpath(os.path.join(directory, name)) not in excluded]
+                paths.update(os.path.join(directory, name) for name in names if name.endswith(TEMPLATE_EXTENSIONS))
+        elif (os.path.isfile(argument)):
+            paths.add(argument)
+        else:
+            paths.update(path for path in glob.glob(argument, recursive=True) if os.path.isfile(path))
+
+    return sorted(paths)
+
+class ResultCache():
+    # Scan results per template file, keyed by the file's content and the artifact, so unchanged templates in a repo
+    # aren't scanned again by the next CI run
+
+    def __init__(self, directory: Optional[str], artifact_digest: str):
+        self.directory = directory
+        self.artifact_digest = artifact_digest
+
+        if (self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, template_hash: str) -> str:
+        return hashlib.sha256(f"{self.artifact_digest}:{template_hash}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if (not self.directory):
+            return None
+
+        try:
+            with open(self._path(key)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        if (not self.directory):
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+            json.dump(result, file)
+
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+def parse_requirements(requirements: List[str]) -> List[Tuple[Optional[str], str]]:
+    # CAPABILITY_ID for every resource type supporting it, or RESOURCE_TYPE=CAPABILITY_ID
+    parsed = []
+
+    for requirement in requirements:
+        resource_type, separator, capability_id = requirement.rpartition("=")
+        parsed.append((resource_type if separator else None, capability_id))
+
+    return parsed
+
+def find_violations(result: Dict[str, Any], requirements: List[Tuple[Optional[str], str]]) -> List[Dict[str, str]]:
+    violations = []
+
+    for resource in result["resources"] or []:
+        for resource_type, capability_id in requirements:
+            if ((resource_type is None or resource_type == resource["type"]) and capability_id in resource["missing"]):
+                violations.append({"logical_name": resource["logical_name"], "type": resource["type"], "capability": capability_id})
+
+    return violations
+
+def scan(paths: List[str], processes: int, cache: ResultCache, artifact_path: str) -> List[Dict[str, Any]]:
+    templates: List[str] = []
+
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            templates.append(file.read())
+
+    keys = [cache.key(hashlib.sha256(template.encode("utf-8")).hexdigest()) for template in templates]
+    results: List[Optional[Dict[str, Any]]] = [cache.get(key) for key in keys]
+    pending = [position for position, result in enumerate(results) if result is None]
+    logger.info(f"Scanning {len(pending)} of {len(paths)} templates ({len(paths) - len(pending)} unchanged since cached)")
+
+    for position, template_scan in zip(pending, scan_templates([templates[position] for position in pending], processes, artifact_path)):
+        resources = None
+
+        if (template_scan.resources is not None):
+            resources = [{
+                "logical_name": logical_name,
+                "type": template_scan.resource_types[logical_name],
+                "implements": [capability.id for capability in capability_match.implements()],
+                "missing": [capability.id for _, capability in capability_match.not_implemented()]} for logical_name, capability_match in template_scan.resources]
+
+        results[position] = {"resources": resources, "error": template_scan.error}
+        cache.put(keys[position], results[position])
+
+    return [{"path": path, "cached": position not in pending, **result} for position, (path, result) in enumerate(zip(paths, results))]
+
+def logical_name_line(path: str, logical_name: str) -> Optional[int]:
+    # Line the resource is declared on, in JSON or YAML, for SARIF locations
+    try:
+        with open(path, encoding="utf-8") as file:
+            content = file.read()
+    except OSError:
+        return None
+
+    match = re.search(rf"^\s*[\"']?{re.escape(logical_name)}[\"']?\s*:", content, re.MULTILINE)
+    return content.count("\n", 0, match.start()) + 1 if match else None
+
+def to_sarif(results: List[Dict[str, Any]], requirements: List[Tuple[Optional[str], str]], artifact_path: str) -> Dict[str, Any]:
+    artifact = src.artifact.load_artifact(artifact_path)
+    rules = []
+
+    for capability_id in sorted({capability_id for _, capability_id in requirements}):
+        try:
+            title = artifact.get_capability(capability_id).title
+        except KeyError:
+            title = capability_id
+
+        rules.append({"id": capability_id, "name": title, "shortDescription": {"text": f"Resources must implement {title}"}})
+
+    sarif_results = []
+    notifications = []
+
+    for result in results:
+        if (result["error"] is not None):
+            notifications.append({"level": "error", "message": {"text": result["error"]}, "locations": [{"physicalLocation": {"artifactLocation": {"uri": result["path"]}}}]})
+
+        for violation in result["violations"]:
+            region = logical_name_line(result["path"], violation["logical_name"])
+            location: Dict[str, Any] = {"artifactLocation": {"uri": result["path"]}}
+
+            if (region is not None):
+                location["region"] = {"startLine": region}
+
+            sarif_results.append({
+                "ruleId": violation["capability"],
+                "level": "error",
+                "message": {"text": f"{violation['logical_name']} ({violation['type']}) doesn't implement {violation['capability']}"},
+                "locations": [{"physicalLocation": location, "logicalLocations": [{"name": violation["logical_name"], "kind": "resource"}]}]})
+
+    return {
+        "$schema": SARIF_SCHEMA,
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {"name": "gomboc-scanner", "rules": rules}},
+            "invocations": [{"executionSuccessful": not notifications, "toolExecutionNotifications": notifications}],
+            "results": sarif_results}]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan CloudFormation templates for the capabilities their resources implement")
+    parser.add_argument("paths", nargs="+", help="Template files, directories (searched recursively) or globs")
+    parser.add_argument("--format", choices=["jsonl", "sarif"], default="jsonl")
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Scan worker processes, 0 scans in this process")
+    parser.add_argument("--cache-dir", default=".scan_results", help="Results of templates scanned before, keyed by content and artifact")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--require", action="append", default=[], metavar="[RESOURCE_TYPE=]CAPABILITY_ID", help="Fail when a resource supporting the capability doesn't implement it")
+    parser.add_argument("--policy", help='JSON file of requirements, {"require": ["CAPABILITY_ID", "RESOURCE_TYPE=CAPABILITY_ID"]}')
+    parser.add_argument("--artifact", default=src.artifact.ARTIFACT_PATH, help="Capability artifact built by generate.py")
+    parser.add_argument("--allow-errors", action="store_true", help="Don't fail on templates that can't be scanned")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    started = time.perf_counter()
+    requirements = list(args.require)
+
+    if (args.policy):
+        with open(args.policy) as file:
+            requirements += json.load(file).get("require", [])
+
+    parsed_requirements = parse_requirements(requirements)
+    paths = find_templates(args.paths, () if args.no_cache else (args.cache_dir,))
+    cache = ResultCache(None if args.no_cache else args.cache_dir, src.artifact.load_artifact(args.artifact).digest)
+    results = scan(paths, args.processes, cache, args.artifact)
+
+    for result in results:
+        result["violations"] = find_violations(result, parsed_requirements)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+
+    try:
+        if (args.format == "sarif"):
+            json.dump(to_sarif(results, parsed_requirements, args.artifact), output, indent=2)
+            output.write("\n")
+        else:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+    finally:
+        if (output is not sys.stdout):
+            output.close()
+
+    errors = sum(1 for result in results if result["error"] is not None)
+    violations = sum(len(result["violations"]) for result in results)
+    logger.info(f"Scanned {len(results)} templates in {time.perf_counter() - started:.2f}s: {violations} policy violations, {errors} templates failed")
+
+    if (errors and not args.allow_errors):
+        sys.exit(EXIT_ERRORS)
+
+    if (violations):
+        sys.exit(EXIT_VIOLATIONS)
+
+if __name__ == "__main__":
+    main()
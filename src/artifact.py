@@ -0,0 +1,406 @@
+from __future__ import annotations
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+from gomboctypes.models import Capability
+from src.capability_index import CapabilityIndex, Edge, Node, PlanPropertySkeleton, PlanResourceSkeleton, PlanSkeleton
+
+# Capability data written by generate.py and memory-mapped at runtime. Layout, all integers little-endian u32:
+#
+#   header     magic, format version, schema fingerprint, sha256 digest of everything after the header,
+#              directory offset/length/crc32
+#   blocks     one for the capability table (with each capability's ancestors), one per resource type, 8-byte aligned
+#   directory  a block naming every resource type with the offset, length and crc32 of its block, and the graph
+#              fingerprint it was generated from
+#
+# A block is a string table followed by u32 arrays: string count, array count, string offsets, array lengths, the
+# UTF-8 string data padded to 4 bytes, then the arrays back to back. Arrays are read in place through memoryview, so
+# a resource type only costs memory once a template uses it.
+
+ARTIFACT_PATH = "capability_artifact.bin"
+FORMAT_VERSION = 3
+
+_MAGIC = b"GOMBOCSA"
+_HEADER = struct.Struct("<8sI32s32sIII")
+
+# Capability table block arrays. Ancestors follow PROVIDES_CAPABILITY outwards, so the last one is the root.
+_CAPABILITY_ANCESTOR_OFFSETS = 0
+_CAPABILITY_ANCESTORS = 1
+
+# Directory block arrays
+_DIRECTORY_CAPABILITIES = 0
+_DIRECTORY_OFFSETS = 1
+_DIRECTORY_LENGTHS = 2
+_DIRECTORY_CRCS = 3
+_DIRECTORY_FINGERPRINTS = 4
+
+# Resource type block arrays. Edges are stored CSR-style, sorted by source node, and an edge's id is its position.
+_NODE_FLAGS = 0
+_NODE_NAMES = 1
+_EDGE_OFFSETS = 2
+_EDGE_TARGETS = 3
+_CAPABILITY_IDS = 4
+_REQUIRED_OFFSETS = 5
+_REQUIRED_EDGES = 6
+_INVERTED_OFFSETS = 7
+_INVERTED_CAPABILITIES = 8
+_PLAN_OFFSETS = 9
+_PLAN_RESOURCE_TYPES = 10
+_PLAN_RESOURCE_FLAGS = 11
+_PLAN_RESOURCE_EDGE_OFFSETS = 12
+_PLAN_RESOURCE_EDGES = 13
+_PLAN_RESOURCE_PROPERTY_OFFSETS = 14
+_PLAN_PROPERTY_NAMES = 15
+_PLAN_PROPERTY_EDGE_OFFSETS = 16
+_PLAN_PROPERTY_EDGES = 17
+_PLAN_PROPERTY_USES_OFFSETS = 18
+_PLAN_PROPERTY_USES_EDGES = 19
+_PLAN_PROPERTY_USES_TARGETS = 20
+
+# Capability index of every resource type missing from the artifact
+_EMPTY_CAPABILITY_INDEX = CapabilityIndex.compile([])
+
+class ArtifactError(Exception):
+    pass
+
+def schema_fingerprint() -> bytes:
+    # Changes whenever the layout or the gomboctypes Capability model changes, so older artifacts get rejected
+    return hashlib.sha256(f"{FORMAT_VERSION}:{Capability.schema_json(sort_keys=True)}".encode("utf-8")).digest()
+
+class _BlockWriter():
+
+    def __init__(self):
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self._arrays: List[array] = []
+
+    def string(self, value: str) -> int:
+        if (value not in self._string_ids):
+            self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+
+        return self._string_ids[value]
+
+    def add_array(self, values: Sequence[int]):
+        self._arrays.append(array("I", values))
+
+    def add_offsets(self, lengths: Sequence[int]):
+        # Row offsets into arrays added after this one, with one more entry than there are rows
+        offsets = [0]
+
+        for length in lengths:
+            offsets.append(offsets[-1] + length)
+
+        self.add_array(offsets)
+
+    def add_ragged(self, rows: Sequence[Sequence[int]]):
+        self.add_offsets([len(row) for row in rows])
+        self.add_array([value for row in rows for value in row])
+
+    def to_bytes(self) -> bytes:
+        encoded_strings = [value.encode("utf-8") for value in self._strings]
+        string_offsets = [0]
+
+        for encoded in encoded_strings:
+            string_offsets.append(string_offsets[-1] + len(encoded))
+
+        string_data = b"".join(encoded_strings)
+        string_data += b"\0" * (-len(string_data) % 4)
+
+        integers = array("I", [len(self._strings), len(self._arrays)] + string_offsets + [len(values) for values in self._arrays])
+        arrays = [array("I", values) for values in self._arrays]
+
+        if (sys.byteorder == "big"):
+            for values in [integers] + arrays:
+                values.byteswap()
+
+        return integers.tobytes() + string_data + b"".join(values.tobytes() for values in arrays)
+
+class _Block():
+
+    def __init__(self, buffer: memoryview):
+        words = buffer[:8].cast("I")
+        string_count, array_count = words[0], words[1]
+        header = buffer[8:8 + 4 * (string_count + 1 + array_count)].cast("I")
+
+        self._buffer = buffer
+        self._string_offsets = header[:string_count + 1]
+        self._string_data_start = 8 + 4 * (string_count + 1 + array_count)
+        self._arrays: List[memoryview] = []
+
+        array_start = self._string_data_start + self._string_offsets[-1] + (-self._string_offsets[-1] % 4)
+
+        for length in header[string_count + 1:]:
+            self._arrays.append(buffer[array_start:array_start + 4 * length].cast("I"))
+            array_start += 4 * length
+
+        if (array_start > len(buffer)):
+            raise ArtifactError("Artifact block is truncated")
+
+    def string(self, index: int) -> str:
+        start = self._string_data_start + self._string_offsets[index]
+        end = self._string_data_start + self._string_offsets[index + 1]
+        return str(self._buffer[start:end], "utf-8")
+
+    def array(self, index: int) -> memoryview:
+        return self._arrays[index]
+
+    def row(self, offsets_index: int, row: int) -> memoryview:
+        offsets = self._arrays[offsets_index]
+        return self._arrays[offsets_index + 1][offsets[row]:offsets[row + 1]]
+
+def _resource_block(capability_index: CapabilityIndex) -> bytes:
+    block = _BlockWriter()
+
+    # Renumber edges into CSR order (grouped by source node) so an edge's id is its position in the targets array
+    nodes: List[Node] = sorted({node for edge in capability_index.edge_ids for node in edge}, key=lambda node: (node[1], node[0]))
+    node_ids = {node: position for position, node in enumerate(nodes)}
+    csr_edges = sorted(capability_index.edge_ids.items(), key=lambda item: (node_ids[item[0][0]], node_ids[item[0][1]]))
+    edge_ids = {edge_id: position for position, (_, edge_id) in enumerate(csr_edges)}
+    outgoing: List[List[int]] = [[] for _ in nodes]
+
+    for (source, target), _ in csr_edges:
+        outgoing[node_ids[source]].append(node_ids[target])
+
+    block.add_array([int(node[0]) for node in nodes])
+    block.add_array([block.string(node[1]) for node in nodes])
+    block.add_ragged(outgoing)
+    block.add_array([block.string(capability.id) for capability in capability_index.capabilities])
+    block.add_ragged([sorted(edge_ids[edge_id] for edge_id in required) for required in capability_index.required_edges])
+    block.add_ragged([sorted(capability_index.edge_capabilities.get(old_edge_id, ())) for _, old_edge_id in csr_edges])
+
+    plan_resources = [resource for plan in capability_index.plans for resource in plan]
+    plan_properties = [resource_property for resource in plan_resources for resource_property in resource.properties]
+
+    block.add_offsets([len(plan) for plan in capability_index.plans])
+    block.add_array([block.string(resource.type) for resource in plan_resources])
+    block.add_array([int(resource.is_template_resource) for resource in plan_resources])
+    block.add_ragged([sorted(edge_ids[edge_id] for edge_id in resource.edge_ids) for resource in plan_resources])
+    block.add_offsets([len(resource.properties) for resource in plan_resources])
+    block.add_array([block.string(resource_property.name) for resource_property in plan_properties])
+    block.add_ragged([sorted(edge_ids[edge_id] for edge_id in resource_property.edge_ids) for resource_property in plan_properties])
+    block.add_ragged([[edge_ids[edge_id] for edge_id, _ in resource_property.uses_other_resource] for resource_property in plan_properties])
+    block.add_array([block.string(target) for resource_property in plan_properties for _, target in resource_property.uses_other_resource])
+
+    return block.to_bytes()
+
+def _capabilities_block(capabilities: List[Tuple[Capability, List[Capability]]]) -> bytes:
+    block = _BlockWriter()
+    positions = {capability.id: position for position, (capability, _) in enumerate(capabilities)}
+
+    for capability, _ in capabilities:
+        block.string(capability.json())
+
+    block.add_ragged([[positions[ancestor.id] for ancestor in ancestors] for _, ancestors in capabilities])
+    return block.to_bytes()
+
+def write_artifact(path: str, capabilities: List[Tuple[Capability, List[Capability]]], capability_indexes: Dict[str, CapabilityIndex], fingerprints: Optional[Dict[str, str]] = None):
+    # Capabilities only referenced by implementations or as ancestors still need a record, so they can be resolved
+    capabilities = list(capabilities)
+    known_ids = {capability.id for capability, _ in capabilities}
+
+    for capability_index in capability_indexes.values():
+        for capability in capability_index.capabilities:
+            if (capability.id not in known_ids):
+                known_ids.add(capability.id)
+                capabilities.append((capability, []))
+
+    for _, ancestors in list(capabilities):
+        for ancestor in ancestors:
+            if (ancestor.id not in known_ids):
+                known_ids.add(ancestor.id)
+                capabilities.append((ancestor, []))
+
+    blocks = [_capabilities_block(capabilities)] + [_resource_block(capability_indexes[resource_type]) for resource_type in sorted(capability_indexes)]
+    offsets: List[int] = []
+    body = b""
+
+    for block in blocks:
+        body += b"\0" * (-(_HEADER.size + len(body)) % 8)
+        offsets.append(_HEADER.size + len(body))
+        body += block
+
+    body += b"\0" * (-(_HEADER.size + len(body)) % 8)
+    directory = _BlockWriter()
+
+    for resource_type in sorted(capability_indexes):
+        directory.string(resource_type)
+
+    directory.add_array([offsets[0], len(blocks[0]), zlib.crc32(blocks[0])])
+    directory.add_array(offsets[1:])
+    directory.add_array([len(block) for block in blocks[1:]])
+    directory.add_array([zlib.crc32(block) for block in blocks[1:]])
+    directory.add_array([directory.string((fingerprints or {}).get(resource_type, "")) for resource_type in sorted(capability_indexes)])
+    directory_bytes = directory.to_bytes()
+
+    header = _HEADER.pack(_MAGIC, FORMAT_VERSION, schema_fingerprint(), hashlib.sha256(body + directory_bytes).digest(), _HEADER.size + len(body), len(directory_bytes), zlib.crc32(directory_bytes))
+
+    # Written aside then renamed, so processes with the previous artifact mapped keep a consistent file
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(header + body + directory_bytes)
+
+    os.replace(f"{path}.tmp", path)
+
+class CapabilityArtifact():
+
+    def __init__(self, path: str):
+        if (sys.byteorder == "big"):
+            raise ArtifactError("Capability artifacts can only be memory-mapped on little-endian hosts")
+
+        with open(path, "rb") as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ArtifactError(f"{path} is empty")
+
+        self._buffer = memoryview(self._mmap)
+
+        if (len(self._buffer) < _HEADER.size):
+            raise ArtifactError(f"{path} is too short to be a capability artifact")
+
+        magic, format_version, fingerprint, digest, directory_offset, directory_length, directory_crc = _HEADER.unpack_from(self._buffer)
+
+        if (magic != _MAGIC):
+            raise ArtifactError(f"{path} is not a capability artifact")
+        if (format_version != FORMAT_VERSION):
+            raise ArtifactError(f"{path} has format version {format_version}, expected {FORMAT_VERSION}. Re-run generate.py")
+        if (fingerprint != schema_fingerprint()):
+            raise ArtifactError(f"{path} was generated against a different Capability schema. Re-run generate.py")
+        if (directory_offset + directory_length > len(self._buffer) or zlib.crc32(self._buffer[directory_offset:directory_offset + directory_length]) != directory_crc):
+            raise ArtifactError(f"{path} is truncated or corrupt")
+
+        self.path = path
+        self.digest = digest.hex()
+        self._digest_verified = False
+        directory = _Block(self._buffer[directory_offset:directory_offset + directory_length])
+        self._capabilities_location = tuple(directory.array(_DIRECTORY_CAPABILITIES))
+        self._resource_locations = {directory.string(position): (offset, length, crc) for position, (offset, length, crc) in enumerate(zip(directory.array(_DIRECTORY_OFFSETS), directory.array(_DIRECTORY_LENGTHS), directory.array(_DIRECTORY_CRCS)))}
+        self._fingerprints = {resource_type: directory.string(fingerprint) for resource_type, fingerprint in zip(self._resource_locations, directory.array(_DIRECTORY_FINGERPRINTS))}
+        self._capabilities: Optional[List[Tuple[Capability, Optional[Capability]]]] = None
+        self._capabilities_by_id: Dict[str, Capability] = {}
+        self._ancestors_by_id: Dict[str, List[Capability]] = {}
+        self._capability_indexes: Dict[str, CapabilityIndex] = {}
+
+    @property
+    def resource_types(self) -> List[str]:
+        return list(self._resource_locations.keys())
+
+    def get_fingerprint(self, resource_type: str) -> Optional[str]:
+        # Fingerprint of the graph the resource type's implementations were generated from, if generate.py recorded one
+        return self._fingerprints.get(resource_type) or None
+
+    def _read_block(self, offset: int, length: int, crc: int) -> _Block:
+        # The digest is checked once, before the first block is used, rather than when mapping the file
+        if (not self._digest_verified):
+            if (hashlib.sha256(self._buffer[_HEADER.size:]).hexdigest() != self.digest):
+                raise ArtifactError(f"{self.path} doesn't match its digest, it's truncated or corrupt")
+
+            self._digest_verified = True
+
+        buffer = self._buffer[offset:offset + length]
+
+        if (offset + length > len(self._buffer) or zlib.crc32(buffer) != crc):
+            raise ArtifactError(f"{self.path} is truncated or corrupt")
+
+        return _Block(buffer)
+
+    def capabilities(self) -> List[Tuple[Capability, Optional[Capability]]]:
+        # Every capability with its root capability, if it provides one
+        if (self._capabilities is None):
+            block = self._read_block(*self._capabilities_location)
+            ancestor_offsets = block.array(_CAPABILITY_ANCESTOR_OFFSETS)
+            parsed = [Capability.parse_raw(block.string(position)) for position in range(len(ancestor_offsets) - 1)]
+
+            self._capabilities_by_id = {capability.id: capability for capability in parsed}
+            self._ancestors_by_id = {capability.id: [parsed[ancestor] for ancestor in block.row(_CAPABILITY_ANCESTOR_OFFSETS, position)] for position, capability in enumerate(parsed)}
+            self._capabilities = [(capability, self._ancestors_by_id[capability.id][-1] if self._ancestors_by_id[capability.id] else None) for capability in parsed]
+
+        return self._capabilities
+
+    def get_capability(self, id: str) -> Capability:
+        self.capabilities()
+        return self._capabilities_by_id[id]
+
+    def get_ancestor_capabilities(self, id: str) -> List[Capability]:
+        self.capabilities()
+        return self._ancestors_by_id[id]
+
+    def get_root_capability(self, id: str) -> Optional[Capability]:
+        ancestors = self.get_ancestor_capabilities(id)
+        return ancestors[-1] if ancestors else None
+
+    def get_capability_index(self, resource_type: str) -> CapabilityIndex:
+        # Only the resource types templates actually use are turned into Python objects
+        if (resource_type not in self._capability_indexes):
+            # Types the graph doesn't know (Custom::*, newer AWS types) support no capabilities, as they did when Neo4j
+            # was queried directly. They all share one index, kept out of the dict so templates full of made-up types
+            # don't grow it.
+            if (resource_type not in self._resource_locations):
+                return _EMPTY_CAPABILITY_INDEX
+
+            self.capabilities()
+            block = self._read_block(*self._resource_locations[resource_type])
+            self._capability_indexes[resource_type] = self._materialize(block)
+
+        return self._capability_indexes[resource_type]
+
+    def _materialize(self, block: _Block) -> CapabilityIndex:
+        strings: Dict[int, str] = {}
+
+        def string(index: int) -> str:
+            if (index not in strings):
+                strings[index] = block.string(index)
+            return strings[index]
+
+        nodes: List[Node] = [(bool(flag), string(name)) for flag, name in zip(block.array(_NODE_FLAGS), block.array(_NODE_NAMES))]
+        edge_offsets = block.array(_EDGE_OFFSETS)
+        edge_targets = block.array(_EDGE_TARGETS)
+        edge_ids: Dict[Edge, int] = {}
+
+        for source in range(len(nodes)):
+            for edge_id in range(edge_offsets[source], edge_offsets[source + 1]):
+                edge_ids[(nodes[source], nodes[edge_targets[edge_id]])] = edge_id
+
+        capability_ids = block.array(_CAPABILITY_IDS)
+        capabilities = [self._capabilities_by_id[string(capability_id)] for capability_id in capability_ids]
+        required_edges = [frozenset(block.row(_REQUIRED_OFFSETS, position)) for position in range(len(capabilities))]
+        edge_capabilities = {edge_id: tuple(block.row(_INVERTED_OFFSETS, edge_id)) for edge_id in range(len(edge_targets)) if block.row(_INVERTED_OFFSETS, edge_id)}
+
+        plan_offsets = block.array(_PLAN_OFFSETS)
+        property_offsets = block.array(_PLAN_RESOURCE_PROPERTY_OFFSETS)
+        uses_targets = block.array(_PLAN_PROPERTY_USES_TARGETS)
+        uses_offsets = block.array(_PLAN_PROPERTY_USES_OFFSETS)
+        plans: List[PlanSkeleton] = []
+
+        for position in range(len(capabilities)):
+            resources: List[PlanResourceSkeleton] = []
+
+            for resource in range(plan_offsets[position], plan_offsets[position + 1]):
+                properties = tuple(PlanPropertySkeleton(
+                    name=string(block.array(_PLAN_PROPERTY_NAMES)[resource_property]),
+                    edge_ids=frozenset(block.row(_PLAN_PROPERTY_EDGE_OFFSETS, resource_property)),
+                    uses_other_resource=tuple((edge_id, string(uses_targets[uses_offsets[resource_property] + use])) for use, edge_id in enumerate(block.row(_PLAN_PROPERTY_USES_OFFSETS, resource_property))))
+                    for resource_property in range(property_offsets[resource], property_offsets[resource + 1]))
+
+                resources.append(PlanResourceSkeleton(
+                    type=string(block.array(_PLAN_RESOURCE_TYPES)[resource]),
+                    is_template_resource=bool(block.array(_PLAN_RESOURCE_FLAGS)[resource]),
+                    edge_ids=frozenset(block.row(_PLAN_RESOURCE_EDGE_OFFSETS, resource)),
+                    properties=properties))
+
+            plans.append(tuple(resources))
+
+        return CapabilityIndex(capabilities=capabilities, edge_ids=edge_ids, required_edges=required_edges, edge_capabilities=edge_capabilities, plans=plans)
+
+def load_artifact(path: str = ARTIFACT_PATH) -> CapabilityArtifact:
+    return _load_artifact(path)
+
+@lru_cache(maxsize=None)
+def _load_artifact(path: str) -> CapabilityArtifact:
+    return CapabilityArtifact(path)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from itertools import chain
+from typing import TYPE_CHECKING, AbstractSet, Dict, FrozenSet, List, NamedTuple, Tuple
+from gomboctypes.models import Capability, EdgeLabels, NodeLabels
+import src.implementation_plan
+import src.metrics
+
+# Only generate.py compiles indexes from graphs, scanning templates doesn't need networkx
+if (TYPE_CHECKING):
+    import networkx
+
+Node = Tuple[bool, str]
+Edge = Tuple[Node, Node]
+
+# Template-independent parts of an implementation plan. Each node keeps the ids of the implementation graph edges
+# touching it: it's left out of the plan when all of them are already present in the template.
+class PlanPropertySkeleton(NamedTuple):
+    name: str
+    edge_ids: FrozenSet[int]
+    uses_other_resource: Tuple[Tuple[int, str], ...]
+
+class PlanResourceSkeleton(NamedTuple):
+    type: str
+    is_template_resource: bool
+    edge_ids: FrozenSet[int]
+    properties: Tuple[PlanPropertySkeleton, ...]
+
+PlanSkeleton = Tuple[PlanResourceSkeleton, ...]
+
+# Compiled form of one resource type's implementations, emitted by generate.py. Every implementation edge is interned
+# to an integer id, each capability position keeps the frozenset of edge ids it requires, and an inverted index maps
+# each edge id to the positions requiring it, so matching only touches the edges a template actually contains.
+class CapabilityIndex():
+
+    def __init__(self, capabilities: List[Capability], edge_ids: Dict[Edge, int], required_edges: List[FrozenSet[int]], edge_capabilities: Dict[int, Tuple[int, ...]], plans: List[PlanSkeleton]):
+        self.capabilities = capabilities
+        self.edge_ids = edge_ids
+        self.required_edges = required_edges
+        self.edge_capabilities = edge_capabilities
+        self.plans = plans
+
+    @staticmethod
+    def compile(implementations: List[Tuple[Capability, networkx.DiGraph]]) -> CapabilityIndex:
+        edge_ids: Dict[Edge, int] = {}
+        required_edges: List[FrozenSet[int]] = []
+        edge_capabilities: Dict[int, List[int]] = {}
+        plans: List[PlanSkeleton] = []
+
+        for position, (_, implementation_graph) in enumerate(implementations):
+            required = frozenset(edge_ids.setdefault(edge, len(edge_ids)) for edge in implementation_graph.edges)
+            required_edges.append(required)
+            plans.append(CapabilityIndex._compile_plan(implementation_graph, edge_ids))
+
+            for edge_id in required:
+                edge_capabilities.setdefault(edge_id, []).append(position)
+
+        return CapabilityIndex(
+            capabilities=[capability for capability, _ in implementations],
+            edge_ids=edge_ids,
+            required_edges=required_edges,
+            edge_capabilities={edge_id: tuple(positions) for edge_id, positions in edge_capabilities.items()},
+            plans=plans)
+
+    @staticmethod
+    def _compile_plan(implementation_graph: networkx.DiGraph, edge_ids: Dict[Edge, int]) -> PlanSkeleton:
+        # Only needed when generate.py compiles an index, importing it here keeps networkx out of the service's cold
+        # start (checked by importtime.py)
+        import networkx
+        resources: List[PlanResourceSkeleton] = []
+
+        def incident_edge_ids(node: Node):
+            return frozenset(edge_ids[edge] for edge in chain(implementation_graph.in_edges(node), implementation_graph.out_edges(node)))
+
+        for resource_tuple in [node for node in networkx.topological_sort(implementation_graph.reverse()) if implementation_graph.nodes[node]["label"] == NodeLabels.CFN_RESOURCE]:
+            resource_properties: List[PlanPropertySkeleton] = []
+            current_resource_properties_tuples = [node_tuple for node_tuple in implementation_graph.nodes if implementation_graph.nodes[node_tuple]["label"] == NodeLabels.CFN_PROPERTY and node_tuple[1].split("-")[0] == resource_tuple[1]]
+
+            for property_tuple in sorted(current_resource_properties_tuples, key=lambda x: x[1]):
+                uses_other_resources = tuple((edge_ids[edge], edge[1][1]) for edge in implementation_graph.out_edges(property_tuple) if implementation_graph.edges[edge]["label"] == EdgeLabels.USES_OTHER_RESOURCE_TO)
+                property_name = property_tuple[1].replace(f"{resource_tuple[1]}-", "")
+                resource_properties.append(PlanPropertySkeleton(name=property_name, edge_ids=incident_edge_ids(property_tuple), uses_other_resource=uses_other_resources))
+
+            resources.append(PlanResourceSkeleton(type=resource_tuple[1], is_template_resource=resource_tuple[0], edge_ids=incident_edge_ids(resource_tuple), properties=tuple(resource_properties)))
+
+        return tuple(resources)
+
+    def present_edge_ids(self, resource_edges: AbstractSet[Edge]) -> FrozenSet[int]:
+        # Walk whichever side is smaller: the template's edges, or the edges this index knows about
+        if (len(resource_edges) < len(self.edge_ids)):
+            return frozenset(self.edge_ids[edge] for edge in resource_edges if edge in self.edge_ids)
+        else:
+            return frozenset(edge_id for edge, edge_id in self.edge_ids.items() if edge in resource_edges)
+
+    def match(self, present_edge_ids: FrozenSet[int]) -> List[bool]:
+        hits = [0] * len(self.capabilities)
+
+        for edge_id in present_edge_ids:
+            for position in self.edge_capabilities.get(edge_id, ()):
+                hits[position] += 1
+
+        return [hits[position] == len(required) for position, required in enumerate(self.required_edges)]
+
+    def implementation_plan(self, position: int, present_edge_ids: FrozenSet[int]) -> src.implementation_plan.ImplementationPlan:
+        resources: List[src.implementation_plan.Resource] = []
+
+        # Nodes whose edges are all in the template already don't need any change
+        for resource in self.plans[position]:
+            if (resource.edge_ids <= present_edge_ids):
+                continue
+
+            resource_properties: List[src.implementation_plan.ResourceProperty] = []
+
+            for resource_property in resource.properties:
+                if (resource_property.edge_ids <= present_edge_ids):
+                    continue
+
+                uses_other_resources = [target for edge_id, target in resource_property.uses_other_resource if edge_id not in present_edge_ids]
+
+                if (uses_other_resources):
+                    resource_properties.append(src.implementation_plan.ResourceProperty(name=resource_property.name, value=f"ARN of {{{uses_other_resources[0]}}}"))
+                else:
+                    resource_properties.append(src.implementation_plan.ResourceProperty(name=resource_property.name, value=f"CONFIGURE APPROPRIATELY"))
+
+            # Set the label depending whether it's an existing resource
+            resource_action = src.implementation_plan.Action.ADD_PROPERTIES if resource.is_template_resource else src.implementation_plan.Action.NEW_RESOURCE
+            resources.append(src.implementation_plan.Resource(type=resource.type, action=resource_action, properties=resource_properties))
+
+        return src.implementation_plan.ImplementationPlan(resources=resources)
+
+# Outcome of matching one resource against its type's CapabilityIndex, with implementation plans built on demand
+class CapabilityMatch():
+
+    def __init__(self, capability_index: CapabilityIndex, present_edge_ids: FrozenSet[int]):
+        self.capability_index = capability_index
+        self.present_edge_ids = present_edge_ids
+        self.is_implemented = capability_index.match(present_edge_ids)
+        self._implementation_plans: Dict[int, src.implementation_plan.ImplementationPlan] = {}
+
+    def implements(self) -> List[Capability]:
+        return [capability for capability, is_implemented in zip(self.capability_index.capabilities, self.is_implemented) if is_implemented]
+
+    def not_implemented(self) -> List[Tuple[int, Capability]]:
+        return [(position, capability) for position, (capability, is_implemented) in enumerate(zip(self.capability_index.capabilities, self.is_implemented)) if not is_implemented]
+
+    def implementation_plan(self, position: int) -> src.implementation_plan.ImplementationPlan:
+        if (position not in self._implementation_plans):
+            with src.metrics.phase("implementation_plans"):
+                self._implementation_plans[position] = self.capability_index.implementation_plan(position, self.present_edge_ids)
+
+            src.metrics.count("plans_built")
+
+        return self._implementation_plans[position]
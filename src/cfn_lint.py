@@ -1,24 +1,49 @@
 from __future__ import annotations
 from pydantic import BaseModel, Field
-from typing import Dict, Optional, List, Union, Any, Tuple
-import networkx
-from gomboctypes.models import Capability, EdgeLabels, NodeLabels
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, List, Set, Union, Any, Tuple
+import logging
+from gomboctypes.models import Capability, EdgeLabels
 
-import pickle
 import src.implementation_plan
+import src.artifact
+import src.metrics
+import src.scan_cache
+import src.settings
+import src.template_loader
+from src.capability_index import CapabilityMatch
+from src.template_graph import ResourceGraphView, TemplateGraph
 
-cloudformation_intrisic_functions = [
-    "AWS::Region"
-]
+logger = logging.getLogger(__name__)
 
-with open("implementations.pkl", "rb") as file:
-    implementations: Dict[str, List[Tuple[Capability, networkx.DiGraph]]] = pickle.load(file)
+# Pseudo parameters are valid Ref targets that aren't logical resources
+cloudformation_intrisic_functions = frozenset([
+    "AWS::AccountId",
+    "AWS::NotificationARNs",
+    "AWS::NoValue",
+    "AWS::Partition",
+    "AWS::Region",
+    "AWS::StackId",
+    "AWS::StackName",
+    "AWS::URLSuffix"
+])
 
-CfnTemplate_Resource_Properties_Type = Union[str, Dict[str, Any], List[Dict[str, Any]]]
+# Longest chain of resources referencing each other ({"Ref": ...} inside {"Ref": ...}) that gets expanded
+MAX_REF_DEPTH = 32
+
+CfnTemplate_Resource_Properties_Type = Union[str, int, float, Dict[str, Any], List[Any]]
+
+# Property graph edge relative to the node it's expanded under: (True, suffix) nodes get the ancestor node name
+# prepended, (False, resource_type) nodes stand for a referenced resource and are used as-is.
+RelativeEdge = Tuple[Tuple[bool, str], Tuple[bool, str], Optional[EdgeLabels]]
 
 class CfnTemplate_Resource_Entry(BaseModel):
     Type: str = Field(...)
-    Properties: Dict[str, CfnTemplate_Resource_Properties_Type] = Field(...)
+    # A plain dict is passed through by pydantic as parsed, without walking it; property values are only checked when
+    # the property graph is built
+    Properties: dict = Field(...)
 
 class CfnTemplate(BaseModel):
     AWSTemplateFormatVersion: Optional[str]
@@ -27,85 +52,297 @@ class CfnTemplate(BaseModel):
     Resources: Dict[str, CfnTemplate_Resource_Entry] = Field(...)
     Outputs: Optional[Dict[str, Dict]]
 
+    # Per-template caches, set through object.__setattr__ so they stay out of the pydantic fields
+    __slots__ = ("_ref_expansions", "_non_resource_refs", "_graph")
+
+    @classmethod
+    def parse_raw(cls, template: Union[str, bytes]) -> CfnTemplate:
+        # JSON or YAML, short-form intrinsics included
+        with src.metrics.phase("parse"):
+            return cls.parse_obj(src.template_loader.load_template(template))
+
     def get_resource_internal_capabilities(self, resource_logical_name: str):
-        implements: List[Capability] = []
+        capability_match = self.match_resource_capabilities(resource_logical_name)
         does_not_implement: List[Tuple[Capability, src.implementation_plan.ImplementationPlan]] = []
-        resource_type = self.Resources[resource_logical_name].Type
-        current_resource_graph = networkx.DiGraph()
-        current_resource_graph.add_node((True, resource_type))
 
+        # If does not implement the capability, return the actual delta to implement
+        for position, capability in capability_match.not_implemented():
+            does_not_implement.append((capability, capability_match.implementation_plan(position)))
+
+        return((capability_match.implements(), does_not_implement))
+
+    def match_resource_capabilities(self, resource_logical_name: str, artifact_path: str = src.artifact.ARTIFACT_PATH) -> CapabilityMatch:
+        # Same as get_resource_internal_capabilities, but leaves building implementation plans to the caller
         if (resource_logical_name not in self.Resources):
             raise ValueError(f"Resource {resource_logical_name} doesn't exist in template")
 
-        for property_name, property_value in self.Resources[resource_logical_name].Properties.items():
-            self._recursively_add_property(current_resource_graph, resource_type, property_name, property_value)
-        
-        for capability, implementation_graph in implementations[resource_type]:
-            edges_not_implemented = [edge for edge in implementation_graph.edges if not current_resource_graph.has_edge(edge[0], edge[1])]
-            
-            # If implements capability, return it.
-            if (not edges_not_implemented):
-                implements.append(capability)
-
-            # If does not implement the capability, return the actual delta to implement
-            else:
-                does_not_implement.append((capability, self.generate_implementation_plan(current_resource_graph, implementation_graph)))
+        resource_type = self.Resources[resource_logical_name].Type
+        src.metrics.count("resources")
+
+        artifact = src.artifact.load_artifact(artifact_path)
+        capability_index = artifact.get_capability_index(resource_type)
+
+        # Resources identical to one scanned before, against the same artifact, skip Ref expansion and building their
+        # graph. The key is the resource as written, so it's computed before either.
+        scan_cache = src.scan_cache.get_scan_cache()
+        cache_key = scan_cache.key(artifact.digest, self.resource_content(resource_logical_name))
+        capability_match = scan_cache.get(cache_key, capability_index)
+
+        if (capability_match is None):
+            resource_graph = self.resource_graph(resource_logical_name)
+            src.metrics.count("edges", len(resource_graph))
+
+            with src.metrics.phase("capability_matching"):
+                capability_match = CapabilityMatch(capability_index, capability_index.present_edge_ids(resource_graph))
+
+            src.metrics.count("capabilities_checked", len(capability_index.capabilities))
+            src.metrics.count("scan_cache_misses")
+            scan_cache.put(cache_key, capability_match)
+        else:
+            src.metrics.count("scan_cache_hits")
+
+        return capability_match
 
-        return((implements, does_not_implement))
+    def resource_graph(self, resource_logical_name: str) -> ResourceGraphView:
+        # Property graph of one resource, out of the graph shared by every resource of this template
+        if (not hasattr(self, "_graph")):
+            object.__setattr__(self, "_graph", TemplateGraph())
 
-    def _recursively_add_property(self, graph: networkx.DiGraph, ancestor_node_name: str, property_name: str, property_value: CfnTemplate_Resource_Properties_Type):
-        if isinstance(property_value, str):
-            graph.add_edge((True, ancestor_node_name), (True, f"{ancestor_node_name}-{property_name}"))
+        resource_graph = self._graph.resource(resource_logical_name)
 
-        elif isinstance(property_value, int):
-            graph.add_edge((True, ancestor_node_name), (True, f"{ancestor_node_name}-{property_name}"))
+        if (resource_graph is None):
+            resource_type = self.Resources[resource_logical_name].Type
+            edges: List[RelativeEdge] = []
+
+            with src.metrics.phase("property_graph"):
+                for property_name, property_value in self.Resources[resource_logical_name].Properties.items():
+                    self._add_relative_property_edges(edges, "", property_name, property_value, ())
+
+                self._graph.add_resource(resource_logical_name, [((True, f"{resource_type}{source[1]}"), (True, f"{resource_type}{target[1]}") if target[0] else target) for source, target, _ in edges])
+            resource_graph = self._graph.resource(resource_logical_name)
+
+        return resource_graph
+
+    def _add_relative_property_edges(self, edges: List[RelativeEdge], ancestor_suffix: str, property_name: str, property_value: CfnTemplate_Resource_Properties_Type, ref_stack: Tuple[str, ...]) -> int:
+        # Returns the depth of the deepest Ref chain expanded below this property
+        node_suffix = f"{ancestor_suffix}-{property_name}"
+        ref_depth = 0
+
+        if isinstance(property_value, (str, int, float)):
+            edges.append(((True, ancestor_suffix), (True, node_suffix), None))
 
         elif isinstance(property_value, list):
             for subproperty_value in property_value:
-                self._recursively_add_property(graph, f"{ancestor_node_name}", property_name, subproperty_value)
+                ref_depth = max(ref_depth, self._add_relative_property_edges(edges, ancestor_suffix, property_name, subproperty_value, ref_stack))
 
         elif isinstance(property_value, dict):
+            referenced_logical_name = self._get_referenced_resource(property_value)
 
             # If the entry is a CloudFormation reference i.e. {"Ref": "ResourceName"} to a logical resource (NOT parameter or intrisic function)
-            if (list(map(lambda x: x.lower(), property_value.keys())) == ["ref"] and list(property_value.values())[0] not in list(self.Parameters.keys()) + cloudformation_intrisic_functions):
-                referenced_resource = self.Resources[list(property_value.values())[0]]
-                
-                graph.add_edge((True, ancestor_node_name), (True, f"{ancestor_node_name}-{property_name}"))
-                graph.add_edge((True, f"{ancestor_node_name}-{property_name}"), (False, referenced_resource.Type))
+            if (referenced_logical_name is not None):
+                referenced_edges, ref_depth = self._expand_referenced_resource(referenced_logical_name, ref_stack)
+
+                edges.append(((True, ancestor_suffix), (True, node_suffix), None))
+                edges.append(((True, node_suffix), (False, self.Resources[referenced_logical_name].Type), None))
 
-                for subproperty_name, subproperty_value in referenced_resource.Properties.items():
-                    self._recursively_add_property(graph, f"{ancestor_node_name}-{property_name}", subproperty_name, subproperty_value)
+                for source, target, label in referenced_edges:
+                    edges.append(((True, f"{node_suffix}{source[1]}"), (True, f"{node_suffix}{target[1]}") if target[0] else target, label))
 
             else:
-                graph.add_edge((True, ancestor_node_name), (True, f"{ancestor_node_name}-{property_name}"), label=EdgeLabels.HAS_SUBPROPERTY)
+                edges.append(((True, ancestor_suffix), (True, node_suffix), EdgeLabels.HAS_SUBPROPERTY))
                 for subproperty_name, subproperty_value in property_value.items():
-                    self._recursively_add_property(graph, f"{ancestor_node_name}-{property_name}", subproperty_name, subproperty_value)
+                    ref_depth = max(ref_depth, self._add_relative_property_edges(edges, node_suffix, subproperty_name, subproperty_value, ref_stack))
 
         else:
-            raise Exception(f"Unkonwn type {str(type(property_value))} for property {ancestor_node_name}-{property_name}")
+            raise Exception(f"Unkonwn type {str(type(property_value))} for property {node_suffix}")
+
+        return ref_depth
+
+    def _expand_referenced_resource(self, logical_name: str, ref_stack: Tuple[str, ...]) -> Tuple[List[RelativeEdge], int]:
+        # Each referenced resource is walked once per template, then re-used under every prefix referencing it
+        if (not hasattr(self, "_ref_expansions")):
+            object.__setattr__(self, "_ref_expansions", {})
 
-    def generate_implementation_plan(self, current_resource_graph: networkx.Graph, implementation_graph: networkx.DiGraph):
-        implementation_delta = implementation_graph.copy().to_directed()
-        implementation_delta.remove_edges_from(current_resource_graph)
-        implementation_delta.remove_nodes_from(list(networkx.isolates(implementation_delta)))        
+        if (logical_name in ref_stack):
+            raise ValueError(f"Circular Ref between resources: {' -> '.join(ref_stack + (logical_name,))}")
 
-        resources: List[src.implementation_plan.Resource] = []
+        # Depth of an uncached expansion is only known once it's walked, so check it against the minimum of 1 first
+        edges, ref_depth = self._ref_expansions.get(logical_name, (None, 1))
 
-        for resource_tuple in [node for node in networkx.topological_sort(implementation_delta.reverse()) if implementation_delta.nodes[node]["label"] == NodeLabels.CFN_RESOURCE]:
-            resource_properties = []
-            current_resource_properties_tuples = [node_tuple for node_tuple in implementation_delta.nodes if implementation_delta.nodes[node_tuple]["label"] == NodeLabels.CFN_PROPERTY and node_tuple[1].split("-")[0] == resource_tuple[1]]
+        if (len(ref_stack) + ref_depth > MAX_REF_DEPTH):
+            raise ValueError(f"Ref chain {' -> '.join(ref_stack + (logical_name,))} is deeper than {MAX_REF_DEPTH} resources")
 
-            for property_tuple in sorted(current_resource_properties_tuples, key=lambda x: x[1]):
-                uses_other_resources = [edge[1][1] for edge in implementation_delta.out_edges(property_tuple) if implementation_delta.edges[edge]["label"] == EdgeLabels.USES_OTHER_RESOURCE_TO]
-                property_name = property_tuple[1].replace(f"{resource_tuple[1]}-", "")
+        if (edges is None):
+            edges = []
+            nested_ref_depth = 0
 
-                if (uses_other_resources):
-                    resource_properties.append(src.implementation_plan.ResourceProperty(name=property_name, value=f"ARN of {{{uses_other_resources[0]}}}"))
+            for property_name, property_value in self.Resources[logical_name].Properties.items():
+                nested_ref_depth = max(nested_ref_depth, self._add_relative_property_edges(edges, "", property_name, property_value, ref_stack + (logical_name,)))
+
+            ref_depth = nested_ref_depth + 1
+            self._ref_expansions[logical_name] = (edges, ref_depth)
+
+        return (edges, ref_depth)
+
+    def referenced_resources(self, resource_logical_name: str) -> Set[str]:
+        # Logical names the resource's properties Ref directly, as detected when expanding them
+        referenced: Set[str] = set()
+        values: List[Any] = list(self.Resources[resource_logical_name].Properties.values())
+
+        while (values):
+            value = values.pop()
+
+            if (isinstance(value, list)):
+                values.extend(value)
+            elif (isinstance(value, dict)):
+                referenced_logical_name = self._get_referenced_resource(value)
+
+                if (referenced_logical_name is not None):
+                    referenced.add(referenced_logical_name)
                 else:
-                    resource_properties.append(src.implementation_plan.ResourceProperty(name=property_name, value=f"CONFIGURE APPROPRIATELY"))
+                    values.extend(value.values())
+
+        return referenced
+
+    def resource_content(self, resource_logical_name: str) -> List[Any]:
+        # Everything the resource's property graph is built from: its type and properties as written, and those of every
+        # resource it Refs, directly or through other resources. The logical name it's scanned under doesn't matter.
+        resource = self.Resources[resource_logical_name]
+        referenced: Dict[str, List[Any]] = {}
+        pending = list(self.referenced_resources(resource_logical_name))
+
+        while (pending):
+            logical_name = pending.pop()
+
+            if (logical_name not in referenced):
+                referenced[logical_name] = [self.Resources[logical_name].Type, self.Resources[logical_name].Properties]
+                pending.extend(self.referenced_resources(logical_name))
+
+        return [resource.Type, resource.Properties, referenced]
+
+    def _get_referenced_resource(self, property_value: Dict[str, Any]) -> Optional[str]:
+        if (not hasattr(self, "_non_resource_refs")):
+            object.__setattr__(self, "_non_resource_refs", frozenset(self.Parameters.keys()) | cloudformation_intrisic_functions)
+
+        if (len(property_value) == 1):
+            key, value = next(iter(property_value.items()))
+
+            if (key.lower() == "ref" and value not in self._non_resource_refs):
+                return value
+
+        return None
+
+# Templates with more resources than this are split across several scan_templates tasks
+RESOURCES_PER_TASK = 64
+
+class TemplateScan(NamedTuple):
+    # Either the (logical name, match) of every resource, in template order, or why the template couldn't be scanned
+    resources: Optional[List[Tuple[str, CapabilityMatch]]]
+    error: Optional[str]
+    resource_types: Optional[Dict[str, str]] = None
+
+def _initialize_scan_worker(artifact_path: str):
+    # Map the artifact when the worker starts, instead of on the first template it's handed
+    src.artifact.load_artifact(artifact_path)
+
+def _scan_template_resources(template: str, logical_names: Optional[List[str]], artifact_path: str):
+    # Runs in the worker processes: only edge ids go back, matches are rebuilt against the caller's artifact
+    try:
+        parsed_template = CfnTemplate.parse_raw(template)
+        resources = []
+
+        for logical_name in (logical_names if logical_names is not None else list(parsed_template.Resources.keys())):
+            capability_match = parsed_template.match_resource_capabilities(logical_name, artifact_path)
+            resources.append((logical_name, parsed_template.Resources[logical_name].Type, sorted(capability_match.present_edge_ids)))
+
+        return (resources, None)
+    except Exception as error:
+        return (None, f"{type(error).__name__}: {error}")
+
+@lru_cache(maxsize=None)
+def _get_scan_pool(processes: int, artifact_path: str) -> Executor:
+    return ProcessPoolExecutor(max_workers=processes, initializer=_initialize_scan_worker, initargs=(artifact_path,))
+
+def _run_scan_tasks(tasks: List[Tuple[int, str, Optional[List[str]]]], processes: int, artifact_path: str) -> List[Tuple[Optional[List], Optional[str]]]:
+    # A worker dying (killed for using too much memory, or crashing) breaks its pool and fails every task still in it.
+    # The broken pool, which has already shut itself down, is dropped so the next one starts fresh, and the lost tasks
+    # are retried once in it. Tasks lost twice fail their own template's entry.
+    task_results: Dict[int, Tuple[Optional[List], Optional[str]]] = {}
+    pending = list(range(len(tasks)))
+
+    for _ in range(2):
+        pool = _get_scan_pool(processes, artifact_path)
+        futures = []
+        lost: List[int] = []
+
+        for position in pending:
+            _, template, logical_names = tasks[position]
+
+            try:
+                futures.append((position, pool.submit(_scan_template_resources, template, logical_names, artifact_path)))
+            except BrokenProcessPool:
+                lost.append(position)
+
+        for position, future in futures:
+            try:
+                task_results[position] = future.result()
+            except BrokenProcessPool:
+                lost.append(position)
+
+        if (not lost):
+            break
+
+        logger.warning(f"A scan worker exited, {len(lost)} of {len(pending)} tasks were lost")
+        _get_scan_pool.cache_clear()
+        pending = sorted(lost)
+    else:
+        for position in pending:
+            task_results[position] = (None, "BrokenProcessPool: the process scanning the template exited")
+
+    return [task_results[position] for position in range(len(tasks))]
+
+def scan_templates(templates: List[str], processes: Optional[int] = None, artifact_path: str = src.artifact.ARTIFACT_PATH) -> List[TemplateScan]:
+    # Scans every template, spreading templates (and the resources of large ones) over a pool of processes. Results
+    # come back in input order, a template failing to parse or scan only fails its own entry.
+    if (processes is None):
+        processes = src.settings.Settings().SCAN_PROCESSES
+
+    tasks: List[Tuple[int, str, Optional[List[str]]]] = []
+    errors: Dict[int, str] = {}
+
+    for template_index, template in enumerate(templates):
+        # Splitting needs the logical names up front; without a pool, the template is only parsed once, when scanned
+        if (processes == 0):
+            tasks.append((template_index, template, None))
+            continue
+
+        try:
+            logical_names = list(src.template_loader.load_template(template).get("Resources", {}).keys())
+        except (ValueError, AttributeError) as error:
+            errors[template_index] = f"{type(error).__name__}: {error}"
+            continue
+
+        if (len(logical_names) > RESOURCES_PER_TASK):
+            tasks += [(template_index, template, logical_names[start:start + RESOURCES_PER_TASK]) for start in range(0, len(logical_names), RESOURCES_PER_TASK)]
+        else:
+            tasks.append((template_index, template, None))
+
+    # Phases inside worker processes aren't recorded, only the time spent waiting on them
+    if (processes > 0):
+        with src.metrics.phase("scan_worker_wait"):
+            task_results = _run_scan_tasks(tasks, processes, artifact_path)
+    else:
+        task_results = [_scan_template_resources(template, logical_names, artifact_path) for _, template, logical_names in tasks]
+
+    artifact = src.artifact.load_artifact(artifact_path)
+    resources_by_template: Dict[int, List[Tuple[str, CapabilityMatch]]] = {}
+    resource_types_by_template: Dict[int, Dict[str, str]] = {}
 
-            # Set the label depending whether it's an existing resource
-            resource_action = src.implementation_plan.Action.ADD_PROPERTIES if resource_tuple[0] else src.implementation_plan.Action.NEW_RESOURCE
-            resources.append(src.implementation_plan.Resource(type=resource_tuple[1], action=resource_action, properties=resource_properties))
+    for (template_index, _, _), (resources, error) in zip(tasks, task_results):
+        if (error is not None):
+            errors.setdefault(template_index, error)
+        elif (template_index not in errors):
+            resources_by_template.setdefault(template_index, []).extend((logical_name, CapabilityMatch(artifact.get_capability_index(resource_type), frozenset(present_edge_ids))) for logical_name, resource_type, present_edge_ids in resources)
+            resource_types_by_template.setdefault(template_index, {}).update((logical_name, resource_type) for logical_name, resource_type, _ in resources)
 
-        return src.implementation_plan.ImplementationPlan(resources=resources)
\ No newline at end of file
+    return [TemplateScan(resources=None, error=errors[template_index]) if template_index in errors else TemplateScan(resources=resources_by_template.get(template_index, []), error=None, resource_types=resource_types_by_template.get(template_index, {})) for template_index in range(len(templates))]
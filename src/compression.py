@@ -0,0 +1,79 @@
+from __future__ import annotations
+from typing import List, Optional
+import gzip
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compresses whole responses of at least minimum_size bytes, with br when the client accepts it and the brotli package
+# is installed, otherwise gzip. Responses are buffered until complete, so it only wraps apps that don't stream.
+class CompressionMiddleware():
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    @staticmethod
+    def accepted_encoding(scope: Scope) -> Optional[str]:
+        accepted: List[str] = []
+
+        for value in Headers(scope=scope).get("accept-encoding", "").split(","):
+            encoding, _, parameters = value.strip().partition(";")
+
+            if (parameters.replace(" ", "") not in ("q=0", "q=0.0")):
+                accepted.append(encoding.strip().lower())
+
+        if ("br" in accepted and brotli is not None):
+            return "br"
+
+        return "gzip" if "gzip" in accepted else None
+
+    @staticmethod
+    def compress(body: bytes, encoding: str) -> bytes:
+        if (encoding == "br"):
+            return brotli.compress(body, quality=4)
+
+        return gzip.compress(body, compresslevel=6)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = self.accepted_encoding(scope) if scope["type"] == "http" else None
+
+        if (encoding is None):
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        body = b""
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, body
+
+            if (message["type"] == "http.response.start"):
+                start_message = message
+                return
+
+            if (message["type"] != "http.response.body"):
+                await send(message)
+                return
+
+            body += message.get("body", b"")
+
+            if (message.get("more_body", False)):
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+
+            if (len(body) >= self.minimum_size and "content-encoding" not in headers):
+                body = self.compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Union
+from contextvars import copy_context
+import asyncio
+
+# Collects every key requested while one pass of resolvers runs, then fetches them all with a single batch call.
+# Keys are cached for the lifetime of the loader, which should be one GraphQL request.
+class DataLoader():
+
+    def __init__(self, batch_load: Callable[[List[Any]], Union[Dict[Any, Any], Awaitable[Dict[Any, Any]]]]):
+        self._batch_load = batch_load
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Any] = []
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        if (key not in self._futures):
+            loop = asyncio.get_running_loop()
+            self._futures[key] = loop.create_future()
+
+            # Dispatch once the resolvers currently running have had the chance to queue their keys too
+            if (not self._queue):
+                loop.call_soon(self._dispatch)
+
+            self._queue.append(key)
+
+        return self._futures[key]
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        asyncio.ensure_future(self._resolve(keys))
+
+    async def _resolve(self, keys: List[Any]):
+        # Blocking batch functions are kept off the event loop
+        try:
+            if (asyncio.iscoroutinefunction(self._batch_load)):
+                results = await self._batch_load(keys)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(None, copy_context().run, self._batch_load, keys)
+        except Exception as exception:
+            for key in keys:
+                self._futures[key].set_exception(exception)
+        else:
+            for key in keys:
+                self._futures[key].set_result(results.get(key))
+
+def get_request_loader(context: Any, name: str, batch_load: Callable[[List[Any]], Union[Dict[Any, Any], Awaitable[Dict[Any, Any]]]]):
+    # Loaders live in the per-request GraphQL context; None when executing without one or outside an event loop
+    if (not isinstance(context, dict)):
+        return None
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+    loaders: Dict[str, DataLoader] = context.setdefault("dataloaders", {})
+
+    if (name not in loaders):
+        loaders[name] = DataLoader(batch_load)
+
+    return loaders[name]
@@ -0,0 +1,90 @@
+from __future__ import annotations
+from functools import lru_cache
+from inspect import isawaitable
+from typing import Any, Callable, Dict, Optional
+import logging
+from graphql import ExecutionResult, execute
+from starlette.background import BackgroundTasks
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+from starlette_graphene3 import GraphQLApp
+import graphene
+import src.metrics
+import src.persisted_queries
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def _orjson_dumps() -> Optional[Callable[[Any], bytes]]:
+    try:
+        import orjson
+        return orjson.dumps
+    except ImportError:
+        return None
+
+class _JSONResponse(JSONResponse):
+    # orjson when it's installed, several times faster than json for large scan reports
+    def render(self, content: Any) -> bytes:
+        dumps = _orjson_dumps()
+        return dumps(content) if dumps is not None else super().render(content)
+
+# GraphQLApp with scan metrics. Requests sending {"extensions": {"metrics": true}} get the phases and counters of
+# their own execution back in the response's "extensions" block. Documents come from the persisted query cache, so
+# each query is only parsed and validated the first time it's seen. JSON POSTs are executed here, everything else
+# (GraphiQL, multipart/form-data uploads, websockets) is left to the wrapped GraphQLApp.
+class InstrumentedGraphQLApp():
+
+    def __init__(self, schema: graphene.Schema, on_get: Optional[Callable[[Request], Response]] = None):
+        self.schema = schema
+        self.graphql_app = GraphQLApp(schema, on_get=on_get)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http" or scope["method"] != "POST" or Request(scope).headers.get("content-type", "").split(";")[0].strip() != "application/json"):
+            await self.graphql_app(scope, receive, send)
+            return
+
+        response = await self.handle_request(Request(scope, receive=receive))
+        await response(scope, receive, send)
+
+    async def handle_request(self, request: Request) -> Response:
+        try:
+            operation = await request.json()
+        except ValueError:
+            return JSONResponse({"errors": ["Request body is not a valid JSON"]}, status_code=400)
+
+        if (isinstance(operation, list)):
+            return JSONResponse({"errors": ["This server does not support batching"]}, status_code=400)
+        elif (not isinstance(operation, dict)):
+            return JSONResponse({"errors": ["Expected a JSON body with a GraphQL query"]}, status_code=400)
+
+        context_value: Dict[str, Any] = {"request": request, "background": BackgroundTasks()}
+        request_extensions = operation.get("extensions") or {}
+
+        with src.metrics.collect("graphql") as request_metrics:
+            document, errors = src.persisted_queries.get_document_cache(self.schema.graphql_schema).get(operation.get("query"), request_extensions)
+
+            if (document is None):
+                result = ExecutionResult(data=None, errors=errors)
+            else:
+                with src.metrics.phase("graphql_execution"):
+                    result = execute(self.schema.graphql_schema, document, context_value=context_value, variable_values=operation.get("variables"), operation_name=operation.get("operationName"))
+
+                    if (isawaitable(result)):
+                        result = await result
+
+            response: Dict[str, Any] = {"data": result.data}
+
+            if (result.errors):
+                for error in result.errors:
+                    if (error.original_error):
+                        logger.error("An exception occurred in resolvers", exc_info=error.original_error)
+
+                response["errors"] = [error.formatted for error in result.errors]
+
+            # Serialization happens after this snapshot, so it's only in /metrics and the log line
+            if (isinstance(request_extensions, dict) and request_extensions.get("metrics")):
+                response["extensions"] = {"metrics": request_metrics.as_dict()}
+
+            with src.metrics.phase("serialization"):
+                return _JSONResponse(response, status_code=200, background=context_value["background"])
@@ -0,0 +1,201 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import threading
+import time
+import src.settings
+
+logger = logging.getLogger(__name__)
+SNAPSHOT_INTERVAL = 1.0
+
+# Phases and counters recorded across the scan pipeline. Every observation goes to the process-wide registry (exported
+# by the /metrics route) and, when a request is being collected, to that request's metrics too. Both are updated from
+# worker threads (contexts copied with copy_context share the request's metrics), so updates are locked.
+class Metrics():
+
+    def __init__(self):
+        self.phases: Dict[str, List[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, phase_name: str, seconds: float):
+        with self._lock:
+            observed = self.phases.setdefault(phase_name, [0.0, 0])
+            observed[0] += seconds
+            observed[1] += 1
+
+    def count(self, counter_name: str, value: int):
+        with self._lock:
+            self.counts[counter_name] = self.counts.get(counter_name, 0) + value
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phases": {phase_name: {"milliseconds": round(seconds * 1000, 3), "calls": calls} for phase_name, (seconds, calls) in self.phases.items()},
+                "counts": dict(self.counts)}
+
+# The registry of this process. With several processes serving (uvicorn --workers, or app.py's pre-fork mode) each has
+# its own, so with METRICS_DIR set every process also writes its registry to {METRICS_DIR}/{pid}.json, at most once per
+# SNAPSHOT_INTERVAL seconds, and /metrics sums all of them. Without it the numbers are those of the process scraped.
+class MetricsRegistry(Metrics):
+
+    def __init__(self):
+        super().__init__()
+        self._snapshot_pending = False
+
+    def observe(self, phase_name: str, seconds: float):
+        super().observe(phase_name, seconds)
+        self._schedule_snapshot()
+
+    def count(self, counter_name: str, value: int):
+        super().count(counter_name, value)
+        self._schedule_snapshot()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"phases": {phase_name: list(observed) for phase_name, observed in self.phases.items()}, "counts": dict(self.counts)}
+
+    def reset(self):
+        # A forked worker starts from what the parent had recorded, and from its pending snapshot without the timer
+        with self._lock:
+            self.phases.clear()
+            self.counts.clear()
+            self._snapshot_pending = False
+
+    def _schedule_snapshot(self):
+        if (not _metrics_dir()):
+            return
+
+        with self._lock:
+            if (self._snapshot_pending):
+                return
+
+            self._snapshot_pending = True
+
+        timer = threading.Timer(SNAPSHOT_INTERVAL, self.write_snapshot)
+        timer.daemon = True
+        timer.start()
+
+    def write_snapshot(self):
+        with self._lock:
+            self._snapshot_pending = False
+
+        path = os.path.join(_metrics_dir(), f"{os.getpid()}.json")
+
+        try:
+            # The rename keeps processes reading the directory from seeing partial files
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(self.snapshot(), file)
+
+            os.replace(f"{path}.tmp", path)
+        except OSError as error:
+            logger.warning(f"Couldn't write metrics snapshot {path}: {error}")
+
+    def aggregate(self) -> Dict[str, Any]:
+        # This process's own numbers are current, the other processes' are from their last snapshot. Snapshots of
+        # processes that exited are kept, so the sums don't go backwards when a worker is restarted.
+        aggregated = self.snapshot()
+
+        if (not _metrics_dir()):
+            return aggregated
+
+        for entry in os.scandir(_metrics_dir()):
+            if (not entry.name.endswith(".json") or entry.name == f"{os.getpid()}.json"):
+                continue
+
+            try:
+                with open(entry.path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+
+            for phase_name, (seconds, calls) in snapshot["phases"].items():
+                observed = aggregated["phases"].setdefault(phase_name, [0.0, 0])
+                observed[0] += seconds
+                observed[1] += calls
+
+            for counter_name, value in snapshot["counts"].items():
+                aggregated["counts"][counter_name] = aggregated["counts"].get(counter_name, 0) + value
+
+        return aggregated
+
+    def prometheus_text(self) -> str:
+        aggregated = self.aggregate()
+        lines = [
+            "# HELP gomboc_phase_seconds Time spent in each scan phase",
+            "# TYPE gomboc_phase_seconds summary"]
+
+        for phase_name, (seconds, calls) in sorted(aggregated["phases"].items()):
+            lines.append(f'gomboc_phase_seconds_sum{{phase="{phase_name}"}} {seconds}')
+            lines.append(f'gomboc_phase_seconds_count{{phase="{phase_name}"}} {calls}')
+
+        lines += [
+            "# HELP gomboc_events_total Resources, edges, capabilities checked, plans built and other scan events",
+            "# TYPE gomboc_events_total counter"]
+
+        for counter_name, value in sorted(aggregated["counts"].items()):
+            lines.append(f'gomboc_events_total{{event="{counter_name}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+_request_metrics: ContextVar[Optional[Metrics]] = ContextVar("request_metrics", default=None)
+
+@contextmanager
+def phase(phase_name: str) -> Iterator[None]:
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe(phase_name, seconds)
+        request_metrics = _request_metrics.get()
+
+        if (request_metrics is not None):
+            request_metrics.observe(phase_name, seconds)
+
+def count(counter_name: str, value: int = 1):
+    registry.count(counter_name, value)
+    request_metrics = _request_metrics.get()
+
+    if (request_metrics is not None):
+        request_metrics.count(counter_name, value)
+
+@contextmanager
+def collect(operation: str) -> Iterator[Metrics]:
+    # Collects what's observed while the block runs, in this context and the ones copied from it (worker threads)
+    request_metrics = Metrics()
+    token = _request_metrics.set(request_metrics)
+
+    try:
+        yield request_metrics
+    finally:
+        _request_metrics.reset(token)
+
+        if (_log_enabled()):
+            logger.info(json.dumps({"message": "scan metrics", "operation": operation, **request_metrics.as_dict()}))
+
+@lru_cache(maxsize=None)
+def _log_enabled() -> bool:
+    # Structured log lines default to on under Lambda, where there's no /metrics to scrape. The Lambda runtime leaves
+    # the root logger at WARNING, so this logger gets its own level, and a handler when nothing is configured at all.
+    metrics_log = src.settings.Settings().METRICS_LOG
+    enabled = metrics_log if metrics_log is not None else "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+    if (enabled):
+        logger.setLevel(logging.INFO)
+
+        if (not logging.getLogger().handlers):
+            logger.addHandler(logging.StreamHandler())
+
+    return enabled
+
+@lru_cache(maxsize=None)
+def _metrics_dir() -> Optional[str]:
+    return src.settings.Settings().METRICS_DIR
@@ -0,0 +1,350 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from gomboctypes.models import EdgeLabels, NodeLabels
+import csv
+import json
+
+# A Neo4j graph exported to a file (apoc.export.json.all or apoc.export.csv.all), held in memory so the artifact can
+# be generated without a Neo4j server. While a graph is active, the few queries generate.py needs are answered by
+# walking its adjacency lists directly, one walk per path family of ResourceQueryGenerator's implementation query,
+# and come back as records shaped like the driver's, so everything parsing them stays the same. As in Neo4j, a
+# relationship is used at most once across the patterns of one MATCH.
+
+_CFN_RESOURCE = NodeLabels.CFN_RESOURCE.value.lstrip(":")
+_CAPABILITY = NodeLabels.CAPABILITY.value.lstrip(":")
+_USE_CASE = NodeLabels.USE_CASE.value.lstrip(":")
+_HAS_SUBPROPERTY = EdgeLabels.HAS_SUBPROPERTY.value.lstrip(":")
+_ENABLES_INTERNAL_CAPABILITY = EdgeLabels.ENABLES_INTERNAL_CAPABILITY.value.lstrip(":")
+_PROVIDES_CAPABILITY = EdgeLabels.PROVIDES_CAPABILITY.value.lstrip(":")
+_USES_OTHER_RESOURCE_TO = EdgeLabels.USES_OTHER_RESOURCE_TO.value.lstrip(":")
+_CAN_BE_USED_TO = EdgeLabels.CAN_BE_USED_TO.value.lstrip(":")
+_ADDS_CAPABILITIES_TO_RESOURCE = EdgeLabels.ADDS_CAPABILITIES_TO_RESOURCE.value.lstrip(":")
+
+# One step of a walk: relationship type, direction ("out" along relationships, "in" against them, "both"), least and
+# most hops (None for unbounded), and the label the node it ends on must have
+class _Step(NamedTuple):
+    type: str
+    direction: str
+    min_hops: int = 1
+    max_hops: Optional[int] = 1
+    label: Optional[str] = None
+
+# (node indexes, relationship indexes) of a path, its first node included
+_Path = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+# -[:HAS_SUBPROPERTY*0..]-> and <-[:HAS_SUBPROPERTY*0..]-
+_DOWN_PROPERTIES = _Step(_HAS_SUBPROPERTY, "out", 0, None)
+_UP_PROPERTIES = _Step(_HAS_SUBPROPERTY, "in", 0, None)
+
+# (to_primary_resource)<-[:HAS_SUBPROPERTY*0..]-()<-[:ADDS_CAPABILITIES_TO_RESOURCE*0..]-()-[:HAS_SUBPROPERTY*0..]->()
+_ADDING_RESOURCE_PROPERTIES = [_UP_PROPERTIES, _Step(_ADDS_CAPABILITIES_TO_RESOURCE, "in", 0, None), _DOWN_PROPERTIES]
+
+class OfflineNode():
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: OfflineGraph, index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def labels(self) -> FrozenSet[str]:
+        return frozenset(self.graph._labels[self.index])
+
+    @property
+    def _properties(self) -> Dict[str, Any]:
+        return self.graph._properties[self.index]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, OfflineNode) and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash(("node", self.index))
+
+class OfflineRelationship():
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: OfflineGraph, index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def type(self) -> str:
+        return self.graph._relationship_types[self.index]
+
+    @property
+    def start_node(self) -> OfflineNode:
+        return OfflineNode(self.graph, self.graph._relationship_ends[self.index][0])
+
+    @property
+    def end_node(self) -> OfflineNode:
+        return OfflineNode(self.graph, self.graph._relationship_ends[self.index][1])
+
+class OfflinePath():
+    __slots__ = ("graph", "node_indexes", "relationship_indexes")
+
+    def __init__(self, graph: OfflineGraph, path: _Path):
+        self.graph = graph
+        self.node_indexes, self.relationship_indexes = path
+
+    @property
+    def nodes(self) -> List[OfflineNode]:
+        return [OfflineNode(self.graph, index) for index in self.node_indexes]
+
+    @property
+    def relationships(self) -> List[OfflineRelationship]:
+        return [OfflineRelationship(self.graph, index) for index in self.relationship_indexes]
+
+    def __iter__(self) -> Iterator[OfflineRelationship]:
+        return iter(self.relationships)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, OfflinePath) and (other.node_indexes, other.relationship_indexes) == (self.node_indexes, self.relationship_indexes)
+
+    def __hash__(self) -> int:
+        return hash((self.node_indexes, self.relationship_indexes))
+
+_active_offline_graph: ContextVar[Optional[OfflineGraph]] = ContextVar("offline_graph", default=None)
+
+def get_active_offline_graph() -> Optional[OfflineGraph]:
+    return _active_offline_graph.get()
+
+class OfflineGraph():
+
+    def __init__(self):
+        self._labels: List[Tuple[str, ...]] = []
+        self._properties: List[Dict[str, Any]] = []
+        self._nodes_by_id: Dict[Any, List[int]] = {}
+        self._nodes_by_label: Dict[str, List[int]] = {}
+        self._relationship_types: List[str] = []
+        self._relationship_ends: List[Tuple[int, int]] = []
+        self._outgoing: Dict[Tuple[int, str], List[int]] = {}
+        self._incoming: Dict[Tuple[int, str], List[int]] = {}
+
+    def add_node(self, labels: List[str], properties: Dict[str, Any]) -> int:
+        index = len(self._labels)
+        self._labels.append(tuple(labels))
+        self._properties.append(properties)
+        self._nodes_by_id.setdefault(properties.get("id"), []).append(index)
+
+        for label in labels:
+            self._nodes_by_label.setdefault(label, []).append(index)
+
+        return index
+
+    def add_relationship(self, start: int, type: str, end: int) -> int:
+        index = len(self._relationship_types)
+        self._relationship_types.append(type)
+        self._relationship_ends.append((start, end))
+        self._outgoing.setdefault((start, type), []).append(index)
+        self._incoming.setdefault((end, type), []).append(index)
+        return index
+
+    @staticmethod
+    def load(path: str) -> OfflineGraph:
+        with open(path, newline="") as file:
+            return OfflineGraph._load_csv(file) if path.endswith(".csv") else OfflineGraph._load_json(file.read())
+
+    @staticmethod
+    def _load_json(content: str) -> OfflineGraph:
+        # One JSON object per line, as written by apoc.export.json.all, or a JSON array of the same objects
+        entries = json.loads(content) if content.lstrip().startswith("[") else [json.loads(line) for line in content.splitlines() if line.strip()]
+        graph = OfflineGraph()
+        node_indexes: Dict[str, int] = {}
+
+        for entry in entries:
+            if (entry["type"] == "node"):
+                node_indexes[str(entry["id"])] = graph.add_node(entry.get("labels", []), entry.get("properties", {}))
+
+        for entry in entries:
+            if (entry["type"] == "relationship"):
+                graph.add_relationship(node_indexes[str(entry["start"]["id"])], entry["label"], node_indexes[str(entry["end"]["id"])])
+
+        return graph
+
+    @staticmethod
+    def _load_csv(file) -> OfflineGraph:
+        # apoc.export.csv.all: node rows have _id and _labels (":Label"), relationship rows _start, _end and _type.
+        # CSV has no types, property values come back as the strings they were written as.
+        rows = list(csv.DictReader(file))
+        graph = OfflineGraph()
+        node_indexes: Dict[str, int] = {}
+
+        for row in rows:
+            if (row.get("_id")):
+                properties = {name: value for name, value in row.items() if not name.startswith("_") and value != ""}
+                node_indexes[row["_id"]] = graph.add_node([label for label in row.get("_labels", "").split(":") if label], properties)
+
+        for row in rows:
+            if (row.get("_type")):
+                graph.add_relationship(node_indexes[row["_start"]], row["_type"], node_indexes[row["_end"]])
+
+        return graph
+
+    @contextmanager
+    def activate(self):
+        token = _active_offline_graph.set(self)
+        try:
+            yield self
+        finally:
+            _active_offline_graph.reset(token)
+
+    def graph_content(self) -> Tuple[List[Tuple[Tuple[str, str], Dict[str, Any]]], List[Tuple[Tuple[str, str], str, Tuple[str, str]]]]:
+        # Same as Query.graph_content, read from the dump
+        node_keys = [(NodeLabels.parse_from_iterable(labels).value, properties["id"]) for labels, properties in zip(self._labels, self._properties)]
+        nodes = [(node_key, properties) for node_key, properties in zip(node_keys, self._properties)]
+        relationships = [(node_keys[start], type, node_keys[end]) for type, (start, end) in zip(self._relationship_types, self._relationship_ends)]
+
+        return (nodes, relationships)
+
+    def nodes(self, label: str, id: Optional[Any] = None) -> List[int]:
+        return [index for index in (self._nodes_by_id.get(id, []) if id is not None else self._nodes_by_label.get(label, [])) if label in self._labels[index]]
+
+    def all_nodes(self, label: str) -> List[OfflineNode]:
+        # MATCH (node:Label) RETURN node
+        return [OfflineNode(self, index) for index in self.nodes(label)]
+
+    def _walk(self, start: int, steps: List[_Step], used: FrozenSet[int]) -> Iterator[Tuple[int, _Path]]:
+        # (end node, path from start) of every way of taking the steps in order, without re-using a relationship
+        if (not steps):
+            yield (start, ((start,), ()))
+            return
+
+        step = steps[0]
+
+        def hops(node: int, nodes: Tuple[int, ...], relationships: Tuple[int, ...]) -> Iterator[Tuple[int, _Path]]:
+            if (len(relationships) >= step.min_hops and (step.label is None or step.label in self._labels[node])):
+                for end, (rest_nodes, rest_relationships) in self._walk(node, steps[1:], used | frozenset(relationships)):
+                    yield (end, (nodes + rest_nodes[1:], relationships + rest_relationships))
+
+            if (step.max_hops is not None and len(relationships) >= step.max_hops):
+                return
+
+            for index in (self._outgoing.get((node, step.type), []) if step.direction != "in" else []):
+                if (index not in used and index not in relationships):
+                    yield from hops(self._relationship_ends[index][1], nodes + (self._relationship_ends[index][1],), relationships + (index,))
+
+            for index in (self._incoming.get((node, step.type), []) if step.direction != "out" else []):
+                if (index not in used and index not in relationships):
+                    yield from hops(self._relationship_ends[index][0], nodes + (self._relationship_ends[index][0],), relationships + (index,))
+
+        yield from hops(start, (start,), ())
+
+    @staticmethod
+    def _join(first: _Path, second: _Path) -> _Path:
+        return (first[0] + second[0][1:], first[1] + second[1])
+
+    @staticmethod
+    def _reverse(path: _Path) -> _Path:
+        return (tuple(reversed(path[0])), tuple(reversed(path[1])))
+
+    def _usecase_capabilities(self, usecase: int, prefix: _Path, used: FrozenSet[int], to_primary_resource: Optional[int] = None) -> Iterator[Tuple[int, _Path]]:
+        # (capability, other_resource_configuration) of UseCaseQueryGenerator.paths_to_capabilities, from a use case
+        # reached through prefix (already part of the path bound to other_resource_configuration, when not empty)
+
+        # (usecase)<-[:CAN_BE_USED_TO]-()<-[:HAS_SUBPROPERTY*0..]-(:CfnResource), (usecase)-[:PROVIDES_CAPABILITY]->(capability)
+        for _, to_resource in self._walk(usecase, [_Step(_CAN_BE_USED_TO, "in"), _Step(_HAS_SUBPROPERTY, "in", 0, None, _CFN_RESOURCE)], used):
+            to_resource_used = used | frozenset(to_resource[1])
+            repeated_prefixes: Iterable[Tuple[int, _Path]] = [(usecase, ((usecase,), ()))]
+
+            # From a resource adding capabilities, the second pattern repeats the prefix from to_primary_resource, which
+            # has to match other relationships than the path's
+            if (to_primary_resource is not None):
+                repeated_prefixes = self._walk(to_primary_resource, _ADDING_RESOURCE_PROPERTIES + [_Step(_USES_OTHER_RESOURCE_TO, "out", label=_USE_CASE)], to_resource_used)
+
+            for repeated_usecase, repeated_prefix in repeated_prefixes:
+                if (repeated_usecase != usecase):
+                    continue
+
+                for capability, _ in self._walk(usecase, [_Step(_PROVIDES_CAPABILITY, "out", label=_CAPABILITY)], to_resource_used | frozenset(repeated_prefix[1])):
+                    yield (capability, self._join(prefix, to_resource))
+
+        # (used_resource:CfnResource)-[:HAS_SUBPROPERTY*0..]->(enabling_usecase)-[:HAS_SUBPROPERTY*0..]->()-[:PROVIDES_CAPABILITY]->(capability),
+        # (usecase)<-[:CAN_BE_USED_TO]-(enabling_usecase): the path is the first pattern, without the use case
+        for enabling_usecase, can_be_used_to in self._walk(usecase, [_Step(_CAN_BE_USED_TO, "in")], used):
+            can_be_used_to_used = used | frozenset(can_be_used_to[1])
+
+            for _, from_resource in self._walk(enabling_usecase, [_Step(_HAS_SUBPROPERTY, "in", 0, None, _CFN_RESOURCE)], can_be_used_to_used):
+                for capability, to_capability in self._walk(enabling_usecase, [_DOWN_PROPERTIES, _Step(_PROVIDES_CAPABILITY, "out", label=_CAPABILITY)], can_be_used_to_used | frozenset(from_resource[1])):
+                    yield (capability, self._join(self._reverse(from_resource), to_capability))
+
+        # (usecase)<-[:CAN_BE_USED_TO]-()<-[:HAS_SUBPROPERTY*0..]-(:CfnResource)<-[:ADDS_CAPABILITIES_TO_RESOURCE]-()-[:HAS_SUBPROPERTY*0..]-()-[:PROVIDES_CAPABILITY]->(capability)
+        for capability, to_capability in self._walk(usecase, [_Step(_CAN_BE_USED_TO, "in"), _Step(_HAS_SUBPROPERTY, "in", 0, None, _CFN_RESOURCE), _Step(_ADDS_CAPABILITIES_TO_RESOURCE, "in"), _Step(_HAS_SUBPROPERTY, "both", 0, None), _Step(_PROVIDES_CAPABILITY, "out", label=_CAPABILITY)], used):
+            yield (capability, self._join(prefix, to_capability))
+
+    def _resource_implementations(self, resource: int) -> Iterator[Tuple[_Path, Optional[_Path], int]]:
+        # (internal_resource_configuration, other_resource_configuration, capability) rows of one resource, family by
+        # family as ResourceQueryGenerator.internal_capabilities_implementations_cypher_query puts them together
+        no_path: FrozenSet[int] = frozenset()
+        resource_only = ((resource,), ())
+
+        # Resource -> Properties -> Capabilities
+        for capability, internal in self._walk(resource, [_DOWN_PROPERTIES, _Step(_ENABLES_INTERNAL_CAPABILITY, "out", label=_CAPABILITY)], no_path):
+            yield (internal, None, capability)
+
+        # Resource -> Properties -> Usecases ...
+        for usecase, internal in self._walk(resource, [_DOWN_PROPERTIES, _Step(_USES_OTHER_RESOURCE_TO, "out", label=_USE_CASE)], no_path):
+            for capability, other in self._usecase_capabilities(usecase, ((usecase,), ()), frozenset(internal[1])):
+                yield (internal, other, capability)
+
+        for adds_capabilities in self._incoming.get((resource, _ADDS_CAPABILITIES_TO_RESOURCE), []):
+            to_primary_resource = self._relationship_ends[adds_capabilities][0]
+            used = frozenset([adds_capabilities])
+
+            # Resource <- Resource_Adding_capabilities -> Properties -> Capabilities
+            for capability, other in self._walk(to_primary_resource, _ADDING_RESOURCE_PROPERTIES + [_Step(_ENABLES_INTERNAL_CAPABILITY, "out", label=_CAPABILITY)], used):
+                yield (resource_only, other, capability)
+
+            # Resource <- Resource Adding Capabilities -> Properties -> Usecases...
+            for usecase, prefix in self._walk(to_primary_resource, _ADDING_RESOURCE_PROPERTIES + [_Step(_USES_OTHER_RESOURCE_TO, "out", label=_USE_CASE)], used):
+                for capability, other in self._usecase_capabilities(usecase, prefix, used | frozenset(prefix[1]), to_primary_resource):
+                    yield (resource_only, other, capability)
+
+    def implementation_records(self, resource_ids: List[str]) -> List[Dict[str, Any]]:
+        # Records of ResourceQueryGenerator.internal_capabilities_implementations_cypher_query, duplicates dropped as
+        # its UNION does
+        records: List[Dict[str, Any]] = []
+        seen = set()
+
+        for resource_id in resource_ids:
+            for resource in self.nodes(_CFN_RESOURCE, resource_id):
+                for internal, other, capability in self._resource_implementations(resource):
+                    if ((resource_id, internal, other, capability) in seen):
+                        continue
+
+                    seen.add((resource_id, internal, other, capability))
+                    records.append({
+                        "resource_id": resource_id,
+                        "internal_resource_configuration": OfflinePath(self, internal),
+                        "other_resource_configuration": OfflinePath(self, other) if other is not None else None,
+                        "capability": OfflineNode(self, capability)})
+
+        return records
+
+    def ancestor_capabilities(self, capability_ids: List[str]) -> Dict[str, List[OfflineNode]]:
+        # End of every PROVIDES_CAPABILITY path from each capability, once, ordered by its longest path and id as
+        # CapabilityQueryGenerator.ancestor_capabilities orders them
+        ancestors: Dict[str, List[OfflineNode]] = {}
+
+        for capability_id in capability_ids:
+            depths: Dict[int, int] = {}
+
+            for capability in self.nodes(_CAPABILITY, capability_id):
+                for end, path in self._walk(capability, [_Step(_PROVIDES_CAPABILITY, "out", 1, None, _CAPABILITY)], frozenset()):
+                    depths[end] = max(depths.get(end, 0), len(path[1]))
+
+            ancestors[capability_id] = [OfflineNode(self, end) for end in sorted(depths, key=lambda end: (depths[end], self._properties[end]["id"]))]
+
+        return ancestors
+
+def write_graph_dump(path: str, nodes: List[Tuple[Tuple[str, str], Dict[str, Any]]], relationships: List[Tuple[Tuple[str, str], str, Tuple[str, str]]]):
+    # Query.graph_content written in the apoc.export.json.all format, for OfflineGraph.load
+    node_ids = {node_key: str(position) for position, (node_key, _) in enumerate(nodes)}
+
+    with open(path, "w") as file:
+        for node_key, properties in nodes:
+            file.write(json.dumps({"type": "node", "id": node_ids[node_key], "labels": [node_key[0].lstrip(":")], "properties": properties}) + "\n")
+
+        for position, (source, type, target) in enumerate(relationships):
+            file.write(json.dumps({"type": "relationship", "id": str(position), "label": type, "start": {"id": node_ids[source], "labels": [source[0].lstrip(":")]}, "end": {"id": node_ids[target], "labels": [target[0].lstrip(":")]}}) + "\n")
@@ -0,0 +1,80 @@
+from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from graphql import DocumentNode, GraphQLError, GraphQLSchema, parse, validate
+import hashlib
+import threading
+import src.metrics
+import src.settings
+
+# Automatic persisted queries, as sent by Apollo clients: a request's extensions.persistedQuery.sha256Hash stands in
+# for the query text once the server has seen that query. Every query is parsed and validated once, then kept by the
+# SHA-256 of its text, whether or not the client asked for it to be persisted.
+class DocumentCache():
+
+    def __init__(self, schema: GraphQLSchema, max_size: int):
+        self.schema = schema
+        self.max_size = max_size
+        self._documents: OrderedDict[str, DocumentNode] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: Optional[str], extensions: Optional[Dict[str, Any]] = None) -> Tuple[Optional[DocumentNode], List[GraphQLError]]:
+        # The parsed and validated document, or why the request has none
+        persisted_query = (extensions or {}).get("persistedQuery") if isinstance(extensions, dict) else None
+        query_hash = persisted_query.get("sha256Hash") if isinstance(persisted_query, dict) else None
+
+        if (query is None):
+            if (query_hash is None):
+                return (None, [GraphQLError("Must provide query string.")])
+
+            document = self._lookup(query_hash)
+            return (document, []) if document is not None else (None, [GraphQLError("PersistedQueryNotFound", extensions={"code": "PERSISTED_QUERY_NOT_FOUND"})])
+
+        if (not isinstance(query, str)):
+            return (None, [GraphQLError("The query must be a string.")])
+
+        query_text_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+        if (query_hash is not None and query_hash != query_text_hash):
+            return (None, [GraphQLError("provided sha does not match query", extensions={"code": "PERSISTED_QUERY_HASH_MISMATCH"})])
+
+        document = self._lookup(query_text_hash)
+
+        if (document is not None):
+            return (document, [])
+
+        with src.metrics.phase("graphql_validation"):
+            try:
+                document = parse(query)
+            except GraphQLError as error:
+                return (None, [error])
+
+            validation_errors = validate(self.schema, document)
+
+        # Only valid documents are kept, so a hash can't be registered for a query that will never run
+        if (validation_errors):
+            return (None, validation_errors)
+
+        with self._lock:
+            if (self.max_size > 0):
+                self._documents[query_text_hash] = document
+
+                while (len(self._documents) > self.max_size):
+                    self._documents.popitem(last=False)
+
+        return (document, [])
+
+    def _lookup(self, query_hash: str) -> Optional[DocumentNode]:
+        with self._lock:
+            document = self._documents.get(query_hash)
+
+            if (document is not None):
+                self._documents.move_to_end(query_hash)
+
+        src.metrics.count("document_cache_hits" if document is not None else "document_cache_misses")
+        return document
+
+@lru_cache(maxsize=None)
+def get_document_cache(schema: GraphQLSchema) -> DocumentCache:
+    return DocumentCache(schema, src.settings.Settings().PERSISTED_QUERY_CACHE_SIZE)
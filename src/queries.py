@@ -1,29 +1,58 @@
 from __future__ import annotations
-from functools import lru_cache
+from contextvars import copy_context
+import asyncio
+import functools
 import graphene
-import pickle
 from typing import Dict, List, Tuple, Optional
 from graphene_pydantic import PydanticObjectType
+from graphql import FieldNode, FragmentSpreadNode, GraphQLResolveInfo, InlineFragmentNode
 from gomboctypes.models import Capability
-from src.querybuilder import CapabilityQueryGenerator
-from src.implementation_plan import Recommendations_Model, Recommendations, ImplementationPlan
+from src.querybuilder import CapabilityQueryGenerator, SessionScope
+from src.capability_index import CapabilityMatch
+from src.dataloader import get_request_loader
+from src.implementation_plan import Recommendations_Model, Recommendations, ImplementationPlan, Resource_Model
 import src.settings
+import src.artifact
 import src.cfn_lint
+import src.scan_cache
+import src.scan_index
+import src.template_diff
 
 settings = src.settings.Settings()
 
-@lru_cache(maxsize=None)
-def _load_capabilities_from_pickle() -> List[Tuple[Capability, Optional[Capability]]]:
-    with open("capabilities.pkl", "rb") as file:
-        return pickle.load(file)
+def _get_root_capability_from_artifact(id: str):
+    try:
+        return src.artifact.load_artifact().get_root_capability(id)
+    except KeyError:
+        raise Exception(f"Was expecting 1 Capability matching id {id}, but found none")
 
-def _get_capability_from_pickle(id: str):
-    matches = list(filter(lambda x: x[0].id == id, _load_capabilities_from_pickle()))
+def _get_request_session_scope(context: Dict) -> SessionScope:
+    # Queries of one GraphQL request share a Neo4j session, closed once the response has been sent
+    if ("neo4j_session_scope" not in context):
+        context["neo4j_session_scope"] = SessionScope()
+        context["background"].add_task(context["neo4j_session_scope"].close)
 
-    if (len(matches) != 1):
-        raise Exception(f"Was expecting 1 Capability matching id {id}, but found {matches}")
+    return context["neo4j_session_scope"]
 
-    return matches[0]
+def _selects_field(info: GraphQLResolveInfo, field_name: str, nested: bool = False) -> bool:
+    # Whether the selection set of the field being resolved asks for field_name, looking through fragments, and through
+    # the selection sets of its subfields when nested
+    selections = [selection for field_node in info.field_nodes if field_node.selection_set for selection in field_node.selection_set.selections]
+
+    while (selections):
+        selection = selections.pop()
+
+        if (isinstance(selection, FieldNode) and selection.name.value == field_name):
+            return True
+        elif (isinstance(selection, FieldNode)):
+            if (nested and selection.selection_set):
+                selections.extend(selection.selection_set.selections)
+        elif (isinstance(selection, InlineFragmentNode)):
+            selections.extend(selection.selection_set.selections)
+        elif (isinstance(selection, FragmentSpreadNode)):
+            selections.extend(info.fragments[selection.name.value].selection_set.selections)
+
+    return False
 
 class CapabilityModel(PydanticObjectType):
     class Meta:
@@ -35,6 +64,12 @@ class CapabilityModel(PydanticObjectType):
     def resolve_root_capability(parent: Capability, info):
 
         if (settings.DATASOURCE == src.settings.DataSource.NEO4J.value):
+            root_capability_loader = get_request_loader(info.context, "root_capability", functools.partial(CapabilityModel._load_root_capabilities, info.context))
+
+            # Batch every rootCapability in the response into one query, when executing asynchronously
+            if (root_capability_loader):
+                return root_capability_loader.load(parent.id)
+
             capabilities = CapabilityQueryGenerator(id=parent.id).provides_capability(capability_column="dest_c").asQuery("last(collect(dest_c)) as result").parse_column_as_model("result", Capability)
             
             if (len(capabilities)):
@@ -43,36 +78,209 @@ class CapabilityModel(PydanticObjectType):
                 return None
 
         elif (settings.DATASOURCE == src.settings.DataSource.PICKLE.value):
-            capability_tuple = _get_capability_from_pickle(parent.id)
-            return capability_tuple[1]
+            return _get_root_capability_from_artifact(parent.id)
         
         else:
             raise Exception(f"Unexpected Datasource: {settings.DATASOURCE}")
 
+    @staticmethod
+    async def _load_root_capabilities(context: Dict, capability_ids: List[str]) -> Dict[str, Capability]:
+        with _get_request_session_scope(context).activate():
+            return await CapabilityQueryGenerator.root_capabilities_async(capability_ids)
+
+def _recommended_alternatives(capability_match: CapabilityMatch, capability_ids: Optional[List[str]] = None, limit: Optional[int] = None) -> List[List[Tuple[int, Capability]]]:
+    # Capabilities not implemented, by title, each with the positions of its alternative implementations
+    not_implemented_by_capability: Dict[str, List[Tuple[int, Capability]]] = {}
+
+    for position, capability in capability_match.not_implemented():
+        if (capability_ids is None or capability.id in capability_ids):
+            not_implemented_by_capability.setdefault(capability.id, []).append((position, capability))
+
+    # Don't show alternative implementations for capabilities already implemented
+    recommended = sorted(not_implemented_by_capability.values(), key=lambda x: x[0][1].title)
+
+    if (limit is not None):
+        recommended = recommended[:limit]
+
+    return recommended
+
+def _build_recommendations(capability_match: CapabilityMatch, recommended: List[List[Tuple[int, Capability]]]) -> List[Recommendations]:
+    return [Recommendations(capability=alternatives[0][1], implementations=[capability_match.implementation_plan(position) for position, _ in alternatives]) for alternatives in recommended]
+
 class ResourceCapabilityReport(graphene.ObjectType):
     logical_name = graphene.String(required=True)
     currently_implements = graphene.List(CapabilityModel, required=True)
-    supports_but_does_not_currently_implement = graphene.List(graphene.NonNull(Recommendations_Model), required=True)
+    supports_but_does_not_currently_implement = graphene.List(graphene.NonNull(Recommendations_Model), required=True, capability_ids=graphene.List(graphene.NonNull(graphene.String)), limit=graphene.Int())
+
+    @staticmethod
+    async def resolve_supports_but_does_not_currently_implement(parent: Dict, info, capability_ids: Optional[List[str]] = None, limit: Optional[int] = None):
+        capability_match: CapabilityMatch = parent["capability_match"]
+        recommended = _recommended_alternatives(capability_match, capability_ids, limit)
+
+        # Implementation plans are only built when the query selects them, on a thread like the scan itself
+        if (not _selects_field(info, "implementations")):
+            return [Recommendations(capability=alternatives[0][1], implementations=[]) for alternatives in recommended]
+
+        return await asyncio.get_running_loop().run_in_executor(None, copy_context().run, _build_recommendations, capability_match, recommended)
+
+def _resource_report(logical_name: str, capability_match: CapabilityMatch) -> Dict:
+    # Recommendations are resolved by ResourceCapabilityReport, from the match kept here
+    return {"logical_name": logical_name, "currently_implements": sorted(capability_match.implements(), key=lambda x: x.title), "capability_match": capability_match}
+
+def _scan_template(template: str) -> List[Dict]:
+    retval = []
+    parsed_template = src.cfn_lint.CfnTemplate.parse_raw(template)
+
+    for logical_name in parsed_template.Resources.keys():
+        retval.append(_resource_report(logical_name, parsed_template.match_resource_capabilities(logical_name)))
+
+    return(retval)
+
+def _diff_templates(base: str, head: str) -> List[src.template_diff.ResourceCapabilityDiff]:
+    return src.template_diff.diff_templates(src.cfn_lint.CfnTemplate.parse_raw(base), src.cfn_lint.CfnTemplate.parse_raw(head))
+
+class TemplateScanReport(graphene.ObjectType):
+    resources = graphene.List(graphene.NonNull(ResourceCapabilityReport))
+    error = graphene.String()
+
+# Normalized scan reports list every capability and distinct implementation plan once, in tables at the top of the
+# response, with resources referring to them by id. Large templates repeat the same capabilities (and their root
+# capability chains) and plans across many resources, which otherwise dominates the size of the response.
+class NormalizedImplementationPlan(graphene.ObjectType):
+    id = graphene.Int(required=True)
+    resources = graphene.List(graphene.NonNull(Resource_Model), required=True)
+
+class NormalizedRecommendation(graphene.ObjectType):
+    capability_id = graphene.String(required=True)
+    implementation_plan_ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+
+class NormalizedResourceReport(graphene.ObjectType):
+    logical_name = graphene.String(required=True)
+    currently_implements = graphene.List(graphene.NonNull(graphene.String), required=True)
+    supports_but_does_not_currently_implement = graphene.List(graphene.NonNull(NormalizedRecommendation), required=True)
+
+class NormalizedTemplateScanReport(graphene.ObjectType):
+    resources = graphene.List(graphene.NonNull(NormalizedResourceReport))
+    error = graphene.String()
+
+class NormalizedScanReport(graphene.ObjectType):
+    capabilities = graphene.List(graphene.NonNull(CapabilityModel), required=True)
+    implementation_plans = graphene.List(graphene.NonNull(NormalizedImplementationPlan), required=True)
+    templates = graphene.List(graphene.NonNull(NormalizedTemplateScanReport), required=True)
+
+class _ScanNormalizer():
+
+    def __init__(self, build_implementation_plans: bool, capability_ids: Optional[List[str]] = None, limit: Optional[int] = None):
+        self.build_implementation_plans = build_implementation_plans
+        self.capability_ids = capability_ids
+        self.limit = limit
+        self.capabilities: Dict[str, Capability] = {}
+        self.implementation_plans: Dict[Tuple, Dict] = {}
+
+    def _capability_id(self, capability: Capability) -> str:
+        self.capabilities.setdefault(capability.id, capability)
+        return capability.id
+
+    def _implementation_plan_id(self, implementation_plan: ImplementationPlan) -> int:
+        key = tuple((resource.type, resource.action, tuple((resource_property.name, resource_property.value) for resource_property in resource.properties)) for resource in implementation_plan.resources)
+
+        if (key not in self.implementation_plans):
+            self.implementation_plans[key] = {"id": len(self.implementation_plans), "resources": implementation_plan.resources}
+
+        return self.implementation_plans[key]["id"]
+
+    def resource_report(self, logical_name: str, capability_match: CapabilityMatch) -> Dict:
+        recommendations = []
+
+        for alternatives in _recommended_alternatives(capability_match, self.capability_ids, self.limit):
+            implementation_plan_ids = []
+
+            if (self.build_implementation_plans):
+                implementation_plan_ids = [self._implementation_plan_id(capability_match.implementation_plan(position)) for position, _ in alternatives]
+
+            recommendations.append({"capability_id": self._capability_id(alternatives[0][1]), "implementation_plan_ids": implementation_plan_ids})
+
+        currently_implements = [self._capability_id(capability) for capability in sorted(capability_match.implements(), key=lambda x: x.title)]
+        return {"logical_name": logical_name, "currently_implements": currently_implements, "supports_but_does_not_currently_implement": recommendations}
+
+    def report(self, template_scans: List[src.cfn_lint.TemplateScan]) -> Dict:
+        templates = [{"resources": [self.resource_report(logical_name, capability_match) for logical_name, capability_match in template_scan.resources] if template_scan.resources is not None else None, "error": template_scan.error} for template_scan in template_scans]
+        return {"capabilities": list(self.capabilities.values()), "implementation_plans": list(self.implementation_plans.values()), "templates": templates}
+
+resource_change_enum = graphene.Enum.from_enum(src.template_diff.ResourceChange)
+
+class ResourceCapabilityDiff(graphene.ObjectType):
+    logical_name = graphene.String(required=True)
+    change = graphene.Field(resource_change_enum, required=True)
+    gained = graphene.List(graphene.NonNull(CapabilityModel), required=True)
+    lost = graphene.List(graphene.NonNull(CapabilityModel), required=True)
+
+class ScanCacheStats(graphene.ObjectType):
+    hits = graphene.Int(required=True)
+    disk_hits = graphene.Int(required=True)
+    misses = graphene.Int(required=True)
+    size = graphene.Int(required=True)
+    max_size = graphene.Int(required=True)
+
+coverage_grouping_enum = graphene.Enum.from_enum(src.scan_index.CoverageGrouping)
+
+class IndexedResource(graphene.ObjectType):
+    stack_id = graphene.String(required=True)
+    account = graphene.String()
+    logical_name = graphene.String(required=True)
+    resource_type = graphene.String(required=True)
+
+class CapabilityCoverage(graphene.ObjectType):
+    key = graphene.String()
+    implemented = graphene.Int(required=True)
+    total = graphene.Int(required=True)
 
 class Query(graphene.ObjectType):
     scan_cloudformation_template = graphene.List(graphene.NonNull(ResourceCapabilityReport), required=True, template=graphene.String(required=True))
+    scan_cloudformation_templates = graphene.List(graphene.NonNull(TemplateScanReport), required=True, templates=graphene.List(graphene.NonNull(graphene.String), required=True))
+    scan_cloudformation_templates_normalized = graphene.Field(NormalizedScanReport, required=True, templates=graphene.List(graphene.NonNull(graphene.String), required=True), capability_ids=graphene.List(graphene.NonNull(graphene.String)), limit=graphene.Int())
+    scan_template_diff = graphene.List(graphene.NonNull(ResourceCapabilityDiff), required=True, base=graphene.String(required=True), head=graphene.String(required=True))
+    scan_cache_stats = graphene.Field(ScanCacheStats, required=True)
+
+    # Answered from the scan index (index_stacks.py), without scanning anything
+    resources_lacking_capability = graphene.List(graphene.NonNull(IndexedResource), required=True, capability_id=graphene.String(required=True), resource_type=graphene.String(), account=graphene.String(), limit=graphene.Int(default_value=1000))
+    capability_coverage = graphene.List(graphene.NonNull(CapabilityCoverage), required=True, capability_id=graphene.String(required=True), group_by=graphene.Argument(coverage_grouping_enum, default_value=src.scan_index.CoverageGrouping.ACCOUNT), resource_type=graphene.String())
 
     @staticmethod
-    def resolve_scan_cloudformation_template(root, info, template: str):
-        retval = []
-        parsed_template = src.cfn_lint.CfnTemplate.parse_raw(template)
+    async def resolve_scan_cloudformation_template(root, info, template: str):
+        # The NDJSON endpoint executes the query once per resource, with that resource already matched
+        if (isinstance(info.context, dict) and "streamed_resource" in info.context):
+            return [_resource_report(*info.context["streamed_resource"])]
 
-        for logical_name in parsed_template.Resources.keys():
-            recommendations_dict: Dict[str, Recommendations] = {}
-            currently_implements, supports_but_does_not_currently_implement = parsed_template.get_resource_internal_capabilities(logical_name)
-            
-            for capability, implementation in supports_but_does_not_currently_implement:    
-                if (capability.id not in recommendations_dict):
-                    recommendations_dict[capability.id] = Recommendations(capability=capability, implementations=[])
+        # Scanning is CPU bound, it runs on a thread so the event loop keeps serving other requests
+        return await asyncio.get_running_loop().run_in_executor(None, copy_context().run, _scan_template, template)
+
+    @staticmethod
+    async def resolve_scan_cloudformation_templates(root, info, templates: List[str]):
+        # Waiting on the process pool happens on a thread, leaving the event loop free
+        template_scans = await asyncio.get_running_loop().run_in_executor(None, copy_context().run, src.cfn_lint.scan_templates, templates)
+        return [{"resources": [_resource_report(logical_name, capability_match) for logical_name, capability_match in template_scan.resources] if template_scan.resources is not None else None, "error": template_scan.error} for template_scan in template_scans]
+
+    @staticmethod
+    async def resolve_scan_cloudformation_templates_normalized(root, info, templates: List[str], capability_ids: Optional[List[str]] = None, limit: Optional[int] = None):
+        template_scans = await asyncio.get_running_loop().run_in_executor(None, copy_context().run, src.cfn_lint.scan_templates, templates)
 
-                recommendations_dict[capability.id].implementations.append(implementation)
+        # Implementation plans are only built when the query selects them, or the ids recommendations refer to them by
+        build_implementation_plans = _selects_field(info, "implementationPlans") or _selects_field(info, "implementationPlanIds", nested=True)
+        return _ScanNormalizer(build_implementation_plans, capability_ids, limit).report(template_scans)
 
-            # Don't show alternative implementations for capabilities already implemented
-            retval.append({"logical_name": logical_name, "currently_implements": sorted(currently_implements, key=lambda x: x.title), "supports_but_does_not_currently_implement": sorted(recommendations_dict.values(), key=lambda x: x.capability.title)})
-        
-        return(retval)
\ No newline at end of file
+    @staticmethod
+    async def resolve_scan_template_diff(root, info, base: str, head: str):
+        return await asyncio.get_running_loop().run_in_executor(None, copy_context().run, _diff_templates, base, head)
+
+    @staticmethod
+    def resolve_scan_cache_stats(root, info):
+        return src.scan_cache.get_scan_cache().stats()
+
+    @staticmethod
+    def resolve_resources_lacking_capability(root, info, capability_id: str, resource_type: Optional[str] = None, account: Optional[str] = None, limit: int = 1000):
+        return src.scan_index.get_scan_index().resources_lacking(capability_id, resource_type, account, limit)
+
+    @staticmethod
+    def resolve_capability_coverage(root, info, capability_id: str, group_by: src.scan_index.CoverageGrouping = src.scan_index.CoverageGrouping.ACCOUNT, resource_type: Optional[str] = None):
+        return src.scan_index.get_scan_index().coverage(capability_id, group_by, resource_type)
@@ -1,14 +1,103 @@
 from __future__ import annotations
-from typing import Optional, Tuple, cast, Dict
-from gomboctypes.models import Capability, NodeLabels, EdgeLabels, Relation, UseCase
-from neo4j import Neo4jDriver, GraphDatabase
-import networkx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, TypeVar, Dict
+from gomboctypes.models import Capability, CfnResource, NodeLabels, EdgeLabels, Relation, UseCase
+import asyncio
+import logging
+import re
+import threading
 
 from typing import List
 from src.settings import Settings
+import src.metrics
+from src.offline_graph import get_active_offline_graph
+from src.resource_fingerprints import GraphNode
 
+# neo4j and networkx are only imported once a query runs, keeping them out of the Lambda cold start when
+# DATASOURCE=pickle
+if (TYPE_CHECKING):
+    import networkx
+    from neo4j import Neo4jDriver, Result
+
+logger = logging.getLogger(__name__)
 settings = Settings()
-driver = cast(Neo4jDriver, GraphDatabase.driver(settings.NEO4J_URL, auth=(settings.NEO4j_USER, settings.NEO4j_PASSWORD)))
+
+@lru_cache(maxsize=None)
+def get_driver() -> Neo4jDriver:
+    from neo4j import GraphDatabase
+
+    if (not (settings.NEO4J_URL and settings.NEO4j_USER and settings.NEO4j_PASSWORD)):
+        raise Exception("NEO4J_URL, NEO4j_USER and NEO4j_PASSWORD must be set to query Neo4j")
+
+    return GraphDatabase.driver(
+        settings.NEO4J_URL,
+        auth=(settings.NEO4j_USER, settings.NEO4j_PASSWORD),
+        max_connection_pool_size=settings.NEO4J_MAX_CONNECTION_POOL_SIZE,
+        connection_timeout=settings.NEO4J_CONNECTION_TIMEOUT,
+        connection_acquisition_timeout=settings.NEO4J_CONNECTION_ACQUISITION_TIMEOUT)
+
+@lru_cache(maxsize=None)
+def _get_executor() -> ThreadPoolExecutor:
+    # The pinned 4.x driver is blocking only, async callers get one thread per pooled connection
+    return ThreadPoolExecutor(max_workers=settings.NEO4J_MAX_CONNECTION_POOL_SIZE, thread_name_prefix="neo4j")
+
+# Ids are embedded in Cypher fragments as placeholders carrying their own (hex encoded) value, so fragments built
+# separately can be concatenated. Query replaces them with numbered parameters ($id0, $id1...) right before running,
+# which keeps the statement text identical across ids and lets Neo4j re-use its cached plan.
+_ID_PLACEHOLDER = re.compile(r"\$__id_([0-9a-f]*)")
+
+# An id that is a variable bound earlier in the statement (e.g. by UNWIND), matched as-is instead of as a parameter
+class CypherVariable(str):
+    pass
+
+def id_parameter(id: str) -> str:
+    if (isinstance(id, CypherVariable)):
+        return id
+
+    return f"$__id_{id.encode('utf-8').hex()}"
+
+_active_session_scope: ContextVar[Optional[SessionScope]] = ContextVar("neo4j_session_scope", default=None)
+T = TypeVar("T")
+
+class SessionScope():
+    # Queries run while a scope is active share its session, opened on first use. Sessions aren't thread-safe, so
+    # queries coming from several threads take turns.
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+        self._tokens: List[Any] = []
+
+    @contextmanager
+    def activate(self):
+        token = _active_session_scope.set(self)
+        try:
+            yield self
+        finally:
+            _active_session_scope.reset(token)
+
+    def __enter__(self):
+        self._tokens.append(_active_session_scope.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_session_scope.reset(self._tokens.pop())
+        self.close()
+
+    def run(self, query: Any, parameters: Dict[str, Any], consume: Callable[[Result], T]) -> T:
+        with self._lock:
+            if (self._session is None):
+                self._session = get_driver().session()
+
+            return consume(self._session.run(query, parameters))
+
+    def close(self):
+        with self._lock:
+            if (self._session is not None):
+                self._session.close()
+                self._session = None
 
 class QueryGenerator():
     def __init__(self, preceding_cypher_string: str = "", column_name: str = "", id: str = "", hide_label: bool = False):
@@ -18,7 +107,7 @@ class QueryGenerator():
             label = self.get_node_label().value
 
         if (id):
-            self._cypher_string = f"{preceding_cypher_string}({column_name}{label} {{id: '{id}'}})"
+            self._cypher_string = f"{preceding_cypher_string}({column_name}{label} {{id: {id_parameter(id)}}})"
         else:
             self._cypher_string = f"{preceding_cypher_string}({column_name}{label})"
 
@@ -33,29 +122,87 @@ class QueryGenerator():
         return self._cypher_string
 
 class Query():
-    def __init__(self, querystring: str):
+    def __init__(self, querystring: str, parameters: Optional[Dict] = None):
         self._querystring = querystring
+        self._parameters = parameters or {}
 
     def union(self, other: Query):
-        return Query(self._querystring + " UNION " + other._querystring)
+        return Query(self._querystring + " UNION " + other._querystring, {**self._parameters, **other._parameters})
+
+    def statement(self) -> Tuple[str, Dict[str, Any]]:
+        parameters = dict(self._parameters)
+        parameter_names: Dict[str, str] = {}
+
+        def to_parameter(match):
+            if (match.group(0) not in parameter_names):
+                parameter_names[match.group(0)] = f"id{len(parameter_names)}"
+                parameters[parameter_names[match.group(0)]] = bytes.fromhex(match.group(1)).decode("utf-8")
+
+            return f"${parameter_names[match.group(0)]}"
+
+        return (_ID_PLACEHOLDER.sub(to_parameter, self._querystring), parameters)
+
+    def run(self, consume: Callable[[Result], T]) -> T:
+        querystring, parameters = self.statement()
+
+        if (logger.isEnabledFor(logging.DEBUG)):
+            logger.debug("Executing Cypher query", extra={"cypher": querystring, "parameters": parameters})
+
+        # An exported graph only answers the queries generate.py needs, through the generators' own offline paths
+        if (get_active_offline_graph() is not None):
+            raise Exception(f"Query isn't answerable from a graph dump: {querystring}")
+
+        from neo4j import Query as CypherQuery
+        query = CypherQuery(querystring, timeout=settings.NEO4J_QUERY_TIMEOUT)
+        session_scope = _active_session_scope.get()
+        src.metrics.count("neo4j_queries")
+
+        with src.metrics.phase("neo4j"):
+            if (session_scope):
+                return session_scope.run(query, parameters, consume)
+
+            with get_driver().session() as session:
+                return consume(session.run(query, parameters))
+
+    async def _run_async(self, function: Callable[..., T], *args) -> T:
+        # Carries the caller's context over, so an active SessionScope is still used from the worker thread
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), copy_context().run, function, *args)
 
     def parse_column_as_model(self, column_name: str, pydantic_model):
-        with driver.session() as session:
-            print(f"Executing Query: {self._querystring}")
-            result = session.run(self._querystring)
-            return [pydantic_model.parse_obj(record[column_name]._properties) for record in result if record[column_name]]
+        return self.run(lambda result: [pydantic_model.parse_obj(record[column_name]._properties) for record in result if record[column_name]])
+
+    async def parse_column_as_model_async(self, column_name: str, pydantic_model):
+        return await self._run_async(self.parse_column_as_model, column_name, pydantic_model)
+
+    def parse_column_as_model_by_key(self, key_column_name: str, column_name: str, pydantic_model):
+        return self.run(lambda result: {record[key_column_name]: pydantic_model.parse_obj(record[column_name]._properties) for record in result if record[column_name]})
+
+    async def parse_column_as_model_by_key_async(self, key_column_name: str, column_name: str, pydantic_model):
+        return await self._run_async(self.parse_column_as_model_by_key, key_column_name, column_name, pydantic_model)
 
     def parse_column_as_relation(self, column_name: str):
-        with driver.session() as session:
-            print(f"Executing Query: {self._querystring}")
-            result = session.run(self._querystring)
-            records = [record[column_name] for record in result]
-            return [Relation(
-                source_label=NodeLabels.parse_from_iterable(record.start_node.labels),
-                source_id=record.start_node._properties["id"],
-                relation_label=EdgeLabels.parse_string(record.type),
-                target_label=NodeLabels.parse_from_iterable(record.end_node.labels),
-                target_id=record.end_node._properties["id"]) for record in records]
+        records = self.run(lambda result: [record[column_name] for record in result])
+        return [Relation(
+            source_label=NodeLabels.parse_from_iterable(record.start_node.labels),
+            source_id=record.start_node._properties["id"],
+            relation_label=EdgeLabels.parse_string(record.type),
+            target_label=NodeLabels.parse_from_iterable(record.end_node.labels),
+            target_id=record.end_node._properties["id"]) for record in records]
+
+    @staticmethod
+    def graph_content() -> Tuple[List[Tuple[GraphNode, Dict[str, Any]]], List[Tuple[GraphNode, str, GraphNode]]]:
+        # Every node with its properties and every relationship, so generate.py can tell which parts of the graph changed
+        offline_graph = get_active_offline_graph()
+
+        if (offline_graph is not None):
+            return offline_graph.graph_content()
+
+        nodes = Query("MATCH (node) RETURN labels(node) AS labels, properties(node) AS properties").run(
+            lambda result: [((NodeLabels.parse_from_iterable(record["labels"]).value, record["properties"]["id"]), record["properties"]) for record in result])
+        relationships = Query("MATCH (source)-[relation]->(target) RETURN labels(source) AS source_labels, source.id AS source_id, type(relation) AS type, labels(target) AS target_labels, target.id AS target_id").run(
+            lambda result: [((NodeLabels.parse_from_iterable(record["source_labels"]).value, record["source_id"]), record["type"], (NodeLabels.parse_from_iterable(record["target_labels"]).value, record["target_id"])) for record in result])
+
+        return (nodes, relationships)
 
 class UseCaseQueryGenerator(QueryGenerator):
 
@@ -111,6 +258,58 @@ class CapabilityQueryGenerator(QueryGenerator):
     def provides_capability(self, capability_column: str = "", capability_id: str = ""):
         return CapabilityQueryGenerator(f"{self._cypher_string}-[{EdgeLabels.PROVIDES_CAPABILITY.value}*]->", column_name=capability_column, id=capability_id)
 
+    @staticmethod
+    def root_capabilities_query(capability_ids: List[str]) -> Query:
+        # Batched form of provides_capability(...).asQuery("last(collect(dest_c))"), keyed by the starting capability id
+        query = (f"UNWIND $capability_ids AS capability_id " +
+            f"MATCH path=(capability{NodeLabels.CAPABILITY.value} {{id: capability_id}})-[{EdgeLabels.PROVIDES_CAPABILITY.value}*]->(dest_c{NodeLabels.CAPABILITY.value}) " +
+            f"WITH capability_id, dest_c, max(length(path)) AS depth ORDER BY depth, dest_c.id " +
+            f"RETURN capability_id, last(collect(dest_c)) AS result")
+
+        return Query(query, {"capability_ids": capability_ids})
+
+    @staticmethod
+    def root_capabilities(capability_ids: List[str]) -> Dict[str, Capability]:
+        return CapabilityQueryGenerator.root_capabilities_query(capability_ids).parse_column_as_model_by_key("capability_id", "result", Capability)
+
+    @staticmethod
+    async def root_capabilities_async(capability_ids: List[str]) -> Dict[str, Capability]:
+        return await CapabilityQueryGenerator.root_capabilities_query(capability_ids).parse_column_as_model_by_key_async("capability_id", "result", Capability)
+
+    @staticmethod
+    def all_capabilities() -> List[Capability]:
+        offline_graph = get_active_offline_graph()
+
+        # A dump holds every Capability node, Neo4j's are loaded the usual way
+        if (offline_graph is not None):
+            return sorted((Capability.parse_obj(node._properties) for node in offline_graph.all_nodes(NodeLabels.CAPABILITY.value.lstrip(":"))), key=lambda capability: capability.id)
+
+        return Capability.load_all()
+
+    @staticmethod
+    def ancestor_capabilities(capability_ids: List[str]) -> Dict[str, List[Capability]]:
+        # Every capability reached through PROVIDES_CAPABILITY, once, ordered by the longest path to it, so each comes
+        # after the capabilities it's provided through and the root capability is the last one
+        offline_graph = get_active_offline_graph()
+
+        if (offline_graph is not None):
+            with src.metrics.phase("offline_graph"):
+                return {capability_id: [Capability.parse_obj(ancestor._properties) for ancestor in ancestors] for capability_id, ancestors in offline_graph.ancestor_capabilities(capability_ids).items()}
+
+        query = (f"UNWIND $capability_ids AS capability_id " +
+            f"MATCH path=(capability{NodeLabels.CAPABILITY.value} {{id: capability_id}})-[{EdgeLabels.PROVIDES_CAPABILITY.value}*]->(dest_c{NodeLabels.CAPABILITY.value}) " +
+            f"WITH capability_id, dest_c, max(length(path)) AS depth ORDER BY depth, dest_c.id " +
+            f"RETURN capability_id, collect(dest_c) AS ancestors")
+
+        ancestors: Dict[str, List[Capability]] = {capability_id: [] for capability_id in capability_ids}
+
+        def consume(result):
+            for record in result:
+                ancestors[record["capability_id"]] = [Capability.parse_obj(ancestor._properties) for ancestor in record["ancestors"]]
+
+        Query(query, {"capability_ids": capability_ids}).run(consume)
+        return ancestors
+
 class PropertyQueryGenerator(QueryGenerator):
 
     @staticmethod
@@ -165,20 +364,31 @@ class ResourceQueryGenerator(QueryGenerator):
     def has_subproperty(self, property_column: str = "", property_id: str = ""):
         return PropertyQueryGenerator(f"{self._cypher_string}-[{EdgeLabels.HAS_SUBPROPERTY.value}*1..]->", column_name=property_column, id=property_id)
 
+    @staticmethod
+    def all_resources() -> List[CfnResource]:
+        offline_graph = get_active_offline_graph()
+
+        if (offline_graph is not None):
+            return [CfnResource.parse_obj(node._properties) for node in offline_graph.all_nodes(NodeLabels.CFN_RESOURCE.value.lstrip(":"))]
+
+        return ResourceQueryGenerator(column_name="resource").asQuery("resource").parse_column_as_model("resource", CfnResource)
+
     @staticmethod
     def relations(resource_id: str):
-        query = (f"MATCH (resource{NodeLabels.CFN_RESOURCE.value} {{id:'{resource_id}'}})-[{EdgeLabels.HAS_SUBPROPERTY.value}*1..]->(property{NodeLabels.CFN_PROPERTY.value})-[relation]-(other) " +
+        query = (f"MATCH (resource{NodeLabels.CFN_RESOURCE.value} {{id: $resource_id}})-[{EdgeLabels.HAS_SUBPROPERTY.value}*1..]->(property{NodeLabels.CFN_PROPERTY.value})-[relation]-(other) " +
             f"WHERE type(relation) <> '{EdgeLabels.HAS_SUBPROPERTY.value.replace(':','')}' "
             f"RETURN resource, property, relation, other " +
             f"UNION " +
-            f"MATCH (resource{NodeLabels.CFN_RESOURCE.value} {{id:'{resource_id}'}})-[relation]-(other) " +
+            f"MATCH (resource{NodeLabels.CFN_RESOURCE.value} {{id: $resource_id}})-[relation]-(other) " +
             f"WHERE type(relation) <> '{EdgeLabels.HAS_SUBPROPERTY.value.replace(':','')}' "
             f"RETURN resource, null as property, relation, other")
         
-        return Query(query).parse_column_as_relation("relation")
+        return Query(query, {"resource_id": resource_id}).parse_column_as_relation("relation")
 
     @staticmethod
-    def internal_capabilities_implementations_cypher_query(resource_id: str):
+    def internal_capabilities_implementations_cypher_query(resource_ids: List[str]):
+        # Implementations of several resources at once, each row keyed by its resource_id column
+        resource_id = CypherVariable("resource_id")
         this_resource = ResourceQueryGenerator(id=resource_id)
         query_fragments: List[Dict[str, str]] = []
 
@@ -210,63 +420,80 @@ class ResourceQueryGenerator(QueryGenerator):
 
         for fragments in query_fragments:
             if "other_resource_configuration" in fragments:                
-                query_statements.append(f"MATCH internal_resource_configuration={fragments['internal_resource_configuration']}, other_resource_configuration={fragments['other_resource_configuration']} RETURN internal_resource_configuration, other_resource_configuration, capability")
+                query_statements.append(f"UNWIND $resource_ids AS resource_id MATCH internal_resource_configuration={fragments['internal_resource_configuration']}, other_resource_configuration={fragments['other_resource_configuration']} RETURN resource_id, internal_resource_configuration, other_resource_configuration, capability")
             else:
-                query_statements.append(f"MATCH internal_resource_configuration={fragments['internal_resource_configuration']} RETURN internal_resource_configuration, NULL as other_resource_configuration, capability")
+                query_statements.append(f"UNWIND $resource_ids AS resource_id MATCH internal_resource_configuration={fragments['internal_resource_configuration']} RETURN resource_id, internal_resource_configuration, NULL as other_resource_configuration, capability")
 
-        return " UNION ".join(query_statements)
+        return Query(" UNION ".join(query_statements), {"resource_ids": resource_ids})
 
     @staticmethod
     def get_capabilities_implementations(resource_id: str):
-        capability_implementations: List[Tuple[Capability, networkx.DiGraph]] = []
+        return ResourceQueryGenerator.get_capabilities_implementations_batch([resource_id])[resource_id]
 
-        with driver.session() as session:
-            print(f"Running query: {ResourceQueryGenerator.internal_capabilities_implementations_cypher_query(resource_id)}")
+    @staticmethod
+    def get_capabilities_implementations_batch(resource_ids: List[str]) -> Dict[str, List[Tuple[Capability, networkx.DiGraph]]]:
+        query = ResourceQueryGenerator.internal_capabilities_implementations_cypher_query(resource_ids)
+        capability_implementations: Dict[str, List[Tuple[Capability, networkx.DiGraph]]] = {resource_id: [] for resource_id in resource_ids}
+
+        def consume(result):
+            for record in result:
+                capability_implementations[record["resource_id"]].append(ResourceQueryGenerator._parse_capability_implementation(record))
+
+        # Walked directly over an exported graph while one is active (generate.py --graph-dump)
+        offline_graph = get_active_offline_graph()
 
-            for record in session.run(ResourceQueryGenerator.internal_capabilities_implementations_cypher_query(resource_id)):
-                capability = Capability.parse_obj(record["capability"]._properties)
-                graph = networkx.DiGraph()
+        if (offline_graph is not None):
+            with src.metrics.phase("offline_graph"):
+                consume(offline_graph.implementation_records(resource_ids))
+        else:
+            query.run(consume)
+
+        return(capability_implementations)
 
-                for node in record["internal_resource_configuration"].nodes:
-                    if (NodeLabels.parse_from_iterable(node.labels) == NodeLabels.CFN_RESOURCE):
-                        graph.add_node((True, node._properties["id"]), label=NodeLabels.CFN_RESOURCE)
+    @staticmethod
+    def _parse_capability_implementation(record) -> Tuple[Capability, networkx.DiGraph]:
+        capability = Capability.parse_obj(record["capability"]._properties)
+        import networkx
+        graph = networkx.DiGraph()
 
-                for relationship in record["internal_resource_configuration"].relationships:
-                    if (EdgeLabels.parse_string(relationship.type) != EdgeLabels.ENABLES_INTERNAL_CAPABILITY):
-                        start_node_properties = relationship.start_node._properties
-                        end_node_properties = relationship.end_node._properties
+        for node in record["internal_resource_configuration"].nodes:
+            if (NodeLabels.parse_from_iterable(node.labels) == NodeLabels.CFN_RESOURCE):
+                graph.add_node((True, node._properties["id"]), label=NodeLabels.CFN_RESOURCE)
 
-                        start_node_label = NodeLabels.parse_from_iterable(relationship.start_node.labels)
-                        end_node_label = NodeLabels.parse_from_iterable(relationship.end_node.labels)
+        for relationship in record["internal_resource_configuration"].relationships:
+            if (EdgeLabels.parse_string(relationship.type) != EdgeLabels.ENABLES_INTERNAL_CAPABILITY):
+                start_node_properties = relationship.start_node._properties
+                end_node_properties = relationship.end_node._properties
 
-                        start_node_tuple = (start_node_label in [NodeLabels.CFN_RESOURCE, NodeLabels.CFN_PROPERTY], start_node_properties["id"])
-                        end_node_tuple = (end_node_label in [NodeLabels.CFN_RESOURCE, NodeLabels.CFN_PROPERTY], end_node_properties["id"])
+                start_node_label = NodeLabels.parse_from_iterable(relationship.start_node.labels)
+                end_node_label = NodeLabels.parse_from_iterable(relationship.end_node.labels)
 
-                        graph.add_edge(start_node_tuple, end_node_tuple, label=EdgeLabels.parse_string(relationship.type))
-                        graph.nodes[start_node_tuple]["label"] = start_node_label
-                        graph.nodes[end_node_tuple]["label"] = end_node_label
+                start_node_tuple = (start_node_label in [NodeLabels.CFN_RESOURCE, NodeLabels.CFN_PROPERTY], start_node_properties["id"])
+                end_node_tuple = (end_node_label in [NodeLabels.CFN_RESOURCE, NodeLabels.CFN_PROPERTY], end_node_properties["id"])
 
-                if (record.get("other_resource_configuration")):
-                    for relationship in record["other_resource_configuration"]:
-                        if(EdgeLabels.parse_string(relationship.type) != EdgeLabels.PROVIDES_CAPABILITY):
-                            start_node_tuple = (False, relationship.start_node._properties["id"])
-                            end_node_tuple = (False, relationship.end_node._properties["id"])
+                graph.add_edge(start_node_tuple, end_node_tuple, label=EdgeLabels.parse_string(relationship.type))
+                graph.nodes[start_node_tuple]["label"] = start_node_label
+                graph.nodes[end_node_tuple]["label"] = end_node_label
 
-                            graph.add_edge(start_node_tuple, end_node_tuple, label=EdgeLabels.parse_string(relationship.type))
-                            graph.nodes[start_node_tuple]["label"] = NodeLabels.parse_from_iterable(relationship.start_node.labels)
-                            graph.nodes[end_node_tuple]["label"] = NodeLabels.parse_from_iterable(relationship.end_node.labels)
+        if (record.get("other_resource_configuration")):
+            for relationship in record["other_resource_configuration"]:
+                if(EdgeLabels.parse_string(relationship.type) != EdgeLabels.PROVIDES_CAPABILITY):
+                    start_node_tuple = (False, relationship.start_node._properties["id"])
+                    end_node_tuple = (False, relationship.end_node._properties["id"])
 
-                # Delete Usecases and connect the nodes that uses and can_be_used_to directly
-                for usecase_id in [node_id for node_id in graph.nodes if graph.nodes[node_id]["label"] == NodeLabels.USE_CASE]:
-                    usecase_in_edges = [edge for edge in graph.in_edges(usecase_id)]
-                    can_be_used_to_node_id = [edge[0] for edge in usecase_in_edges if graph.edges[edge]["label"] == EdgeLabels.CAN_BE_USED_TO][0]
-                    usecase_node_id = usecase_in_edges[0][1]
+                    graph.add_edge(start_node_tuple, end_node_tuple, label=EdgeLabels.parse_string(relationship.type))
+                    graph.nodes[start_node_tuple]["label"] = NodeLabels.parse_from_iterable(relationship.start_node.labels)
+                    graph.nodes[end_node_tuple]["label"] = NodeLabels.parse_from_iterable(relationship.end_node.labels)
 
-                    for using_other_resource_to in [edge for edge in usecase_in_edges if graph.edges[edge]["label"] == EdgeLabels.USES_OTHER_RESOURCE_TO]:
-                        graph.add_edge(using_other_resource_to[0], can_be_used_to_node_id, label=EdgeLabels.USES_OTHER_RESOURCE_TO)
+        # Delete Usecases and connect the nodes that uses and can_be_used_to directly
+        for usecase_id in [node_id for node_id in graph.nodes if graph.nodes[node_id]["label"] == NodeLabels.USE_CASE]:
+            usecase_in_edges = [edge for edge in graph.in_edges(usecase_id)]
+            can_be_used_to_node_id = [edge[0] for edge in usecase_in_edges if graph.edges[edge]["label"] == EdgeLabels.CAN_BE_USED_TO][0]
+            usecase_node_id = usecase_in_edges[0][1]
 
-                    graph.remove_node(usecase_node_id)
+            for using_other_resource_to in [edge for edge in usecase_in_edges if graph.edges[edge]["label"] == EdgeLabels.USES_OTHER_RESOURCE_TO]:
+                graph.add_edge(using_other_resource_to[0], can_be_used_to_node_id, label=EdgeLabels.USES_OTHER_RESOURCE_TO)
 
-                capability_implementations.append((capability, graph))
+            graph.remove_node(usecase_node_id)
 
-        return(capability_implementations)
\ No newline at end of file
+        return (capability, graph)
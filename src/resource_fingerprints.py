@@ -0,0 +1,53 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple
+import hashlib
+import json
+from gomboctypes.models import NodeLabels
+
+GraphNode = Tuple[str, str]
+
+# A resource's implementations are read from its own properties, but also from the use cases it uses and from the
+# resources and properties around those. Rather than tracking each query path, resources, properties and use cases
+# connected to each other (ignoring Capability nodes, which everything links to) share one fingerprint, and
+# Capability nodes with their relationships go into a fingerprint shared by every resource. A resource type's
+# implementations can be re-used whenever its fingerprint is unchanged.
+def resource_fingerprints(nodes: List[Tuple[GraphNode, Dict[str, Any]]], relationships: List[Tuple[GraphNode, str, GraphNode]]) -> Dict[str, str]:
+    capability_label = NodeLabels.CAPABILITY.value
+    parents: Dict[GraphNode, GraphNode] = {node: node for node, _ in nodes}
+
+    def find(node: GraphNode) -> GraphNode:
+        parents.setdefault(node, node)
+
+        while (parents[node] != node):
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+
+        return node
+
+    for source, _, target in relationships:
+        if (source[0] != capability_label and target[0] != capability_label):
+            parents[find(source)] = find(target)
+
+    shared_records: List[str] = []
+    component_records: Dict[GraphNode, List[str]] = {}
+
+    for node, properties in nodes:
+        record = json.dumps([node, properties], sort_keys=True, default=str)
+
+        if (node[0] == capability_label):
+            shared_records.append(record)
+        else:
+            component_records.setdefault(find(node), []).append(record)
+
+    for source, relation_type, target in relationships:
+        record = json.dumps([source, relation_type, target])
+
+        if (source[0] == capability_label):
+            shared_records.append(record)
+        else:
+            component_records.setdefault(find(source), []).append(record)
+
+    shared_digest = hashlib.sha256("\n".join(sorted(shared_records)).encode("utf-8")).hexdigest()
+    component_digests = {component: hashlib.sha256("\n".join([shared_digest] + sorted(records)).encode("utf-8")).hexdigest() for component, records in component_records.items()}
+
+    return {node[1]: component_digests[find(node)] for node, _ in nodes if node[0] == NodeLabels.CFN_RESOURCE.value}
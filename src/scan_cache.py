@@ -0,0 +1,151 @@
+from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, FrozenSet, Optional
+from src.capability_index import CapabilityIndex, CapabilityMatch
+import hashlib
+import json
+import logging
+import os
+import threading
+import src.settings
+
+logger = logging.getLogger(__name__)
+
+# Results of matching one resource against the capability artifact, keyed by everything the result depends on: the
+# artifact digest, and the resource as written along with the resources it Refs (CfnTemplate.resource_content).
+# Matches are kept in memory along with the implementation plans built from them, the disk only stores the ids of the
+# implementation edges present.
+class ScanCache():
+
+    def __init__(self, max_size: int, directory: Optional[str] = None, max_disk_size: int = 0):
+        self.max_size = max_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CapabilityMatch] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_entries = 0
+
+        if (self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_entries = len(self._disk_paths())
+
+    @staticmethod
+    def key(artifact_digest: str, resource_content: Any) -> str:
+        # Property order doesn't change the graph, so keys are sorted
+        encoded = json.dumps([artifact_digest, resource_content], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, capability_index: CapabilityIndex) -> Optional[CapabilityMatch]:
+        with self._lock:
+            if (key in self._entries):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        present_edge_ids = self._read_disk(key)
+        capability_match = CapabilityMatch(capability_index, present_edge_ids) if present_edge_ids is not None else None
+
+        with self._lock:
+            if (capability_match is None):
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._put_memory(key, capability_match)
+
+        return capability_match
+
+    def put(self, key: str, capability_match: CapabilityMatch):
+        with self._lock:
+            self._put_memory(key, capability_match)
+
+        self._write_disk(key, capability_match.present_edge_ids)
+
+    def _put_memory(self, key: str, capability_match: CapabilityMatch):
+        if (self.max_size <= 0):
+            return
+
+        self._entries[key] = capability_match
+        self._entries.move_to_end(key)
+
+        while (len(self._entries) > self.max_size):
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _disk_paths(self):
+        return [entry.path for subdirectory in os.scandir(self.directory) if subdirectory.is_dir() for entry in os.scandir(subdirectory.path) if entry.name.endswith(".json")]
+
+    def _read_disk(self, key: str) -> Optional[FrozenSet[int]]:
+        if (not self.directory):
+            return None
+
+        try:
+            with open(self._disk_path(key)) as file:
+                present_edge_ids = frozenset(json.load(file))
+
+            # Recently used entries are the last ones evicted
+            os.utime(self._disk_path(key))
+            return present_edge_ids
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, present_edge_ids: FrozenSet[int]):
+        if (not self.directory):
+            return
+
+        path = self._disk_path(key)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Several processes can share the directory, the rename keeps readers from seeing partial files
+            with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+                json.dump(sorted(present_edge_ids), file)
+
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        except OSError as error:
+            logger.warning(f"Couldn't write scan cache entry {path}: {error}")
+            return
+
+        with self._lock:
+            self._disk_entries += 1
+            prune = self.max_disk_size > 0 and self._disk_entries > self.max_disk_size
+
+        if (prune):
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Drop the least recently used tenth, so pruning doesn't happen on every write once the directory is full
+        paths = []
+
+        for path in self._disk_paths():
+            try:
+                paths.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+
+        paths.sort()
+        excess = len(paths) - int(self.max_disk_size * 0.9)
+
+        for _, path in paths[:max(excess, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_entries = len(paths) - max(excess, 0)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_size}
+
+@lru_cache(maxsize=None)
+def get_scan_cache() -> ScanCache:
+    settings = src.settings.Settings()
+    return ScanCache(settings.SCAN_CACHE_SIZE, settings.SCAN_CACHE_DIR, settings.SCAN_CACHE_DISK_SIZE)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+from enum import Enum
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import hashlib
+import sqlite3
+import threading
+import time
+import src.artifact
+import src.cfn_lint
+import src.settings
+
+# Scan results of every stack, in SQLite, for fleet-wide coverage and gap questions answered without rescanning. One
+# row per (resource, capability its type supports), flagged implemented or not. A stack is only rescanned when its
+# template, its account or the capability artifact changed since it was last indexed.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stacks (
+    stack_id TEXT PRIMARY KEY,
+    account TEXT,
+    template_hash TEXT NOT NULL,
+    artifact_digest TEXT NOT NULL,
+    error TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resource_capabilities (
+    stack_id TEXT NOT NULL,
+    account TEXT,
+    logical_name TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    capability_id TEXT NOT NULL,
+    implemented INTEGER NOT NULL,
+    PRIMARY KEY (stack_id, logical_name, capability_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resource_capabilities_by_capability ON resource_capabilities (capability_id, implemented, resource_type);
+CREATE INDEX IF NOT EXISTS resource_capabilities_by_type ON resource_capabilities (resource_type, capability_id);
+"""
+
+# Coverage groupings, valued by the column they group on
+class CoverageGrouping(Enum):
+    ACCOUNT = "account"
+    RESOURCE_TYPE = "resource_type"
+    STACK = "stack_id"
+
+class StackTemplate(NamedTuple):
+    stack_id: str
+    account: Optional[str]
+    template: str
+
+class IndexedResource(NamedTuple):
+    stack_id: str
+    account: Optional[str]
+    logical_name: str
+    resource_type: str
+
+class CapabilityCoverage(NamedTuple):
+    key: Optional[str]
+    implemented: int
+    total: int
+
+class IngestResult(NamedTuple):
+    indexed: int
+    unchanged: int
+    errors: Dict[str, str]
+
+class ScanIndex():
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._connection:
+            # WAL lets other processes read the index while it's being updated
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def template_hash(template: str) -> str:
+        return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+    def ingest(self, stacks: List[StackTemplate], processes: Optional[int] = None, artifact_path: str = src.artifact.ARTIFACT_PATH) -> IngestResult:
+        artifact_digest = src.artifact.load_artifact(artifact_path).digest
+        hashes = [self.template_hash(stack.template) for stack in stacks]
+
+        # Stacks that failed to scan are always retried, rather than counted as indexed
+        with self._lock:
+            indexed = {stack_id: (account, template_hash, digest) for stack_id, account, template_hash, digest in self._connection.execute("SELECT stack_id, account, template_hash, artifact_digest FROM stacks WHERE error IS NULL")}
+
+        changed = [(stack, template_hash) for stack, template_hash in zip(stacks, hashes) if indexed.get(stack.stack_id) != (stack.account, template_hash, artifact_digest)]
+        template_scans = src.cfn_lint.scan_templates([stack.template for stack, _ in changed], processes, artifact_path)
+        errors: Dict[str, str] = {}
+        indexed_at = time.time()
+
+        with self._lock, self._connection:
+            for (stack, template_hash), template_scan in zip(changed, template_scans):
+                self._connection.execute("DELETE FROM resource_capabilities WHERE stack_id = ?", (stack.stack_id,))
+                self._connection.execute("INSERT OR REPLACE INTO stacks VALUES (?, ?, ?, ?, ?, ?)", (stack.stack_id, stack.account, template_hash, artifact_digest, template_scan.error, indexed_at))
+
+                if (template_scan.error is not None):
+                    errors[stack.stack_id] = template_scan.error
+                    continue
+
+                rows: List[Tuple[str, Optional[str], str, str, str, int]] = []
+
+                for logical_name, capability_match in template_scan.resources:
+                    resource_type = template_scan.resource_types[logical_name]
+                    rows += [(stack.stack_id, stack.account, logical_name, resource_type, capability.id, int(is_implemented)) for capability, is_implemented in zip(capability_match.capability_index.capabilities, capability_match.is_implemented)]
+
+                self._connection.executemany("INSERT OR REPLACE INTO resource_capabilities VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        return IngestResult(indexed=len(changed), unchanged=len(stacks) - len(changed), errors=errors)
+
+    def remove(self, stack_ids: List[str]):
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM resource_capabilities WHERE stack_id = ?", [(stack_id,) for stack_id in stack_ids])
+            self._connection.executemany("DELETE FROM stacks WHERE stack_id = ?", [(stack_id,) for stack_id in stack_ids])
+
+    def errors(self) -> Dict[str, str]:
+        # Stacks whose last scan failed, and why
+        with self._lock:
+            return dict(self._connection.execute("SELECT stack_id, error FROM stacks WHERE error IS NOT NULL ORDER BY stack_id"))
+
+    def resources_lacking(self, capability_id: str, resource_type: Optional[str] = None, account: Optional[str] = None, limit: int = 1000) -> List[IndexedResource]:
+        # Resources whose type supports the capability without implementing it
+        query = "SELECT stack_id, account, logical_name, resource_type FROM resource_capabilities WHERE capability_id = ? AND implemented = 0"
+        parameters: List[object] = [capability_id]
+
+        if (resource_type is not None):
+            query += " AND resource_type = ?"
+            parameters.append(resource_type)
+
+        if (account is not None):
+            query += " AND account = ?"
+            parameters.append(account)
+
+        with self._lock:
+            return [IndexedResource(*row) for row in self._connection.execute(query + " ORDER BY stack_id, logical_name LIMIT ?", parameters + [limit])]
+
+    def coverage(self, capability_id: str, group_by: CoverageGrouping = CoverageGrouping.ACCOUNT, resource_type: Optional[str] = None) -> List[CapabilityCoverage]:
+        # Implemented out of supporting resources, per account, resource type or stack
+        column = group_by.value
+        query = f"SELECT {column}, SUM(implemented), COUNT(*) FROM resource_capabilities WHERE capability_id = ?"
+        parameters: List[object] = [capability_id]
+
+        if (resource_type is not None):
+            query += " AND resource_type = ?"
+            parameters.append(resource_type)
+
+        with self._lock:
+            return [CapabilityCoverage(*row) for row in self._connection.execute(query + f" GROUP BY {column} ORDER BY {column}", parameters)]
+
+@lru_cache(maxsize=None)
+def get_scan_index(path: Optional[str] = None) -> ScanIndex:
+    return ScanIndex(path or src.settings.Settings().SCAN_INDEX_PATH)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+from typing import Dict
+import gc
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from starlette import status
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+import src.artifact
+import src.metrics
+
+logger = logging.getLogger("server")
+
+# Pre-fork server for running app.py as a long-lived service. The parent maps the capability artifact and builds the
+# capability index of every resource type once, then freezes them (gc.freeze) so garbage collections in the workers
+# never write to, and so copy, the pages they share. Workers are forked from it and all accept connections on the
+# same listening socket; the parent only restarts workers that die, and stops them on SIGTERM or SIGINT. Workers share
+# their metrics through METRICS_DIR (a temporary directory when it isn't set), so /metrics covers all of them.
+
+# Requests in flight in a worker past max_requests are turned away with a 503, rather than queuing behind scans
+class RequestLimitMiddleware():
+    def __init__(self, app: ASGIApp, max_requests: int):
+        self.app = app
+        self.max_requests = max_requests
+        self.in_flight = 0
+        self.overloaded_response = Response("Server overloaded, retry later", status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http"):
+            await self.app(scope, receive, send)
+            return
+
+        if (self.in_flight >= self.max_requests):
+            src.metrics.count("requests_rejected")
+            await self.overloaded_response(scope, receive, send)
+            return
+
+        self.in_flight += 1
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+def preload(artifact_path: str = src.artifact.ARTIFACT_PATH):
+    artifact = src.artifact.load_artifact(artifact_path)
+    artifact.capabilities()
+
+    for resource_type in artifact.resource_types:
+        artifact.get_capability_index(resource_type)
+
+    # Everything allocated so far is shared with the workers and never collected
+    gc.collect()
+    gc.freeze()
+
+def _run_worker(app: ASGIApp, listener: socket.socket):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="off"))
+    server.run(sockets=[listener])
+
+def serve(app: ASGIApp, host: str, port: int, workers: int):
+    # Collections between preloading and forking would only dirty pages before they're frozen
+    gc.disable()
+    preload()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(2048)
+    listener.set_inheritable(True)
+
+    if (workers <= 1):
+        gc.enable()
+        _run_worker(app, listener)
+        return
+
+    created_metrics_dir = None
+
+    if (not src.metrics._metrics_dir()):
+        created_metrics_dir = tempfile.mkdtemp(prefix="gomboc-metrics-")
+        os.environ["METRICS_DIR"] = created_metrics_dir
+        src.metrics._metrics_dir.cache_clear()
+
+    # Preloading is counted once, in the parent's snapshot, and each worker only adds what it records itself
+    src.metrics.registry.write_snapshot()
+
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+
+        if (pid == 0):
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            src.metrics.registry.reset()
+            gc.enable()
+            exit_code = 0
+
+            try:
+                _run_worker(app, listener)
+            except BaseException:
+                logger.exception("Worker failed")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    gc.enable()
+    logger.info(f"Serving on {host}:{port} with {workers} workers")
+
+    while (children):
+        try:
+            pid, exit_status = os.wait()
+        except ChildProcessError:
+            break
+
+        started = children.pop(pid, None)
+
+        if (not stopping and started is not None):
+            logger.warning(f"Worker {pid} exited with status {exit_status}, restarting it")
+
+            # Don't spin on workers failing as soon as they start
+            if (time.monotonic() - started < 1):
+                time.sleep(1)
+
+            spawn()
+
+    listener.close()
+
+    if (created_metrics_dir is not None):
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
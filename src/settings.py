@@ -1,5 +1,6 @@
 from __future__ import annotations
 from enum import Enum
+from typing import Optional
 from pydantic import BaseSettings
 
 class DataSource(Enum):
@@ -13,6 +14,46 @@ class Settings(BaseSettings):
         use_enum_values = True
 
     DATASOURCE: DataSource = DataSource.PICKLE
-    NEO4J_URL: str
-    NEO4j_USER: str
-    NEO4j_PASSWORD: str
\ No newline at end of file
+
+    # Only needed when querying Neo4j: DATASOURCE=neo4j, or generate.py
+    NEO4J_URL: Optional[str] = None
+    NEO4j_USER: Optional[str] = None
+    NEO4j_PASSWORD: Optional[str] = None
+
+    # Connection pool shared by every query, also bounds the threads running queries for async resolvers
+    NEO4J_MAX_CONNECTION_POOL_SIZE: int = 16
+    NEO4J_CONNECTION_TIMEOUT: float = 30.0
+    NEO4J_CONNECTION_ACQUISITION_TIMEOUT: float = 60.0
+    NEO4J_QUERY_TIMEOUT: Optional[float] = None
+
+    # Scan results cached per resource, 0 disables the in-process cache. SCAN_CACHE_DIR adds an on-disk cache shared
+    # between processes, bounded to SCAN_CACHE_DISK_SIZE entries (0 for unbounded).
+    SCAN_CACHE_SIZE: int = 4096
+    SCAN_CACHE_DIR: Optional[str] = None
+    SCAN_CACHE_DISK_SIZE: int = 100000
+
+    # Worker processes for scanCloudformationTemplates, 0 scans in the serving process (Lambda has no /dev/shm for a
+    # process pool)
+    SCAN_PROCESSES: int = 0
+
+    # Log each request's scan metrics as one JSON line, on by default when running in Lambda
+    METRICS_LOG: Optional[bool] = None
+
+    # Directory the serving processes share their metrics through, so /metrics sums all of them rather than reporting
+    # the one process scraped
+    METRICS_DIR: Optional[str] = None
+
+    # Parsed and validated GraphQL documents kept for automatic persisted queries, keyed by their SHA-256
+    PERSISTED_QUERY_CACHE_SIZE: int = 1024
+
+    # SQLite index of scan results across stacks, filled by index_stacks.py and read by the coverage queries
+    SCAN_INDEX_PATH: str = "scan_index.sqlite"
+
+    # gzip (or br, with the brotli package installed) for GraphQL responses of at least this many bytes, when the client
+    # accepts it. None leaves responses uncompressed, e.g. when API Gateway or a CDN already compresses them.
+    RESPONSE_COMPRESSION_MINIMUM_SIZE: Optional[int] = None
+
+    # Running app.py as a service: worker processes forked from a parent holding the preloaded artifact, and the
+    # requests each worker takes on at once before answering 503
+    SERVER_WORKERS: int = 1
+    SERVER_MAX_REQUESTS: int = 64
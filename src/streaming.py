@@ -0,0 +1,93 @@
+from __future__ import annotations
+from inspect import isawaitable
+from typing import Any, AsyncIterator, Dict, List
+import json
+import logging
+from graphql import FieldNode, OperationType, execute, get_operation_ast
+from graphql.execution.values import get_argument_values, get_variable_values
+from starlette.background import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+import graphene
+import src.cfn_lint
+import src.persisted_queries
+
+logger = logging.getLogger(__name__)
+
+STREAMED_FIELD = "scanCloudformationTemplate"
+
+# NDJSON flavour of the scanCloudformationTemplate query, for templates too large to wait on as a whole. The request
+# body is a regular GraphQL request, persisted queries included; the query is validated once, then executed once per
+# resource with that resource already matched, and each result is written as one line as soon as it's ready:
+# {"data": <ResourceCapabilityReport>} with "errors" alongside when resolving it failed. The next resource is only
+# matched once the previous line has been sent, so a slow client holds back the scan instead of buffering it.
+def make_stream_handler(schema: graphene.Schema):
+
+    async def handle_stream_request(request: Request):
+        try:
+            operation = await request.json()
+            document, errors = src.persisted_queries.get_document_cache(schema.graphql_schema).get(operation.get("query"), operation.get("extensions"))
+        except (ValueError, AttributeError, TypeError):
+            return JSONResponse({"errors": ["Expected a JSON body with a GraphQL query"]}, status_code=400)
+
+        if (document is None):
+            return JSONResponse({"errors": [error.formatted for error in errors]}, status_code=400)
+
+        operation_name = operation.get("operationName")
+        operation_definition = get_operation_ast(document, operation_name)
+        field_nodes = [selection for selection in operation_definition.selection_set.selections] if operation_definition else []
+
+        if (operation_definition is None or operation_definition.operation != OperationType.QUERY or len(field_nodes) != 1 or not isinstance(field_nodes[0], FieldNode) or field_nodes[0].name.value != STREAMED_FIELD):
+            return JSONResponse({"errors": [f"Only a query selecting {STREAMED_FIELD} alone can be streamed"]}, status_code=400)
+
+        variable_values = operation.get("variables") or {}
+        coerced_variables = get_variable_values(schema.graphql_schema, operation_definition.variable_definitions or [], variable_values)
+
+        if (isinstance(coerced_variables, list)):
+            return JSONResponse({"errors": [error.formatted for error in coerced_variables]}, status_code=400)
+
+        arguments = get_argument_values(schema.graphql_schema.query_type.fields[STREAMED_FIELD], field_nodes[0], coerced_variables)
+
+        try:
+            parsed_template = await run_in_threadpool(src.cfn_lint.CfnTemplate.parse_raw, arguments["template"])
+        except Exception as error:
+            return JSONResponse({"errors": [f"{type(error).__name__}: {error}"]}, status_code=400)
+
+        response_key = field_nodes[0].alias.value if field_nodes[0].alias else STREAMED_FIELD
+
+        async def lines() -> AsyncIterator[bytes]:
+            # One context for the whole stream, so DataLoader caches carry over from one resource to the next
+            context: Dict[str, Any] = {"request": request, "background": BackgroundTasks()}
+
+            try:
+                for logical_name in list(parsed_template.Resources.keys()):
+                    line: Dict[str, Any] = {}
+
+                    try:
+                        context["streamed_resource"] = (logical_name, await run_in_threadpool(parsed_template.match_resource_capabilities, logical_name))
+                    except Exception as error:
+                        line = {"data": None, "errors": [{"message": f"{type(error).__name__}: {error}", "logicalName": logical_name}]}
+                    else:
+                        result = execute(schema.graphql_schema, document, context_value=context, variable_values=variable_values, operation_name=operation_name)
+
+                        if (isawaitable(result)):
+                            result = await result
+
+                        reports: List[Any] = (result.data or {}).get(response_key) or [None]
+                        line["data"] = reports[0]
+
+                        if (result.errors):
+                            for error in result.errors:
+                                if (error.original_error):
+                                    logger.error("An exception occurred in resolvers", exc_info=error.original_error)
+
+                            line["errors"] = [error.formatted for error in result.errors]
+
+                    yield (json.dumps(line) + "\n").encode("utf-8")
+            finally:
+                await context["background"]()
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return handle_stream_request
@@ -0,0 +1,79 @@
+from __future__ import annotations
+from enum import Enum
+from typing import Dict, List, NamedTuple, Set
+from gomboctypes.models import Capability
+from src.cfn_lint import CfnTemplate
+
+class ResourceChange(Enum):
+    ADDED = "ADDED"
+    REMOVED = "REMOVED"
+    MODIFIED = "MODIFIED"
+
+class ResourceCapabilityDiff(NamedTuple):
+    logical_name: str
+    change: ResourceChange
+    gained: List[Capability]
+    lost: List[Capability]
+
+def _referencing_resources(template: CfnTemplate) -> Dict[str, Set[str]]:
+    # Reverse Ref index: logical name -> resources whose properties Ref it
+    referencing: Dict[str, Set[str]] = {}
+
+    for logical_name in template.Resources.keys():
+        for referenced_logical_name in template.referenced_resources(logical_name):
+            referencing.setdefault(referenced_logical_name, set()).add(logical_name)
+
+    return referencing
+
+def _affected_resources(base: CfnTemplate, head: CfnTemplate) -> Set[str]:
+    # Ref targets are expanded into the resources referencing them, so a change reaches every transitive referrer.
+    # A parameter appearing or disappearing changes whether a Ref to that name is a resource reference.
+    changed = {logical_name for logical_name in base.Resources.keys() | head.Resources.keys() if base.Resources.get(logical_name) != head.Resources.get(logical_name)}
+    changed |= base.Parameters.keys() ^ head.Parameters.keys()
+
+    base_referencing = _referencing_resources(base)
+    head_referencing = _referencing_resources(head)
+    affected = set(changed)
+    pending = list(changed)
+
+    while (pending):
+        logical_name = pending.pop()
+
+        for referencing_logical_name in base_referencing.get(logical_name, set()) | head_referencing.get(logical_name, set()):
+            if (referencing_logical_name not in affected):
+                affected.add(referencing_logical_name)
+                pending.append(referencing_logical_name)
+
+    return affected & (base.Resources.keys() | head.Resources.keys())
+
+def _implemented_capabilities(template: CfnTemplate, logical_name: str) -> Dict[str, Capability]:
+    if (logical_name not in template.Resources):
+        return {}
+
+    return {capability.id: capability for capability in template.match_resource_capabilities(logical_name).implements()}
+
+def diff_templates(base: CfnTemplate, head: CfnTemplate) -> List[ResourceCapabilityDiff]:
+    # Only resources that changed, or Ref a resource that changed, are scanned; unchanged ones can't gain or lose
+    # anything. Resources are reported in head order followed by removed ones, and only when something was gained
+    # or lost, or the resource was added or removed.
+    affected = _affected_resources(base, head)
+    diffs: List[ResourceCapabilityDiff] = []
+
+    for logical_name in [name for name in head.Resources.keys() if name in affected] + [name for name in base.Resources.keys() if name in affected and name not in head.Resources]:
+        base_capabilities = _implemented_capabilities(base, logical_name)
+        head_capabilities = _implemented_capabilities(head, logical_name)
+
+        if (logical_name not in base.Resources):
+            change = ResourceChange.ADDED
+        elif (logical_name not in head.Resources):
+            change = ResourceChange.REMOVED
+        else:
+            change = ResourceChange.MODIFIED
+
+        gained = sorted([capability for id, capability in head_capabilities.items() if id not in base_capabilities], key=lambda x: x.title)
+        lost = sorted([capability for id, capability in base_capabilities.items() if id not in head_capabilities], key=lambda x: x.title)
+
+        if (gained or lost or change != ResourceChange.MODIFIED):
+            diffs.append(ResourceCapabilityDiff(logical_name=logical_name, change=change, gained=gained, lost=lost))
+
+    return diffs
@@ -0,0 +1,65 @@
+from __future__ import annotations
+from collections.abc import Set
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
+from src.capability_index import Edge, Node
+
+# Edges are stored as one integer, the source node id in the high bits and the target node id in the low ones
+_NODE_ID_BITS = 32
+_NODE_ID_MASK = (1 << _NODE_ID_BITS) - 1
+
+# Property graph of a whole template. Node names are interned once per template and each resource's edges are kept
+# as a frozenset of packed integer pairs, filled in the first time the resource is looked at. Everything scanning the
+# same CfnTemplate shares this structure through CfnTemplate.resource_graph.
+class TemplateGraph():
+
+    def __init__(self):
+        self._node_ids: Dict[Node, int] = {}
+        self._nodes: List[Node] = []
+        self._resource_edges: Dict[str, FrozenSet[int]] = {}
+
+    def intern(self, node: Node) -> int:
+        node_id = self._node_ids.get(node)
+
+        if (node_id is None):
+            node_id = len(self._nodes)
+            self._node_ids[node] = node_id
+            self._nodes.append(node)
+
+        return node_id
+
+    def node_id(self, node: Node) -> Optional[int]:
+        return self._node_ids.get(node)
+
+    def node(self, node_id: int) -> Node:
+        return self._nodes[node_id]
+
+    def add_resource(self, logical_name: str, edges: List[Tuple[Node, Node]]):
+        self._resource_edges[logical_name] = frozenset((self.intern(source) << _NODE_ID_BITS) | self.intern(target) for source, target in edges)
+
+    def resource(self, logical_name: str) -> Optional[ResourceGraphView]:
+        edges = self._resource_edges.get(logical_name)
+        return ResourceGraphView(self, edges) if edges is not None else None
+
+# One resource's edges, read in place from the TemplateGraph. Behaves as a set of (source, target) node pairs.
+class ResourceGraphView(Set):
+    __slots__ = ("graph", "packed_edges")
+
+    def __init__(self, graph: TemplateGraph, packed_edges: FrozenSet[int]):
+        self.graph = graph
+        self.packed_edges = packed_edges
+
+    def __len__(self) -> int:
+        return len(self.packed_edges)
+
+    def __iter__(self) -> Iterator[Edge]:
+        for packed_edge in self.packed_edges:
+            yield (self.graph.node(packed_edge >> _NODE_ID_BITS), self.graph.node(packed_edge & _NODE_ID_MASK))
+
+    def __contains__(self, edge: Edge) -> bool:
+        source_id = self.graph.node_id(edge[0])
+        target_id = self.graph.node_id(edge[1])
+
+        return source_id is not None and target_id is not None and ((source_id << _NODE_ID_BITS) | target_id) in self.packed_edges
+
+    def has_edge(self, source: Node, target: Node) -> bool:
+        return (source, target) in self
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any, Union
+import json
+
+_YAML_TIMESTAMP_TAG = "tag:yaml.org,2002:timestamp"
+
+# Templates come in as JSON or YAML. JSON goes through orjson when it's installed; YAML through the libyaml loader
+# when PyYAML was built with it, with the CloudFormation short-form intrinsics (!Ref, !GetAtt, !Sub, ...) expanded
+# into their long form. Both parsers are only imported by the first template needing them.
+def load_template(template: Union[str, bytes]) -> Any:
+    if (template.lstrip()[:1] in ("{", b"{")):
+        return _json_loads()(template)
+
+    import yaml
+
+    try:
+        return yaml.load(template, Loader=_yaml_loader())
+    except yaml.YAMLError as error:
+        raise ValueError(f"Invalid YAML template: {error}") from error
+
+@lru_cache(maxsize=None)
+def _json_loads():
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+def _construct_intrinsic(loader, tag_suffix: str, node) -> Any:
+    # !Ref and !Condition keep their name, the other short forms are Fn:: functions
+    import yaml
+
+    function_name = tag_suffix if tag_suffix in ("Ref", "Condition") else f"Fn::{tag_suffix}"
+
+    if (isinstance(node, yaml.ScalarNode)):
+        value = loader.construct_scalar(node)
+
+        # !GetAtt Resource.Attribute is the short form of [Resource, Attribute]
+        if (function_name == "Fn::GetAtt"):
+            value = value.split(".", 1)
+
+    elif (isinstance(node, yaml.SequenceNode)):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    return {function_name: value}
+
+@lru_cache(maxsize=None)
+def _yaml_loader():
+    import yaml
+
+    base_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+    # Dates stay strings (AWSTemplateFormatVersion: 2010-09-09 is unquoted in most templates)
+    class CfnYamlLoader(base_loader):
+        yaml_implicit_resolvers = {first: [(tag, regexp) for tag, regexp in resolvers if tag != _YAML_TIMESTAMP_TAG] for first, resolvers in base_loader.yaml_implicit_resolvers.items()}
+
+    CfnYamlLoader.add_multi_constructor("!", _construct_intrinsic)
+    return CfnYamlLoader
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+from gomboctypes.models import Capability, EdgeLabels, NodeLabels
+from src.artifact import ARTIFACT_PATH, _load_artifact, write_artifact
+from src.capability_index import CapabilityIndex
+from src.scan_cache import get_scan_cache
+import networkx
+import os
+import shutil
+import tempfile
+import unittest
+
+BUCKET = "AWS::S3::Bucket"
+
+# Encrypted and versioned buckets, both providing data-protection
+ENCRYPTION_AT_REST = Capability(id="encryption-at-rest", title="Encryption at rest", description="")
+VERSIONING = Capability(id="versioning", title="Versioning", description="")
+DATA_PROTECTION = Capability(id="data-protection", title="Data protection", description="")
+
+def implementation(capability: Capability, resource_type: str, properties: List[str]) -> Tuple[Capability, networkx.DiGraph]:
+    # Implementation graph of a capability enabled by properties directly under the resource, as generate.py parses it
+    graph = networkx.DiGraph()
+    graph.add_node((True, resource_type), label=NodeLabels.CFN_RESOURCE)
+
+    for property_name in properties:
+        graph.add_node((True, f"{resource_type}-{property_name}"), label=NodeLabels.CFN_PROPERTY)
+        graph.add_edge((True, resource_type), (True, f"{resource_type}-{property_name}"), label=EdgeLabels.HAS_SUBPROPERTY)
+
+    return (capability, graph)
+
+def bucket_implementations() -> List[Tuple[Capability, networkx.DiGraph]]:
+    return [implementation(ENCRYPTION_AT_REST, BUCKET, ["BucketEncryption"]), implementation(VERSIONING, BUCKET, ["VersioningConfiguration"])]
+
+def capability_indexes() -> Dict[str, CapabilityIndex]:
+    return {BUCKET: CapabilityIndex.compile(bucket_implementations())}
+
+def write_capability_artifact(path: str, fingerprints: Optional[Dict[str, str]] = None):
+    capabilities = [(DATA_PROTECTION, []), (ENCRYPTION_AT_REST, [DATA_PROTECTION]), (VERSIONING, [DATA_PROTECTION])]
+    write_artifact(path, capabilities, capability_indexes(), fingerprints)
+
+def use_capability_artifact(test_case: unittest.TestCase):
+    # Runs the test from a directory holding the capability artifact, the service loads it from the working directory
+    directory = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, directory)
+    write_capability_artifact(os.path.join(directory, ARTIFACT_PATH))
+
+    test_case.addCleanup(os.chdir, os.getcwd())
+    os.chdir(directory)
+
+    _load_artifact.cache_clear()
+    test_case.addCleanup(_load_artifact.cache_clear)
+
+    # Matches cached by an earlier test against the same artifact would skip what the test looks at
+    get_scan_cache.cache_clear()
+    test_case.addCleanup(get_scan_cache.cache_clear)
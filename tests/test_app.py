@@ -0,0 +1,35 @@
+from __future__ import annotations
+import unittest
+from starlette.testclient import TestClient
+import app
+
+AUTHORIZATION = ("dev", "uIES33LgtXTPObDu3RbM6sotDE70xGq7")
+
+class BasicAuthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app.app)
+
+    def test_unauthenticated(self):
+        for headers in [{}, {"Authorization": "Basic not-base64"}]:
+            response = self.client.post("/", json={"query": "{ __typename }"}, headers=headers)
+
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.headers["www-authenticate"], "Basic")
+
+        self.assertEqual(self.client.post("/", json={"query": "{ __typename }"}, auth=("dev", "wrong")).status_code, 401)
+
+    def test_authenticated(self):
+        self.assertEqual(self.client.post("/", json={"query": "{ __typename }"}, auth=AUTHORIZATION).json(), {"data": {"__typename": "Query"}})
+        self.assertTrue(self.client.get("/metrics", auth=AUTHORIZATION).headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+    def test_preflight(self):
+        # Answered by CORS before authentication, browsers send no credentials with it
+        response = self.client.options("/", headers={"Origin": "https://example.com", "Access-Control-Request-Method": "POST"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["access-control-allow-origin"], "https://example.com")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+import unittest
+from gomboctypes.models import Capability
+from src.artifact import ArtifactError, CapabilityArtifact, write_artifact
+from src.capability_index import CapabilityMatch
+from tests.fixtures import BUCKET, DATA_PROTECTION, ENCRYPTION_AT_REST, capability_indexes, implementation, write_capability_artifact
+
+class CapabilityArtifactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "capability_artifact.bin")
+        write_capability_artifact(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rewrite(self, change) -> str:
+        # A changed copy, the original stays mapped by the artifacts loaded from it
+        with open(self.path, "rb") as file:
+            content = bytearray(file.read())
+
+        path = os.path.join(self.directory, "changed.bin")
+
+        with open(path, "wb") as file:
+            file.write(change(content))
+
+        return path
+
+    def test_round_trip(self):
+        artifact = CapabilityArtifact(self.path)
+
+        self.assertEqual(artifact.resource_types, [BUCKET])
+        self.assertEqual([(capability.id, root.id if root else None) for capability, root in artifact.capabilities()], [("data-protection", None), ("encryption-at-rest", "data-protection"), ("versioning", "data-protection")])
+        self.assertEqual(artifact.get_capability("versioning").title, "Versioning")
+        self.assertEqual([capability.id for capability in artifact.get_ancestor_capabilities("encryption-at-rest")], ["data-protection"])
+        self.assertEqual(artifact.get_root_capability("encryption-at-rest").id, "data-protection")
+        self.assertIsNone(artifact.get_root_capability("data-protection"))
+
+    def test_fingerprints(self):
+        write_capability_artifact(self.path, {BUCKET: "0123abcd"})
+
+        self.assertEqual(CapabilityArtifact(self.path).get_fingerprint(BUCKET), "0123abcd")
+        self.assertIsNone(CapabilityArtifact(self.path).get_fingerprint("AWS::SNS::Topic"))
+
+    def test_no_fingerprints(self):
+        self.assertIsNone(CapabilityArtifact(self.path).get_fingerprint(BUCKET))
+
+    def test_replaced(self):
+        # Rewriting leaves the artifact mapped from the previous file readable, and no temporary file behind
+        artifact = CapabilityArtifact(self.path)
+        write_artifact(self.path, [], {})
+
+        self.assertEqual(artifact.get_capability("versioning").title, "Versioning")
+        self.assertEqual(CapabilityArtifact(self.path).resource_types, [])
+        self.assertEqual(os.listdir(self.directory), ["capability_artifact.bin"])
+
+    def test_ancestor_order(self):
+        # Written in the order generate.py gives them, the root capability last
+        security = Capability(id="security", title="Security", description="")
+        write_artifact(self.path, [(ENCRYPTION_AT_REST, [DATA_PROTECTION, security])], {})
+
+        self.assertEqual([capability.id for capability in CapabilityArtifact(self.path).get_ancestor_capabilities("encryption-at-rest")], ["data-protection", "security"])
+        self.assertEqual(CapabilityArtifact(self.path).get_root_capability("encryption-at-rest"), security)
+
+    def test_capability_index(self):
+        capability_index = CapabilityArtifact(self.path).get_capability_index(BUCKET)
+        compiled = capability_indexes()[BUCKET]
+        resource_edges = set(implementation(None, BUCKET, ["BucketEncryption"])[1].edges)
+
+        # Edges are renumbered in the artifact, matches and plans stay the same
+        capability_match = CapabilityMatch(capability_index, capability_index.present_edge_ids(resource_edges))
+        compiled_match = CapabilityMatch(compiled, compiled.present_edge_ids(resource_edges))
+
+        self.assertEqual(set(capability_index.edge_ids), set(compiled.edge_ids))
+        self.assertEqual([capability.id for capability in capability_match.implements()], ["encryption-at-rest"])
+        self.assertEqual(capability_match.not_implemented(), compiled_match.not_implemented())
+        self.assertEqual(capability_match.implementation_plan(1), compiled_match.implementation_plan(1))
+
+    def test_unknown_resource_type(self):
+        # Types missing from the artifact share one index without capabilities, which isn't kept per type
+        artifact = CapabilityArtifact(self.path)
+        capability_index = artifact.get_capability_index("Custom::Hook")
+
+        self.assertEqual(capability_index.capabilities, [])
+        self.assertIs(artifact.get_capability_index("AWS::SNS::Topic"), capability_index)
+        self.assertIs(CapabilityArtifact(self.path).get_capability_index("Custom::Hook"), capability_index)
+        self.assertEqual(list(artifact._capability_indexes.keys()), [])
+
+    def test_empty(self):
+        with self.assertRaises(ArtifactError):
+            CapabilityArtifact(self.rewrite(lambda content: b""))
+
+    def test_not_an_artifact(self):
+        with self.assertRaises(ArtifactError):
+            CapabilityArtifact(self.rewrite(lambda content: b"PK" + content[2:]))
+
+    def test_truncated(self):
+        with self.assertRaises(ArtifactError):
+            CapabilityArtifact(self.rewrite(lambda content: content[:-16]))
+
+    def test_corrupt_resource_block(self):
+        offset = CapabilityArtifact(self.path)._resource_locations[BUCKET][0]
+
+        def corrupt(content: bytearray) -> bytearray:
+            content[offset] ^= 0xFF
+            return content
+
+        # Blocks are only checked when they're read
+        artifact = CapabilityArtifact(self.rewrite(corrupt))
+
+        with self.assertRaises(ArtifactError):
+            artifact.get_capability_index(BUCKET)
+
+    def test_digest_mismatch(self):
+        digest_offset = 8 + 4 + 32
+
+        def corrupt(content: bytearray) -> bytearray:
+            content[digest_offset] ^= 0xFF
+            return content
+
+        artifact = CapabilityArtifact(self.rewrite(corrupt))
+
+        with self.assertRaisesRegex(ArtifactError, "doesn't match its digest"):
+            artifact.capabilities()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+from unittest import mock
+import os
+import unittest
+from src.cfn_lint import CfnTemplate
+from tests.fixtures import BUCKET, use_capability_artifact
+
+# bench.py turns the scan cache off for the whole process, which other tests rely on
+with mock.patch.dict(os.environ):
+    import bench
+
+class GenerateTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+
+    def test_generate(self):
+        template = bench.generate_template(20, depth=3, fan_in=5, fan_out=2, type_weights={BUCKET: 1.0})
+        resources = template["Resources"]
+        refs = [value["Ref"] for resource in resources.values() for name, value in resource["Properties"].items() if name.startswith("Reference")]
+
+        # 20 resources, 8 of them Ref'd by the others twice each, all with properties from the artifact's implementations
+        self.assertEqual(len(resources), 20)
+        self.assertEqual(len(refs), 24)
+        self.assertEqual(sorted(set(refs)), [f"Resource{position}" for position in range(8)])
+        self.assertTrue(all(set(resource["Properties"]) & {"BucketEncryption", "VersioningConfiguration"} for resource in resources.values()))
+        self.assertEqual(template, bench.generate_template(20, depth=3, fan_in=5, fan_out=2, type_weights={BUCKET: 1.0}))
+        self.assertEqual(CfnTemplate.parse_raw(bench.json.dumps(template)).Resources.keys(), resources.keys())
+
+    def test_no_refs(self):
+        template = bench.generate_template(5, depth=1, fan_in=1, fan_out=0, type_weights={BUCKET: 1.0})
+
+        self.assertFalse(any(name.startswith("Reference") for resource in template["Resources"].values() for name in resource["Properties"]))
+
+    def test_type_weights(self):
+        self.assertEqual(bench.parse_type_weights(None), {BUCKET: 1.0})
+        self.assertEqual(bench.parse_type_weights("AWS::S3::Bucket=3,AWS::SNS::Topic"), {BUCKET: 3.0, "AWS::SNS::Topic": 1.0})
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+
+    def test_property_graph_phase(self):
+        # Each phase only times its own stage: building graphs reuses the parsed template and drops its graph caches
+        with mock.patch.object(bench, "measure", side_effect=lambda run, iterations, resources: run):
+            phases = bench.run_benchmarks(bench.generate_template(10, 2, 2, 1, {BUCKET: 1.0}), 1)
+
+        with mock.patch.object(CfnTemplate, "parse_raw") as parse_raw:
+            first = phases["property_graph"]()
+            second = phases["property_graph"]()
+
+        parse_raw.assert_not_called()
+        self.assertIsNot(first[0].graph, second[0].graph)
+        self.assertEqual(first[0], second[0])
+
+    def test_compare(self):
+        baseline = {"parse": {"p50_ms": 10.0, "p99_ms": 20.0, "peak_memory_kb": 100.0}}
+
+        self.assertEqual(bench.compare({"parse": {"p50_ms": 12.0, "p99_ms": 20.0, "peak_memory_kb": 100.0}, "other": {}}, baseline, 0.25), [])
+        self.assertEqual(bench.compare({"parse": {"p50_ms": 13.0, "p99_ms": 20.0, "peak_memory_kb": 200.0}}, baseline, 0.25), ["parse p50_ms: 13.00 vs baseline 10.00", "parse peak_memory_kb: 200 vs baseline 100"])
+
+if __name__ == "__main__":
+    unittest.main()
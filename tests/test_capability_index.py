@@ -0,0 +1,93 @@
+from __future__ import annotations
+from typing import Set
+import unittest
+import networkx
+from gomboctypes.models import EdgeLabels, NodeLabels
+from src.capability_index import CapabilityIndex, CapabilityMatch, Edge
+from src.implementation_plan import Action
+from tests.fixtures import BUCKET, ENCRYPTION_AT_REST, VERSIONING, bucket_implementations, implementation
+
+KEY = "AWS::KMS::Key"
+
+def kms_encryption() -> networkx.DiGraph:
+    # Bucket encrypted with a new KMS key, the key being configured too
+    graph = implementation(ENCRYPTION_AT_REST, BUCKET, ["BucketEncryption"])[1]
+    graph.add_node((True, f"{BUCKET}-BucketEncryption-KMSMasterKeyID"), label=NodeLabels.CFN_PROPERTY)
+    graph.add_node((False, KEY), label=NodeLabels.CFN_RESOURCE)
+    graph.add_node((False, f"{KEY}-KeyPolicy"), label=NodeLabels.CFN_PROPERTY)
+    graph.add_edge((True, f"{BUCKET}-BucketEncryption"), (True, f"{BUCKET}-BucketEncryption-KMSMasterKeyID"), label=EdgeLabels.HAS_SUBPROPERTY)
+    graph.add_edge((True, f"{BUCKET}-BucketEncryption-KMSMasterKeyID"), (False, KEY), label=EdgeLabels.USES_OTHER_RESOURCE_TO)
+    graph.add_edge((False, KEY), (False, f"{KEY}-KeyPolicy"), label=EdgeLabels.HAS_SUBPROPERTY)
+    return graph
+
+def plan_rows(implementation_plan):
+    return [(resource.type, resource.action, [(resource_property.name, resource_property.value) for resource_property in resource.properties]) for resource in implementation_plan.resources]
+
+def resource_edges(resource_type: str, properties) -> Set[Edge]:
+    # Edges of a template resource with these properties, as scans match them
+    return set(implementation(None, resource_type, properties)[1].edges)
+
+class CapabilityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # Encryption and versioning both, through one shared edge each
+        self.capability_index = CapabilityIndex.compile(bucket_implementations() + [implementation(ENCRYPTION_AT_REST, BUCKET, ["BucketEncryption", "VersioningConfiguration"])])
+
+    def test_compile(self):
+        self.assertEqual(self.capability_index.capabilities, [ENCRYPTION_AT_REST, VERSIONING, ENCRYPTION_AT_REST])
+        self.assertEqual(len(self.capability_index.edge_ids), 2)
+        self.assertEqual(self.capability_index.required_edges[2], self.capability_index.required_edges[0] | self.capability_index.required_edges[1])
+        self.assertEqual(sorted(len(positions) for positions in self.capability_index.edge_capabilities.values()), [2, 2])
+
+    def test_match(self):
+        self.assertEqual(self.capability_index.match(self.capability_index.present_edge_ids(resource_edges(BUCKET, ["BucketEncryption"]))), [True, False, False])
+        self.assertEqual(self.capability_index.match(self.capability_index.present_edge_ids(resource_edges(BUCKET, ["BucketEncryption", "VersioningConfiguration"]))), [True, True, True])
+        self.assertEqual(self.capability_index.match(frozenset()), [False, False, False])
+
+    def test_present_edge_ids(self):
+        # Both sides of the walk find the same edges, whichever is smaller
+        small = resource_edges(BUCKET, ["BucketEncryption"])
+        large = resource_edges(BUCKET, ["BucketEncryption", "Tags", "LoggingConfiguration", "AccessControl"])
+        encryption = self.capability_index.edge_ids[((True, BUCKET), (True, f"{BUCKET}-BucketEncryption"))]
+
+        self.assertEqual(self.capability_index.present_edge_ids(small), frozenset([encryption]))
+        self.assertEqual(self.capability_index.present_edge_ids(large), frozenset([encryption]))
+
+    def test_no_implementations(self):
+        capability_index = CapabilityIndex.compile([])
+
+        self.assertEqual(capability_index.match(capability_index.present_edge_ids(resource_edges(BUCKET, ["BucketEncryption"]))), [])
+
+class ImplementationPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.capability_index = CapabilityIndex.compile([(ENCRYPTION_AT_REST, kms_encryption())])
+
+    def edge_ids(self, *edges):
+        return frozenset(self.capability_index.edge_ids[edge] for edge in edges)
+
+    def test_nothing_present(self):
+        # New resources come before the template's resources using them
+        self.assertEqual(plan_rows(self.capability_index.implementation_plan(0, frozenset())), [
+            (KEY, Action.NEW_RESOURCE, [("KeyPolicy", "CONFIGURE APPROPRIATELY")]),
+            (BUCKET, Action.ADD_PROPERTIES, [("BucketEncryption", "CONFIGURE APPROPRIATELY"), ("BucketEncryption-KMSMasterKeyID", f"ARN of {{{KEY}}}")])])
+
+    def test_partly_present(self):
+        # Resources and properties whose edges are all in the template already are left out
+        present = self.edge_ids(((False, KEY), (False, f"{KEY}-KeyPolicy")))
+
+        self.assertEqual(plan_rows(self.capability_index.implementation_plan(0, present)), [
+            (KEY, Action.NEW_RESOURCE, []),
+            (BUCKET, Action.ADD_PROPERTIES, [("BucketEncryption", "CONFIGURE APPROPRIATELY"), ("BucketEncryption-KMSMasterKeyID", f"ARN of {{{KEY}}}")])])
+        self.assertEqual(plan_rows(self.capability_index.implementation_plan(0, frozenset(self.capability_index.edge_ids.values()))), [])
+
+    def test_capability_match(self):
+        capability_index = CapabilityIndex.compile(bucket_implementations())
+        capability_match = CapabilityMatch(capability_index, capability_index.present_edge_ids(resource_edges(BUCKET, ["VersioningConfiguration"])))
+
+        self.assertEqual(capability_match.implements(), [VERSIONING])
+        self.assertEqual(capability_match.not_implemented(), [(0, ENCRYPTION_AT_REST)])
+        self.assertEqual(plan_rows(capability_match.implementation_plan(0)), [(BUCKET, Action.ADD_PROPERTIES, [("BucketEncryption", "CONFIGURE APPROPRIATELY")])])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import json
+import unittest
+from src.cfn_lint import MAX_REF_DEPTH, CfnTemplate
+from tests.fixtures import BUCKET
+
+TOPIC = "AWS::SNS::Topic"
+
+def parse(resources) -> CfnTemplate:
+    return CfnTemplate.parse_raw(json.dumps({"Parameters": {"KeyArn": {"Type": "String"}}, "Resources": resources}))
+
+def ref_chain(length: int) -> CfnTemplate:
+    # Topic0 -> Topic1 -> ... -> Topic{length - 1}, through {"Ref": ...}
+    resources = {f"Topic{position}": {"Type": TOPIC, "Properties": {"Next": {"Ref": f"Topic{position + 1}"}}} for position in range(length - 1)}
+    resources[f"Topic{length - 1}"] = {"Type": TOPIC, "Properties": {"TopicName": "last"}}
+    return parse(resources)
+
+def resource_edges(template: CfnTemplate, logical_name: str):
+    return set(template.resource_graph(logical_name))
+
+class RefExpansionTest(unittest.TestCase):
+
+    def test_referenced_resource(self):
+        template = parse({
+            "Bucket": {"Type": BUCKET, "Properties": {"NotificationConfiguration": {"TopicConfigurations": [{"Topic": {"Ref": "Topic"}}]}}},
+            "Topic": {"Type": TOPIC, "Properties": {"KmsMasterKeyId": {"Ref": "KeyArn"}}}})
+        topic = f"{BUCKET}-NotificationConfiguration-TopicConfigurations-Topic"
+
+        # The referenced resource's properties are expanded under the property referencing it, parameters aren't
+        self.assertIn(((True, topic), (False, TOPIC)), resource_edges(template, "Bucket"))
+        self.assertIn(((True, f"{topic}-KmsMasterKeyId"), (True, f"{topic}-KmsMasterKeyId-Ref")), resource_edges(template, "Bucket"))
+        self.assertIn(((True, f"{TOPIC}-KmsMasterKeyId"), (True, f"{TOPIC}-KmsMasterKeyId-Ref")), resource_edges(template, "Topic"))
+
+    def test_expanded_once(self):
+        template = parse({
+            "Bucket": {"Type": BUCKET, "Properties": {"First": {"Ref": "Topic"}, "Second": {"Ref": "Topic"}}},
+            "Topic": {"Type": TOPIC, "Properties": {"TopicName": "topic"}}})
+        edges = resource_edges(template, "Bucket")
+
+        self.assertEqual(list(template._ref_expansions.keys()), ["Topic"])
+        self.assertIn(((True, f"{BUCKET}-First"), (True, f"{BUCKET}-First-TopicName")), edges)
+        self.assertIn(((True, f"{BUCKET}-Second"), (True, f"{BUCKET}-Second-TopicName")), edges)
+
+    def test_circular_ref(self):
+        template = parse({
+            "First": {"Type": TOPIC, "Properties": {"Next": {"Ref": "Second"}}},
+            "Second": {"Type": TOPIC, "Properties": {"Next": [{"Ref": "First"}]}}})
+
+        with self.assertRaisesRegex(ValueError, "Circular Ref between resources: Second -> First -> Second"):
+            resource_edges(template, "First")
+
+    def test_self_ref(self):
+        with self.assertRaisesRegex(ValueError, "Circular Ref between resources: Topic -> Topic"):
+            resource_edges(parse({"Topic": {"Type": TOPIC, "Properties": {"Next": {"Ref": "Topic"}}}}), "Topic")
+
+    def test_ref_depth(self):
+        # The resource being scanned and MAX_REF_DEPTH resources it references, one inside the other
+        self.assertIn(((True, TOPIC + "-Next" * MAX_REF_DEPTH), (False, TOPIC)), resource_edges(ref_chain(MAX_REF_DEPTH + 1), "Topic0"))
+
+        with self.assertRaisesRegex(ValueError, f"is deeper than {MAX_REF_DEPTH} resources"):
+            resource_edges(ref_chain(MAX_REF_DEPTH + 2), "Topic0")
+
+    def test_ref_depth_through_cached_expansion(self):
+        # Topic1's expansion is cached while walking from Topic1, then reached one level deeper from Topic0
+        template = ref_chain(MAX_REF_DEPTH + 2)
+        resource_edges(template, "Topic1")
+
+        with self.assertRaisesRegex(ValueError, f"is deeper than {MAX_REF_DEPTH} resources"):
+            resource_edges(template, "Topic0")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+from unittest import mock
+import gzip
+import unittest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+from src.compression import CompressionMiddleware
+import src.compression
+
+BODY = "capability " * 200
+
+class CompressionMiddlewareTest(unittest.TestCase):
+
+    def setUp(self):
+        app = Starlette()
+        app.add_route("/large", lambda request: PlainTextResponse(BODY))
+        app.add_route("/small", lambda request: PlainTextResponse("capability"))
+        self.client = TestClient(CompressionMiddleware(app, minimum_size=1024))
+
+    def get(self, path: str, accept_encoding: str):
+        return self.client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+    def test_gzip(self):
+        response = self.get("/large", "gzip, br;q=0")
+
+        # The client decompresses the body, Content-Length is what was sent
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(int(response.headers["Content-Length"]), len(gzip.compress(BODY.encode("utf-8"), compresslevel=6)))
+        self.assertEqual(response.text, BODY)
+
+    def test_brotli(self):
+        response = self.get("/large", "br, gzip")
+
+        self.assertEqual(response.headers["Content-Encoding"], "br" if src.compression.brotli is not None else "gzip")
+
+    def test_brotli_unavailable(self):
+        # Availability is decided once at import, requests don't retry the import
+        with mock.patch.object(src.compression, "brotli", None), mock.patch("builtins.__import__", side_effect=__import__) as import_:
+            response = self.get("/large", "br, gzip")
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("brotli", [call[0][0] for call in import_.call_args_list])
+
+    def test_not_compressed(self):
+        self.assertNotIn("Content-Encoding", self.get("/small", "gzip").headers)
+        self.assertNotIn("Content-Encoding", self.get("/large", "identity").headers)
+        self.assertNotIn("Content-Encoding", self.get("/large", "gzip;q=0").headers)
+        self.assertEqual(self.get("/large", "identity").text, BODY)
+
+if __name__ == "__main__":
+    unittest.main()
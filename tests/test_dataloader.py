@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import Dict, List
+import asyncio
+import unittest
+from src.dataloader import DataLoader, get_request_loader
+
+class DataLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches: List[List[str]] = []
+
+    def batch_load(self, keys: List[str]) -> Dict[str, str]:
+        self.batches.append(keys)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    def test_batched(self):
+        async def load():
+            loader = DataLoader(self.batch_load)
+            first = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("missing"))
+
+            # Keys already loaded come from the loader, new ones go in another batch
+            second = await asyncio.gather(loader.load("b"), loader.load("c"))
+            return (first, second)
+
+        first, second = asyncio.run(load())
+
+        self.assertEqual(first, ["A", "B", "A", None])
+        self.assertEqual(second, ["B", "C"])
+        self.assertEqual(self.batches, [["a", "b", "missing"], ["c"]])
+
+    def test_batch_error(self):
+        def batch_load(keys: List[str]) -> Dict[str, str]:
+            raise ConnectionError("Neo4j is unavailable")
+
+        async def load():
+            loader = DataLoader(batch_load)
+            return await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+
+        self.assertEqual([type(result) for result in asyncio.run(load())], [ConnectionError, ConnectionError])
+
+    def test_request_loader(self):
+        context: Dict = {}
+
+        async def loaders():
+            return (get_request_loader(context, "root_capability", self.batch_load), get_request_loader(context, "root_capability", self.batch_load))
+
+        first, second = asyncio.run(loaders())
+
+        self.assertIs(first, second)
+        self.assertIs(context["dataloaders"]["root_capability"], first)
+
+    def test_no_request_loader(self):
+        # Executing synchronously, or without a context to keep the loader in
+        self.assertIsNone(get_request_loader({}, "root_capability", self.batch_load))
+        self.assertIsNone(asyncio.run(self.request_loader(None)))
+
+    async def request_loader(self, context):
+        return get_request_loader(context, "root_capability", self.batch_load)
+
+if __name__ == "__main__":
+    unittest.main()
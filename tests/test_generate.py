@@ -0,0 +1,108 @@
+from __future__ import annotations
+from argparse import Namespace
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+from gomboctypes.models import CfnResource, Capability, NodeLabels
+from src.artifact import CapabilityArtifact
+from src.offline_graph import OfflineGraph, write_graph_dump
+from src.querybuilder import CapabilityQueryGenerator, Query, ResourceQueryGenerator
+from src.resource_fingerprints import resource_fingerprints
+from tests.test_offline_graph import ALIAS, ALIAS_ADDING, ALIAS_NAME, CAN_BE_USED_TO, ENABLES, ENCRYPTION, KEY, PROVIDES, USES_KEY, path_family_graph
+from tests.fixtures import BUCKET, DATA_PROTECTION, ENCRYPTION_AT_REST, VERSIONING, bucket_implementations
+import generate
+
+GRAPH = ([((NodeLabels.CFN_RESOURCE.value, BUCKET), {"id": BUCKET})], [])
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "capability_artifact.bin")
+
+        # The graph as Neo4j would return it: one resource type, and three capabilities
+        patches = [
+            mock.patch.object(Query, "parse_column_as_model", autospec=True, return_value=[CfnResource(id=BUCKET)]),
+            mock.patch.object(Query, "graph_content", return_value=GRAPH),
+            mock.patch.object(Capability, "load_all", return_value=[DATA_PROTECTION, ENCRYPTION_AT_REST, VERSIONING]),
+            mock.patch.object(CapabilityQueryGenerator, "ancestor_capabilities", side_effect=lambda capability_ids: {capability_id: [] if capability_id == DATA_PROTECTION.id else [DATA_PROTECTION] for capability_id in capability_ids}),
+            mock.patch.object(ResourceQueryGenerator, "get_capabilities_implementations_batch", side_effect=lambda resource_ids: {resource_id: bucket_implementations() for resource_id in resource_ids})]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def generate(self, incremental: bool = False, write_fingerprints: bool = False) -> CapabilityArtifact:
+        generate.generate(Namespace(workers=2, batch_size=1, incremental=incremental, write_fingerprints=write_fingerprints, output=self.path))
+        return CapabilityArtifact(self.path)
+
+    def test_generate(self):
+        artifact = self.generate()
+
+        self.assertEqual(artifact.resource_types, [BUCKET])
+        self.assertEqual(artifact.get_root_capability(ENCRYPTION_AT_REST.id), DATA_PROTECTION)
+        self.assertEqual(len(artifact.get_capability_index(BUCKET).capabilities), 2)
+
+    def test_fingerprints_not_read(self):
+        # Fingerprinting reads the whole graph, which isn't needed for a full run
+        self.assertIsNone(self.generate().get_fingerprint(BUCKET))
+        Query.graph_content.assert_not_called()
+
+    def test_write_fingerprints(self):
+        self.assertEqual(self.generate(write_fingerprints=True).get_fingerprint(BUCKET), resource_fingerprints(*GRAPH)[BUCKET])
+
+    def test_incremental(self):
+        self.generate(write_fingerprints=True)
+        ResourceQueryGenerator.get_capabilities_implementations_batch.reset_mock()
+
+        artifact = self.generate(incremental=True)
+
+        self.assertEqual(len(artifact.get_capability_index(BUCKET).capabilities), 2)
+        ResourceQueryGenerator.get_capabilities_implementations_batch.assert_not_called()
+
+    def test_incremental_without_fingerprints(self):
+        self.generate()
+        self.generate(incremental=True)
+
+        self.assertEqual(ResourceQueryGenerator.get_capabilities_implementations_batch.call_count, 2)
+
+class GraphDumpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "capability_artifact.bin")
+
+        # A bucket encrypted with a KMS key that an alias adds capabilities to, and the capabilities' hierarchy
+        self.graph = path_family_graph(USES_KEY + ALIAS_ADDING + [
+            (ENCRYPTION, ENABLES, "encryption-at-rest"), (KEY, CAN_BE_USED_TO, "encrypt-with-kms"), (ALIAS_NAME, ENABLES, "key-aliasing"),
+            ("encrypt-with-kms", PROVIDES, "customer-managed-keys"), ("customer-managed-keys", PROVIDES, "encryption-at-rest"), ("encryption-at-rest", PROVIDES, "data-protection")])
+
+    def test_generate(self):
+        # Every query generate.py runs is answered from the dump, none reaches Neo4j
+        with mock.patch("src.querybuilder.get_driver", side_effect=AssertionError("Neo4j was queried")), self.graph.activate():
+            generate.generate(Namespace(workers=2, batch_size=2, incremental=False, write_fingerprints=True, output=self.path))
+
+        artifact = CapabilityArtifact(self.path)
+
+        self.assertEqual(artifact.resource_types, sorted([ALIAS, BUCKET, KEY]))
+        self.assertEqual([capability.id for capability in artifact.get_ancestor_capabilities("customer-managed-keys")], ["encryption-at-rest", "data-protection"])
+        self.assertEqual(artifact.get_fingerprint(BUCKET), resource_fingerprints(*self.graph.graph_content())[BUCKET])
+        self.assertEqual(sorted(capability.id for capability in artifact.get_capability_index(BUCKET).capabilities), ["customer-managed-keys", "encryption-at-rest"])
+        self.assertEqual([capability.id for capability in artifact.get_capability_index(KEY).capabilities], ["key-aliasing"])
+
+    def test_other_queries(self):
+        with self.graph.activate(), self.assertRaisesRegex(Exception, "isn't answerable from a graph dump"):
+            Query("MATCH (node) RETURN node").run(list)
+
+    def test_write_graph_dump(self):
+        path = os.path.join(self.directory, "graph_dump.json")
+        write_graph_dump(path, *self.graph.graph_content())
+
+        self.assertEqual(OfflineGraph.load(path).graph_content(), self.graph.graph_content())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from unittest import mock
+import hashlib
+import importlib.util
+import json
+import unittest
+import graphene
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+from starlette_graphene3 import make_graphiql_handler
+from src.graphql_app import InstrumentedGraphQLApp
+from src.queries import Query
+from tests.fixtures import BUCKET, use_capability_artifact
+import src.graphql_app
+
+TEMPLATE = json.dumps({"Resources": {"Bucket": {"Type": BUCKET, "Properties": {"BucketEncryption": {"Rules": []}}}}})
+QUERY = "query($template: String!) { scanCloudformationTemplate(template: $template) { currentlyImplements { id } } }"
+
+class InstrumentedGraphQLAppTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.client = TestClient(InstrumentedGraphQLApp(graphene.Schema(query=Query), on_get=make_graphiql_handler()))
+
+    def test_metrics_extension(self):
+        response = self.client.post("/", json={"query": QUERY, "variables": {"template": TEMPLATE}, "extensions": {"metrics": True}})
+
+        self.assertEqual(response.json()["data"], {"scanCloudformationTemplate": [{"currentlyImplements": [{"id": "encryption-at-rest"}]}]})
+        self.assertEqual(response.json()["extensions"]["metrics"]["counts"]["resources"], 1)
+        self.assertIn("graphql_execution", response.json()["extensions"]["metrics"]["phases"])
+
+    def test_no_metrics_extension(self):
+        self.assertNotIn("extensions", self.client.post("/", json={"query": QUERY, "variables": {"template": TEMPLATE}}).json())
+
+    def test_errors(self):
+        response = self.client.post("/", json={"query": "{ scanCloudformationTemplate(template: \"{\") { logicalName } }"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["data"])
+        self.assertEqual(len(response.json()["errors"]), 1)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.post("/", data="{", headers={"Content-Type": "application/json"}).status_code, 400)
+        self.assertEqual(self.client.post("/", json=[{"query": QUERY}]).json(), {"errors": ["This server does not support batching"]})
+        self.assertEqual(self.client.post("/", json="query").status_code, 400)
+
+    def test_orjson_resolved_once(self):
+        src.graphql_app._orjson_dumps.cache_clear()
+        self.addCleanup(src.graphql_app._orjson_dumps.cache_clear)
+
+        for _ in range(2):
+            self.assertEqual(self.client.post("/", json={"query": QUERY, "variables": {"template": TEMPLATE}}).json()["data"], {"scanCloudformationTemplate": [{"currentlyImplements": [{"id": "encryption-at-rest"}]}]})
+
+        self.assertEqual(src.graphql_app._orjson_dumps.cache_info().misses, 1)
+
+    def test_persisted_query(self):
+        # The Apollo flow: the hash alone, then the query with its hash, then the hash alone again
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": hashlib.sha256(QUERY.encode("utf-8")).hexdigest()}}
+
+        self.assertEqual(self.client.post("/", json={"variables": {"template": TEMPLATE}, "extensions": extensions}).json()["errors"][0]["message"], "PersistedQueryNotFound")
+        self.assertNotIn("errors", self.client.post("/", json={"query": QUERY, "variables": {"template": TEMPLATE}, "extensions": extensions}).json())
+        self.assertEqual(self.client.post("/", json={"variables": {"template": TEMPLATE}, "extensions": extensions}).json()["data"], {"scanCloudformationTemplate": [{"currentlyImplements": [{"id": "encryption-at-rest"}]}]})
+
+    def test_graphiql(self):
+        response = self.client.get("/", headers={"Accept": "text/html"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("graphiql", response.text.lower())
+
+    def test_multipart_delegated(self):
+        # Left to GraphQLApp, as before it was wrapped
+        app = InstrumentedGraphQLApp(graphene.Schema(query=Query))
+        scopes = []
+
+        async def graphql_app(scope, receive, send):
+            scopes.append(scope)
+            await PlainTextResponse("")(scope, receive, send)
+
+        with mock.patch.object(app, "graphql_app", graphql_app):
+            TestClient(app).post("/", data={"operations": "{}", "map": "{}"}, files={"upload": ("upload.txt", b"")})
+
+        self.assertEqual([scope["method"] for scope in scopes], ["POST"])
+
+    @unittest.skipIf(importlib.util.find_spec("multipart") is None, "python-multipart isn't installed")
+    def test_multipart(self):
+        operations = json.dumps({"query": QUERY, "variables": {"template": TEMPLATE}})
+        response = self.client.post("/", data={"operations": operations, "map": "{}"}, files={"upload": ("upload.txt", b"")})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], {"scanCloudformationTemplate": [{"currentlyImplements": [{"id": "encryption-at-rest"}]}]})
+
+if __name__ == "__main__":
+    unittest.main()
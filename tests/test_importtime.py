@@ -0,0 +1,19 @@
+from __future__ import annotations
+import unittest
+from importtime import DEFERRED_MODULES, budget_ms, import_times
+
+class ImportTimeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # One fresh interpreter importing app, as the Lambda runtime does on a cold start
+        cls.self_us, cls.cumulative_us = import_times("app")
+
+    def test_deferred_modules(self):
+        self.assertEqual([module for module in DEFERRED_MODULES if module in self.cumulative_us], [])
+
+    def test_budget(self):
+        self.assertLessEqual(self.cumulative_us["app"] / 1000, budget_ms())
+
+if __name__ == "__main__":
+    unittest.main()
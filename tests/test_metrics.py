@@ -0,0 +1,121 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from unittest import mock
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import src.metrics
+from src.metrics import Metrics, MetricsRegistry
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        registry = mock.patch.object(src.metrics, "registry", MetricsRegistry())
+        self.registry = registry.start()
+        self.addCleanup(registry.stop)
+
+    def test_collect(self):
+        # Recorded for the request collecting, and the registry, but not once the request is done
+        with src.metrics.collect("graphql") as request_metrics:
+            with src.metrics.phase("parse"):
+                pass
+
+            src.metrics.count("resources", 3)
+
+        src.metrics.count("resources")
+
+        self.assertEqual(request_metrics.as_dict()["counts"], {"resources": 3})
+        self.assertEqual(request_metrics.as_dict()["phases"]["parse"]["calls"], 1)
+        self.assertEqual(self.registry.as_dict()["counts"], {"resources": 4})
+
+    def test_worker_threads(self):
+        # Threads running copies of the request's context all update its metrics
+        def scan():
+            for _ in range(1000):
+                src.metrics.count("edges")
+
+        with src.metrics.collect("graphql") as request_metrics:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for future in [executor.submit(copy_context().run, scan) for _ in range(8)]:
+                    future.result()
+
+        self.assertEqual(request_metrics.as_dict()["counts"], {"edges": 8000})
+        self.assertEqual(self.registry.as_dict()["counts"], {"edges": 8000})
+
+    def test_prometheus_text(self):
+        self.registry.observe("parse", 0.5)
+        self.registry.count("resources", 2)
+
+        self.assertEqual(self.registry.prometheus_text().splitlines()[2:], [
+            'gomboc_phase_seconds_sum{phase="parse"} 0.5',
+            'gomboc_phase_seconds_count{phase="parse"} 1',
+            "# HELP gomboc_events_total Resources, edges, capabilities checked, plans built and other scan events",
+            "# TYPE gomboc_events_total counter",
+            'gomboc_events_total{event="resources"} 2'])
+
+class MetricsDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        metrics_dir = mock.patch.object(src.metrics, "_metrics_dir", return_value=self.directory)
+        metrics_dir.start()
+        self.addCleanup(metrics_dir.stop)
+
+    def write(self, pid: int, metrics: Metrics):
+        with open(os.path.join(self.directory, f"{pid}.json"), "w") as file:
+            json.dump({"phases": {phase_name: list(observed) for phase_name, observed in metrics.phases.items()}, "counts": metrics.counts}, file)
+
+    def test_snapshot(self):
+        registry = MetricsRegistry()
+
+        with mock.patch("threading.Timer") as timer:
+            registry.count("resources", 2)
+            registry.observe("parse", 0.5)
+
+        # One write scheduled for both updates
+        self.assertEqual(timer.call_count, 1)
+        timer.call_args[0][1]()
+
+        with open(os.path.join(self.directory, f"{os.getpid()}.json")) as file:
+            self.assertEqual(json.load(file), {"phases": {"parse": [0.5, 1]}, "counts": {"resources": 2}})
+
+        self.assertEqual(os.listdir(self.directory), [f"{os.getpid()}.json"])
+
+    def test_reset(self):
+        registry = MetricsRegistry()
+
+        with mock.patch("threading.Timer") as timer:
+            registry.count("resources", 2)
+            registry.reset()
+            registry.count("edges", 1)
+
+        # The write still pending when the worker was forked doesn't keep the worker from scheduling its own
+        self.assertEqual(timer.call_count, 2)
+        self.assertEqual(registry.snapshot(), {"phases": {}, "counts": {"edges": 1}})
+
+    def test_aggregate(self):
+        # The other workers' snapshots are summed with this process's own current numbers, not its snapshot
+        worker = Metrics()
+        worker.observe("parse", 0.25)
+        worker.count("resources", 5)
+        self.write(1, worker)
+        self.write(os.getpid(), worker)
+
+        with open(os.path.join(self.directory, "2.json.tmp"), "w") as file:
+            file.write("{")
+
+        registry = MetricsRegistry()
+
+        with mock.patch("threading.Timer"):
+            registry.observe("parse", 0.5)
+            registry.count("edges", 1)
+
+        self.assertEqual(registry.aggregate(), {"phases": {"parse": [0.75, 2]}, "counts": {"resources": 5, "edges": 1}})
+        self.assertIn('gomboc_events_total{event="resources"} 5', registry.prometheus_text())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+from typing import Dict
+import json
+import os
+import unittest
+from src.offline_graph import OfflineGraph
+from src.querybuilder import ResourceQueryGenerator
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+BUCKET, POLICY, ROLE, FUNCTION, KEY, ALIAS = "AWS::S3::Bucket", "AWS::S3::BucketPolicy", "AWS::IAM::Role", "AWS::Lambda::Function", "AWS::KMS::Key", "AWS::KMS::Alias"
+ENCRYPTION, KMS_KEY_ID = f"{BUCKET}.BucketEncryption", f"{BUCKET}.BucketEncryption.KMSMasterKeyID"
+POLICY_BUCKET, POLICY_BUCKET_ARN = f"{POLICY}.Bucket", f"{POLICY}.Bucket.Arn"
+POLICIES, ASSUME_ROLE_POLICY, STATEMENT = f"{ROLE}.Policies", f"{ROLE}.AssumeRolePolicyDocument", f"{ROLE}.AssumeRolePolicyDocument.Statement"
+FUNCTION_ROLE, KEY_POLICY, TARGET_KEY_ID, ALIAS_NAME = f"{FUNCTION}.Role", f"{KEY}.KeyPolicy", f"{ALIAS}.TargetKeyId", f"{ALIAS}.AliasName"
+USE_CASES = ["encrypt-with-kms", "assume-role", "restrict-access"]
+
+HAS, ENABLES, USES, CAN_BE_USED_TO, PROVIDES, ADDS = "HAS_SUBPROPERTY", "ENABLES_INTERNAL_CAPABILITY", "USES_OTHER_RESOURCE_TO", "CAN_BE_USED_TO", "PROVIDES_CAPABILITY", "ADDS_CAPABILITIES_TO_RESOURCE"
+USES_KEY = [(BUCKET, HAS, ENCRYPTION), (ENCRYPTION, HAS, KMS_KEY_ID), (KMS_KEY_ID, USES, "encrypt-with-kms")]
+ALIAS_ADDING = [(ALIAS, HAS, TARGET_KEY_ID), (ALIAS, HAS, ALIAS_NAME), (TARGET_KEY_ID, ADDS, KEY)]
+POLICY_ADDING = [(POLICY, HAS, POLICY_BUCKET), (POLICY_BUCKET, ADDS, BUCKET)]
+
+# One graph per path family of ResourceQueryGenerator.internal_capabilities_implementations_cypher_query: the resource
+# scanned, the graph's relationships, and the (internal_resource_configuration, other_resource_configuration,
+# capability) rows the query returns for it. Neo4jPathFamilyTest runs the query on the same graphs.
+PATH_FAMILIES = {
+    # Resource -> Properties -> Capabilities
+    "internal_capabilities": (BUCKET, [(BUCKET, HAS, ENCRYPTION), (ENCRYPTION, HAS, KMS_KEY_ID), (ENCRYPTION, ENABLES, "encryption-at-rest"), (KMS_KEY_ID, ENABLES, "customer-managed-keys")], [
+        [[BUCKET, ENCRYPTION, KMS_KEY_ID, "customer-managed-keys"], None, "customer-managed-keys"],
+        [[BUCKET, ENCRYPTION, "encryption-at-rest"], None, "encryption-at-rest"]]),
+
+    # Resource -> Properties -> Usecases, capabilities directly from the use case
+    "use_case_capabilities": (BUCKET, USES_KEY + [(KEY, CAN_BE_USED_TO, "encrypt-with-kms"), (KEY, HAS, KEY_POLICY), (KEY_POLICY, CAN_BE_USED_TO, "encrypt-with-kms"), ("encrypt-with-kms", PROVIDES, "customer-managed-keys")], [
+        [[BUCKET, ENCRYPTION, KMS_KEY_ID, "encrypt-with-kms"], ["encrypt-with-kms", KEY], "customer-managed-keys"],
+        [[BUCKET, ENCRYPTION, KMS_KEY_ID, "encrypt-with-kms"], ["encrypt-with-kms", KEY_POLICY, KEY], "customer-managed-keys"]]),
+
+    # Resource -> Properties -> Usecases, capabilities from subproperties of the property that can be used to
+    "use_case_property_capabilities": (FUNCTION, [(FUNCTION, HAS, FUNCTION_ROLE), (FUNCTION_ROLE, USES, "assume-role"), (ROLE, HAS, ASSUME_ROLE_POLICY), (ASSUME_ROLE_POLICY, HAS, STATEMENT), (ASSUME_ROLE_POLICY, CAN_BE_USED_TO, "assume-role"), (STATEMENT, PROVIDES, "least-privilege")], [
+        [[FUNCTION, FUNCTION_ROLE, "assume-role"], [ROLE, ASSUME_ROLE_POLICY, STATEMENT, "least-privilege"], "least-privilege"]]),
+
+    # Resource -> Properties -> Usecases, capabilities from a resource adding capabilities to the one used
+    "use_case_adding_capabilities": (BUCKET, USES_KEY + ALIAS_ADDING + [(KEY, CAN_BE_USED_TO, "encrypt-with-kms"), (ALIAS_NAME, PROVIDES, "key-aliasing")], [
+        [[BUCKET, ENCRYPTION, KMS_KEY_ID, "encrypt-with-kms"], ["encrypt-with-kms", KEY, TARGET_KEY_ID, ALIAS, ALIAS_NAME, "key-aliasing"], "key-aliasing"]]),
+
+    # Resource <- Resource_Adding_capabilities -> Properties -> Capabilities
+    "adding_capabilities": (KEY, ALIAS_ADDING + [(ALIAS_NAME, ENABLES, "key-aliasing")], [
+        [[KEY], [TARGET_KEY_ID, ALIAS, ALIAS_NAME, "key-aliasing"], "key-aliasing"]]),
+
+    # Resource <- Resource Adding Capabilities -> Properties -> Usecases, capabilities directly from the use case. The
+    # use case's pattern repeats the path from to_primary_resource, which has to take other relationships: each of the
+    # two ways to restrict-access is the path once, the other one repeating it
+    "adding_use_case_capabilities": (BUCKET, POLICY_ADDING + [(POLICY_BUCKET, HAS, POLICY_BUCKET_ARN), (POLICY_BUCKET, USES, "restrict-access"), (POLICY_BUCKET_ARN, USES, "restrict-access"), (ROLE, HAS, POLICIES), (POLICIES, CAN_BE_USED_TO, "restrict-access"), ("restrict-access", PROVIDES, "access-control")], [
+        [[BUCKET], [POLICY_BUCKET, POLICY_BUCKET_ARN, "restrict-access", POLICIES, ROLE], "access-control"],
+        [[BUCKET], [POLICY_BUCKET, "restrict-access", POLICIES, ROLE], "access-control"]]),
+
+    # The same with one way to restrict-access, which the repeated path can't take again
+    "adding_use_case_capabilities_one_path": (BUCKET, POLICY_ADDING + [(POLICY_BUCKET, USES, "restrict-access"), (ROLE, HAS, POLICIES), (POLICIES, CAN_BE_USED_TO, "restrict-access"), ("restrict-access", PROVIDES, "access-control")], []),
+
+    # Resource <- Resource Adding Capabilities -> Properties -> Usecases, capabilities from subproperties of the
+    # property that can be used to
+    "adding_use_case_property_capabilities": (BUCKET, POLICY_ADDING + [(POLICY_BUCKET, USES, "restrict-access"), (ROLE, HAS, POLICIES), (POLICIES, CAN_BE_USED_TO, "restrict-access"), (POLICIES, PROVIDES, "least-privilege")], [
+        [[BUCKET], [ROLE, POLICIES, "least-privilege"], "least-privilege"]]),
+
+    # Resource <- Resource Adding Capabilities -> Properties -> Usecases, capabilities from a resource adding
+    # capabilities to the one used
+    "adding_use_case_adding_capabilities": (BUCKET, POLICY_ADDING + ALIAS_ADDING + [(POLICY_BUCKET, USES, "encrypt-with-kms"), (KEY, CAN_BE_USED_TO, "encrypt-with-kms"), (ALIAS_NAME, PROVIDES, "key-aliasing")], [
+        [[BUCKET], [POLICY_BUCKET, "encrypt-with-kms", KEY, TARGET_KEY_ID, ALIAS, ALIAS_NAME, "key-aliasing"], "key-aliasing"]]),
+}
+
+def node_label(node_id: str) -> str:
+    if (node_id.startswith("AWS::")):
+        return "CfnProperty" if "." in node_id else "CfnResource"
+
+    return "UseCase" if node_id in USE_CASES else "Capability"
+
+def path_family_graph(relationships) -> OfflineGraph:
+    graph = OfflineGraph()
+    node_indexes: Dict[str, int] = {}
+
+    for source, _, target in relationships:
+        for node_id in (source, target):
+            if (node_id not in node_indexes):
+                # Capabilities with the properties generate.py parses them with
+                properties = {"id": node_id, "title": node_id, "description": ""} if node_label(node_id) == "Capability" else {"id": node_id}
+                node_indexes[node_id] = graph.add_node([node_label(node_id)], properties)
+
+    for source, type, target in relationships:
+        graph.add_relationship(node_indexes[source], type, node_indexes[target])
+
+    return graph
+
+def path_ids(path):
+    return [node._properties["id"] for node in path.nodes] if path is not None else None
+
+class PathFamilyTest(unittest.TestCase):
+
+    def test_path_families(self):
+        for family, (resource_id, relationships, expected) in PATH_FAMILIES.items():
+            with self.subTest(family):
+                records = path_family_graph(relationships).implementation_records([resource_id])
+
+                self.assertEqual(sorted([path_ids(record["internal_resource_configuration"]), path_ids(record["other_resource_configuration"]), record["capability"]._properties["id"]] for record in records), expected)
+
+# Runs the implementation query on the path family graphs in a scratch Neo4j database, which is emptied first:
+# NEO4J_TEST_URL=bolt://... NEO4J_TEST_USER=... NEO4J_TEST_PASSWORD=... python -m unittest tests.test_offline_graph
+@unittest.skipUnless(os.environ.get("NEO4J_TEST_URL"), "NEO4J_TEST_URL isn't set")
+class Neo4jPathFamilyTest(unittest.TestCase):
+
+    def setUp(self):
+        from neo4j import GraphDatabase
+
+        self.driver = GraphDatabase.driver(os.environ["NEO4J_TEST_URL"], auth=(os.environ.get("NEO4J_TEST_USER", "neo4j"), os.environ.get("NEO4J_TEST_PASSWORD", "")))
+        self.addCleanup(self.driver.close)
+
+    def test_path_families(self):
+        for family, (resource_id, relationships, expected) in PATH_FAMILIES.items():
+            with self.subTest(family), self.driver.session() as session:
+                session.run("MATCH (node) DETACH DELETE node").consume()
+
+                for source, type, target in relationships:
+                    session.run(f"MERGE (source:{node_label(source)} {{id: $source}}) MERGE (target:{node_label(target)} {{id: $target}}) CREATE (source)-[:{type}]->(target)", source=source, target=target).consume()
+
+                statement, parameters = ResourceQueryGenerator.internal_capabilities_implementations_cypher_query([resource_id]).statement()
+                rows = [[[node["id"] for node in record["internal_resource_configuration"].nodes], [node["id"] for node in record["other_resource_configuration"].nodes] if record["other_resource_configuration"] is not None else None, record["capability"]["id"]] for record in session.run(statement, parameters)]
+
+                self.assertEqual(sorted(rows), expected)
+
+# tests/data/graph_dump.json has a path of every family of ResourceQueryGenerator's implementation query, and
+# graph_dump_implementations.json what that query returns for it
+class OfflineGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = OfflineGraph.load(os.path.join(DATA_DIRECTORY, "graph_dump.json"))
+
+    def test_implementation_records(self):
+        with open(os.path.join(DATA_DIRECTORY, "graph_dump_implementations.json")) as file:
+            expected = json.load(file)
+
+        resource_ids = sorted(node._properties["id"] for node in self.graph.all_nodes("CfnResource"))
+        records = self.graph.implementation_records(resource_ids)
+        rows = sorted([record["resource_id"], path_ids(record["internal_resource_configuration"]), path_ids(record["other_resource_configuration"]), record["capability"]._properties["id"]] for record in records)
+
+        self.assertEqual(rows, expected)
+
+    def test_relationship_used_once_per_match(self):
+        # The only prefix from AWS::S3::BucketPolicy.Bucket to restrict-access that the provides pattern could repeat
+        # goes up the same HAS_SUBPROPERTY relationship
+        records = self.graph.implementation_records(["AWS::S3::Bucket"])
+
+        self.assertNotIn("access-control", [record["capability"]._properties["id"] for record in records])
+
+    def test_ancestor_capabilities(self):
+        # data-protection is reached directly and through encryption-at-rest, and comes after it
+        ancestors = self.graph.ancestor_capabilities(["customer-managed-keys", "security"])
+
+        self.assertEqual([node._properties["id"] for node in ancestors["customer-managed-keys"]], ["encryption-at-rest", "data-protection", "security"])
+        self.assertEqual(ancestors["security"], [])
+
+    def test_unknown_resource(self):
+        self.assertEqual(self.graph.implementation_records(["AWS::Unknown::Resource"]), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import hashlib
+import unittest
+import graphene
+from src.persisted_queries import DocumentCache
+from src.queries import Query
+
+QUERY = "query($template: String!) { scanCloudformationTemplate(template: $template) { logicalName } }"
+QUERY_HASH = hashlib.sha256(QUERY.encode("utf-8")).hexdigest()
+
+def persisted_query(query_hash: str):
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+
+class DocumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.document_cache = DocumentCache(graphene.Schema(query=Query).graphql_schema, 2)
+
+    def test_parsed_once(self):
+        document, errors = self.document_cache.get(QUERY)
+
+        self.assertEqual(errors, [])
+        self.assertIs(self.document_cache.get(QUERY)[0], document)
+        self.assertIs(self.document_cache.get(QUERY, persisted_query(QUERY_HASH))[0], document)
+
+    def test_persisted_query(self):
+        # The hash alone finds the query once it has been sent
+        document, errors = self.document_cache.get(None, persisted_query(QUERY_HASH))
+
+        self.assertIsNone(document)
+        self.assertEqual([(error.message, error.extensions) for error in errors], [("PersistedQueryNotFound", {"code": "PERSISTED_QUERY_NOT_FOUND"})])
+
+        document = self.document_cache.get(QUERY, persisted_query(QUERY_HASH))[0]
+
+        self.assertIs(self.document_cache.get(None, persisted_query(QUERY_HASH))[0], document)
+
+    def test_hash_mismatch(self):
+        document, errors = self.document_cache.get(QUERY, persisted_query("0" * 64))
+
+        self.assertIsNone(document)
+        self.assertEqual(errors[0].extensions, {"code": "PERSISTED_QUERY_HASH_MISMATCH"})
+
+    def test_invalid_not_kept(self):
+        invalid_query = "{ scanCloudformationTemplate { missing } }"
+        invalid_hash = hashlib.sha256(invalid_query.encode("utf-8")).hexdigest()
+
+        self.assertNotEqual(self.document_cache.get(invalid_query, persisted_query(invalid_hash))[1], [])
+        self.assertEqual(self.document_cache.get(None, persisted_query(invalid_hash))[1][0].message, "PersistedQueryNotFound")
+        self.assertEqual(len(self.document_cache.get("{")[1]), 1)
+
+    def test_no_query(self):
+        self.assertEqual(self.document_cache.get(None)[1][0].message, "Must provide query string.")
+        self.assertEqual(self.document_cache.get(1)[1][0].message, "The query must be a string.")
+
+    def test_evicted(self):
+        # Least recently used first
+        first = "{ __typename }"
+        self.document_cache.get(first)
+        self.document_cache.get(QUERY)
+        self.document_cache.get(first)
+        self.document_cache.get("query Other { __typename }")
+
+        self.assertEqual(list(self.document_cache._documents.keys()), [hashlib.sha256(first.encode("utf-8")).hexdigest(), hashlib.sha256(b"query Other { __typename }").hexdigest()])
+
+    def test_disabled(self):
+        document_cache = DocumentCache(graphene.Schema(query=Query).graphql_schema, 0)
+
+        self.assertIsNotNone(document_cache.get(QUERY)[0])
+        self.assertEqual(len(document_cache._documents), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+from unittest import mock
+import asyncio
+import json
+import threading
+import unittest
+import graphene
+from starlette.background import BackgroundTasks
+from src.capability_index import CapabilityIndex
+from src.querybuilder import Query
+from src.settings import DataSource
+from tests.fixtures import BUCKET, DATA_PROTECTION, use_capability_artifact
+import src.queries
+
+TEMPLATE = json.dumps({"Resources": {"Bucket": {"Type": BUCKET, "Properties": {"Tags": []}}}})
+ROOT_CAPABILITY_QUERY = "query($template: String!) { scanCloudformationTemplate(template: $template) { supportsButDoesNotCurrentlyImplement { capability { id rootCapability { id } } } } }"
+
+class ScanQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.schema = graphene.Schema(query=src.queries.Query)
+        implementation_plan = mock.patch.object(CapabilityIndex, "implementation_plan", autospec=True, side_effect=CapabilityIndex.implementation_plan)
+        self.implementation_plan = implementation_plan.start()
+        self.addCleanup(implementation_plan.stop)
+
+    def recommendations(self, arguments: str, selection: str):
+        query = f"query($template: String!) {{ scanCloudformationTemplate(template: $template) {{ logicalName supportsButDoesNotCurrentlyImplement{arguments} {{ {selection} }} }} }}"
+        result = asyncio.run(self.schema.execute_async(query, variable_values={"template": TEMPLATE}))
+
+        self.assertIsNone(result.errors)
+        return result.data["scanCloudformationTemplate"][0]["supportsButDoesNotCurrentlyImplement"]
+
+    def test_plans_not_selected(self):
+        recommendations = self.recommendations("", "capability { id }")
+
+        self.assertEqual([recommendation["capability"]["id"] for recommendation in recommendations], ["encryption-at-rest", "versioning"])
+        self.assertEqual(self.implementation_plan.call_count, 0)
+
+    def test_plans_selected(self):
+        recommendations = self.recommendations("", "capability { id } implementations { resources { type action properties { name } } }")
+
+        self.assertEqual(recommendations[0]["implementations"], [{"resources": [{"type": BUCKET, "action": "ADD_PROPERTIES", "properties": [{"name": "BucketEncryption"}]}]}])
+        self.assertEqual(self.implementation_plan.call_count, 2)
+
+    def test_plans_built_off_the_event_loop(self):
+        threads = []
+        implementation_plan = self.implementation_plan.side_effect
+        self.implementation_plan.side_effect = lambda *args: threads.append(threading.current_thread()) or implementation_plan(*args)
+        self.recommendations("", "implementations { resources { type } }")
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    def test_plans_selected_through_fragment(self):
+        query = "... on Recommendations_Model { implementations { resources { type } } }"
+
+        self.assertEqual(len(self.recommendations("", query)[1]["implementations"]), 1)
+
+    def test_filtered_recommendations(self):
+        # Plans are only built for the recommendations left after filtering
+        self.assertEqual(self.recommendations('(capabilityIds: ["versioning"])', "capability { id } implementations { resources { type } }")[0]["capability"]["id"], "versioning")
+        self.assertEqual(self.implementation_plan.call_count, 1)
+        self.assertEqual([recommendation["capability"]["id"] for recommendation in self.recommendations("(limit: 1)", "capability { id }")], ["encryption-at-rest"])
+
+class ScanTemplatesQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.schema = graphene.Schema(query=src.queries.Query)
+
+    def test_scan_templates(self):
+        query = "query($templates: [String!]!) { scanCloudformationTemplates(templates: $templates) { resources { logicalName currentlyImplements { id } } error } }"
+        result = asyncio.run(self.schema.execute_async(query, variable_values={"templates": [TEMPLATE, "{"]}))
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["scanCloudformationTemplates"][0], {"resources": [{"logicalName": "Bucket", "currentlyImplements": []}], "error": None})
+        self.assertIsNone(result.data["scanCloudformationTemplates"][1]["resources"])
+        self.assertTrue(result.data["scanCloudformationTemplates"][1]["error"].startswith("JSONDecodeError"))
+
+class NormalizedScanQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.schema = graphene.Schema(query=src.queries.Query)
+
+    def report(self, selection: str):
+        query = f"query($templates: [String!]!) {{ scanCloudformationTemplatesNormalized(templates: $templates) {{ {selection} }} }}"
+        result = asyncio.run(self.schema.execute_async(query, variable_values={"templates": [TEMPLATE, TEMPLATE, "{"]}))
+
+        self.assertIsNone(result.errors)
+        return result.data["scanCloudformationTemplatesNormalized"]
+
+    def test_normalized(self):
+        report = self.report("capabilities { id } implementationPlans { id resources { type } } templates { resources { logicalName supportsButDoesNotCurrentlyImplement { capabilityId implementationPlanIds } } error }")
+
+        # Both templates' resources refer to the same capabilities and plans
+        self.assertEqual([capability["id"] for capability in report["capabilities"]], ["encryption-at-rest", "versioning"])
+        self.assertEqual([plan["id"] for plan in report["implementationPlans"]], [0, 1])
+        self.assertEqual(report["templates"][0], report["templates"][1])
+        self.assertEqual(report["templates"][0]["resources"][0]["supportsButDoesNotCurrentlyImplement"], [
+            {"capabilityId": "encryption-at-rest", "implementationPlanIds": [0]},
+            {"capabilityId": "versioning", "implementationPlanIds": [1]}])
+        self.assertTrue(report["templates"][2]["error"].startswith("JSONDecodeError"))
+
+    def test_only_plan_ids_selected(self):
+        recommendations = self.report("templates { resources { supportsButDoesNotCurrentlyImplement { implementationPlanIds } } }")["templates"][0]["resources"][0]["supportsButDoesNotCurrentlyImplement"]
+
+        self.assertEqual(recommendations, [{"implementationPlanIds": [0]}, {"implementationPlanIds": [1]}])
+
+    def test_plans_not_selected(self):
+        with mock.patch.object(CapabilityIndex, "implementation_plan", autospec=True) as implementation_plan:
+            self.report("capabilities { id } templates { resources { supportsButDoesNotCurrentlyImplement { capabilityId } } }")
+
+        self.assertEqual(implementation_plan.call_count, 0)
+
+class RootCapabilityTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.schema = graphene.Schema(query=src.queries.Query)
+
+    def test_root_capability(self):
+        result = asyncio.run(self.schema.execute_async(ROOT_CAPABILITY_QUERY, variable_values={"template": TEMPLATE}))
+
+        self.assertIsNone(result.errors)
+        self.assertEqual([recommendation["capability"] for recommendation in result.data["scanCloudformationTemplate"][0]["supportsButDoesNotCurrentlyImplement"]], [
+            {"id": "encryption-at-rest", "rootCapability": {"id": "data-protection"}},
+            {"id": "versioning", "rootCapability": {"id": "data-protection"}}])
+
+    def test_root_capabilities_batched(self):
+        # Every rootCapability of the response in one Neo4j query
+        with mock.patch.object(src.queries.settings, "DATASOURCE", DataSource.NEO4J.value), mock.patch.object(Query, "run", autospec=True, return_value={"encryption-at-rest": DATA_PROTECTION}) as run:
+            result = asyncio.run(self.schema.execute_async(ROOT_CAPABILITY_QUERY, variable_values={"template": TEMPLATE}, context_value={"background": BackgroundTasks()}))
+
+        self.assertIsNone(result.errors)
+        self.assertEqual([recommendation["capability"]["rootCapability"] for recommendation in result.data["scanCloudformationTemplate"][0]["supportsButDoesNotCurrentlyImplement"]], [{"id": "data-protection"}, None])
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(run.call_args[0][0].statement()[1], {"capability_ids": ["encryption-at-rest", "versioning"]})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from types import SimpleNamespace
+from unittest import mock
+import unittest
+from src.querybuilder import CapabilityQueryGenerator, Query, ResourceQueryGenerator, SessionScope
+import src.querybuilder
+
+class StatementTest(unittest.TestCase):
+
+    def test_ids_as_parameters(self):
+        statement, parameters = CapabilityQueryGenerator(id="it's-{encrypted}").provides_capability(capability_column="dest_c", capability_id="data-protection").asQuery("dest_c").statement()
+
+        self.assertEqual(statement, "MATCH (:Capability {id: $id0})-[:PROVIDES_CAPABILITY*]->(dest_c:Capability {id: $id1}) RETURN dest_c")
+        self.assertEqual(parameters, {"id0": "it's-{encrypted}", "id1": "data-protection"})
+
+    def test_same_statement_across_ids(self):
+        # Neo4j only re-uses its cached plan for identical statement text
+        statements = [ResourceQueryGenerator.internal_capabilities_implementations_cypher_query(resource_ids).statement() for resource_ids in [["AWS::S3::Bucket"], ["AWS::SNS::Topic", "AWS::KMS::Key"]]]
+
+        self.assertEqual(statements[0][0], statements[1][0])
+        self.assertNotIn("AWS::", statements[0][0])
+        self.assertEqual(statements[0][1], {"resource_ids": ["AWS::S3::Bucket"]})
+        self.assertEqual(statements[1][1], {"resource_ids": ["AWS::SNS::Topic", "AWS::KMS::Key"]})
+
+    def test_repeated_id(self):
+        statement, parameters = Query(f"MATCH (a {{id: {src.querybuilder.id_parameter('x')}}}), (b {{id: {src.querybuilder.id_parameter('x')}}}) RETURN a").statement()
+
+        self.assertEqual(statement, "MATCH (a {id: $id0}), (b {id: $id0}) RETURN a")
+        self.assertEqual(parameters, {"id0": "x"})
+
+    def test_union(self):
+        union = Query("RETURN $a", {"a": 1}).union(CapabilityQueryGenerator(id="versioning").asQuery("1"))
+
+        self.assertEqual(union.statement(), ("RETURN $a UNION MATCH (:Capability {id: $id0}) RETURN 1", {"a": 1, "id0": "versioning"}))
+
+class BatchTest(unittest.TestCase):
+
+    def run_query(self, records):
+        def run(query, consume):
+            self.statements.append(query.statement())
+            return consume(records)
+
+        self.statements = []
+        return mock.patch.object(Query, "run", autospec=True, side_effect=run)
+
+    def test_implementations_batch(self):
+        records = [{"resource_id": "AWS::SNS::Topic", "implementation": 1}, {"resource_id": "AWS::S3::Bucket", "implementation": 2}, {"resource_id": "AWS::S3::Bucket", "implementation": 3}]
+
+        with self.run_query(records), mock.patch.object(ResourceQueryGenerator, "_parse_capability_implementation", side_effect=lambda record: record["implementation"]):
+            implementations = ResourceQueryGenerator.get_capabilities_implementations_batch(["AWS::S3::Bucket", "AWS::SNS::Topic", "AWS::KMS::Key"])
+
+        self.assertEqual(implementations, {"AWS::S3::Bucket": [2, 3], "AWS::SNS::Topic": [1], "AWS::KMS::Key": []})
+        self.assertEqual(len(self.statements), 1)
+
+    def test_ancestor_capabilities(self):
+        records = [{"capability_id": "encryption-at-rest", "ancestors": [SimpleNamespace(_properties={"id": "data-protection", "title": "Data protection", "description": ""})]}]
+
+        with self.run_query(records):
+            ancestors = CapabilityQueryGenerator.ancestor_capabilities(["encryption-at-rest", "data-protection"])
+
+        # Ancestors are ordered by Neo4j, deepest last, rather than by the order paths happen to come back in
+        self.assertEqual({capability_id: [ancestor.id for ancestor in capabilities] for capability_id, capabilities in ancestors.items()}, {"encryption-at-rest": ["data-protection"], "data-protection": []})
+        self.assertIn("ORDER BY depth, dest_c.id RETURN capability_id, collect(dest_c)", self.statements[0][0])
+        self.assertEqual(self.statements[0][1], {"capability_ids": ["encryption-at-rest", "data-protection"]})
+
+class SessionScopeTest(unittest.TestCase):
+
+    def setUp(self):
+        get_driver = mock.patch.object(src.querybuilder, "get_driver")
+        self.driver = get_driver.start().return_value
+        self.addCleanup(get_driver.stop)
+
+    def test_shared_session(self):
+        with SessionScope():
+            Query("RETURN 1").run(list)
+            Query("RETURN $id", {"id": 2}).run(list)
+
+            session = self.driver.session.return_value
+            self.assertEqual(self.driver.session.call_count, 1)
+            self.assertEqual([call[0][1] for call in session.run.call_args_list], [{}, {"id": 2}])
+            session.close.assert_not_called()
+
+        session.close.assert_called_once_with()
+
+    def test_session_per_query(self):
+        Query("RETURN 1").run(list)
+        Query("RETURN 1").run(list)
+
+        self.assertEqual(self.driver.session.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import unittest
+from gomboctypes.models import NodeLabels
+from src.resource_fingerprints import resource_fingerprints
+
+RESOURCE = NodeLabels.CFN_RESOURCE.value
+PROPERTY = NodeLabels.CFN_PROPERTY.value
+CAPABILITY = NodeLabels.CAPABILITY.value
+
+def graph(encryption_title: str = "Encryption", topic_property: str = "TopicName", capability_title: str = "Data protection"):
+    # A bucket and a topic in separate parts of the graph, both linked to the same capability
+    nodes = [
+        ((RESOURCE, "AWS::S3::Bucket"), {"id": "AWS::S3::Bucket"}),
+        ((PROPERTY, "AWS::S3::Bucket-BucketEncryption"), {"id": "AWS::S3::Bucket-BucketEncryption", "title": encryption_title}),
+        ((RESOURCE, "AWS::SNS::Topic"), {"id": "AWS::SNS::Topic"}),
+        ((PROPERTY, f"AWS::SNS::Topic-{topic_property}"), {"id": f"AWS::SNS::Topic-{topic_property}"}),
+        ((CAPABILITY, "data-protection"), {"id": "data-protection", "title": capability_title})]
+    relationships = [
+        ((RESOURCE, "AWS::S3::Bucket"), "HAS_PROPERTY", (PROPERTY, "AWS::S3::Bucket-BucketEncryption")),
+        ((PROPERTY, "AWS::S3::Bucket-BucketEncryption"), "PROVIDES_CAPABILITY", (CAPABILITY, "data-protection")),
+        ((RESOURCE, "AWS::SNS::Topic"), "HAS_PROPERTY", (PROPERTY, f"AWS::SNS::Topic-{topic_property}")),
+        ((PROPERTY, f"AWS::SNS::Topic-{topic_property}"), "PROVIDES_CAPABILITY", (CAPABILITY, "data-protection"))]
+    return (nodes, relationships)
+
+class ResourceFingerprintsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fingerprints = resource_fingerprints(*graph())
+
+    def test_resources(self):
+        self.assertEqual(sorted(self.fingerprints), ["AWS::S3::Bucket", "AWS::SNS::Topic"])
+        self.assertEqual(resource_fingerprints(*graph()), self.fingerprints)
+
+    def test_connected_change(self):
+        # Only the part of the graph that changed is regenerated, the capability both link to doesn't connect them
+        changed = resource_fingerprints(*graph(encryption_title="Server-side encryption"))
+
+        self.assertNotEqual(changed["AWS::S3::Bucket"], self.fingerprints["AWS::S3::Bucket"])
+        self.assertEqual(changed["AWS::SNS::Topic"], self.fingerprints["AWS::SNS::Topic"])
+
+    def test_relationship_change(self):
+        changed = resource_fingerprints(*graph(topic_property="KmsMasterKeyId"))
+
+        self.assertEqual(changed["AWS::S3::Bucket"], self.fingerprints["AWS::S3::Bucket"])
+        self.assertNotEqual(changed["AWS::SNS::Topic"], self.fingerprints["AWS::SNS::Topic"])
+
+    def test_capability_change(self):
+        changed = resource_fingerprints(*graph(capability_title="Protection"))
+
+        self.assertNotEqual(changed["AWS::S3::Bucket"], self.fingerprints["AWS::S3::Bucket"])
+        self.assertNotEqual(changed["AWS::SNS::Topic"], self.fingerprints["AWS::SNS::Topic"])
+
+if __name__ == "__main__":
+    unittest.main()
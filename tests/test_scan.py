@@ -0,0 +1,106 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import scan
+from tests.fixtures import write_capability_artifact
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENCRYPTED_BUCKET = '{"Resources": {"Bucket": {"Type": "AWS::S3::Bucket", "Properties": {"BucketEncryption": {}}}}}'
+PLAIN_BUCKET = '{"Resources": {"Bucket": {"Type": "AWS::S3::Bucket", "Properties": {}}}}'
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.artifact_path = os.path.join(self.directory, "capability_artifact.bin")
+        write_capability_artifact(self.artifact_path)
+        self.templates = os.path.join(self.directory, "templates")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path: str, content: str) -> str:
+        path = os.path.join(self.templates, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "w") as file:
+            file.write(content)
+
+        return path
+
+    def run_scan(self, *arguments: str) -> subprocess.CompletedProcess:
+        return subprocess.run([sys.executable, os.path.join(REPOSITORY, "scan.py"), self.templates, "--processes", "0", "--artifact", self.artifact_path, "--cache-dir", os.path.join(self.templates, ".scan_results"), *arguments], cwd=self.directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_requirements(self):
+        requirements = scan.parse_requirements(["encryption-at-rest", "AWS::S3::Bucket=versioning"])
+        result = {"resources": [{"logical_name": "Bucket", "type": "AWS::S3::Bucket", "implements": ["encryption-at-rest"], "missing": ["versioning"]}]}
+
+        self.assertEqual(requirements, [(None, "encryption-at-rest"), ("AWS::S3::Bucket", "versioning")])
+        self.assertEqual(scan.find_violations(result, requirements), [{"logical_name": "Bucket", "type": "AWS::S3::Bucket", "capability": "versioning"}])
+        self.assertEqual(scan.find_violations(result, scan.parse_requirements(["AWS::SQS::Queue=versioning"])), [])
+        self.assertEqual(scan.find_violations({"resources": None}, requirements), [])
+
+    def test_find_templates(self):
+        template = self.write("stacks/bucket.json", PLAIN_BUCKET)
+        self.write("stacks/notes.txt", "")
+        self.write(".git/bucket.json", PLAIN_BUCKET)
+        self.write("node_modules/package/bucket.json", PLAIN_BUCKET)
+        self.write("results/bucket.json", PLAIN_BUCKET)
+
+        self.assertEqual(scan.find_templates([self.templates], (os.path.join(self.templates, "results"),)), [template])
+
+    def test_result_cache(self):
+        result_cache = scan.ResultCache(os.path.join(self.directory, "results"), "digest")
+        result_cache.put(result_cache.key("template"), {"resources": [], "error": None})
+
+        self.assertEqual(result_cache.get(result_cache.key("template")), {"resources": [], "error": None})
+        self.assertIsNone(scan.ResultCache(os.path.join(self.directory, "results"), "other digest").get(scan.ResultCache(None, "other digest").key("template")))
+        self.assertIsNone(scan.ResultCache(None, "digest").get(result_cache.key("template")))
+
+    def test_exit_codes(self):
+        self.write("encrypted.json", ENCRYPTED_BUCKET)
+        self.write("plain.json", PLAIN_BUCKET)
+
+        self.assertEqual(self.run_scan().returncode, 0)
+        self.assertEqual(self.run_scan("--require", "encryption-at-rest").returncode, scan.EXIT_VIOLATIONS)
+
+        self.write("broken.json", '{"Resources": ')
+
+        self.assertEqual(self.run_scan("--require", "encryption-at-rest").returncode, scan.EXIT_ERRORS)
+        self.assertEqual(self.run_scan("--require", "encryption-at-rest", "--allow-errors").returncode, scan.EXIT_VIOLATIONS)
+        self.assertEqual(self.run_scan("--allow-errors").returncode, 0)
+
+    def test_unknown_resource_type(self):
+        # Supports no capabilities rather than failing the template
+        self.write("hook.json", '{"Resources": {"Hook": {"Type": "Custom::Hook", "Properties": {}}}}')
+        scan_process = self.run_scan("--require", "encryption-at-rest")
+
+        self.assertEqual(scan_process.returncode, 0)
+        self.assertEqual(json.loads(scan_process.stdout)["resources"], [{"logical_name": "Hook", "type": "Custom::Hook", "implements": [], "missing": []}])
+
+    def test_output(self):
+        self.write("plain.json", json.dumps(json.loads(PLAIN_BUCKET), indent=2))
+        policy = os.path.join(self.directory, "policy.json")
+
+        with open(policy, "w") as file:
+            json.dump({"require": ["AWS::S3::Bucket=encryption-at-rest"]}, file)
+
+        first = [json.loads(line) for line in self.run_scan("--policy", policy).stdout.splitlines()]
+        second = [json.loads(line) for line in self.run_scan("--policy", policy).stdout.splitlines()]
+
+        self.assertEqual([result["cached"] for result in first + second], [False, True])
+        self.assertEqual(first[0]["violations"], [{"logical_name": "Bucket", "type": "AWS::S3::Bucket", "capability": "encryption-at-rest"}])
+        self.assertEqual(second[0]["resources"], first[0]["resources"])
+
+        sarif = json.loads(self.run_scan("--policy", policy, "--format", "sarif").stdout)
+
+        self.assertEqual([rule["id"] for rule in sarif["runs"][0]["tool"]["driver"]["rules"]], ["encryption-at-rest"])
+        self.assertEqual(sarif["runs"][0]["results"][0]["locations"][0]["physicalLocation"]["region"], {"startLine": 3})
+
+if __name__ == "__main__":
+    unittest.main()
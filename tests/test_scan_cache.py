@@ -0,0 +1,116 @@
+from __future__ import annotations
+from unittest import mock
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from src.capability_index import CapabilityMatch
+from src.cfn_lint import CfnTemplate
+from src.scan_cache import ScanCache, get_scan_cache
+from tests.fixtures import BUCKET, capability_indexes, implementation, use_capability_artifact
+
+TOPIC = "AWS::SNS::Topic"
+
+def parse(resources) -> CfnTemplate:
+    return CfnTemplate.parse_raw(json.dumps({"Parameters": {"KeyArn": {"Type": "String"}}, "Resources": resources}))
+
+def notified_bucket(topic_name: str = "topic", bucket_name: str = "Bucket") -> CfnTemplate:
+    return parse({
+        bucket_name: {"Type": BUCKET, "Properties": {"BucketEncryption": {"Rules": []}, "NotificationConfiguration": {"TopicConfigurations": [{"Topic": {"Ref": "Topic"}}]}}},
+        "Topic": {"Type": TOPIC, "Properties": {"TopicName": topic_name, "KmsMasterKeyId": {"Ref": "Key"}}},
+        "Key": {"Type": "AWS::KMS::Key", "Properties": {"KeyPolicy": {"Ref": "KeyArn"}}}})
+
+class ScanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.capability_index = capability_indexes()[BUCKET]
+        self.capability_match = CapabilityMatch(self.capability_index, self.capability_index.present_edge_ids(set(implementation(None, BUCKET, ["BucketEncryption"])[1].edges)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = ScanCache.key("digest", notified_bucket().resource_content("Bucket"))
+
+        self.assertEqual(key, ScanCache.key("digest", notified_bucket(bucket_name="Renamed").resource_content("Renamed")))
+        self.assertNotEqual(key, ScanCache.key("other digest", notified_bucket().resource_content("Bucket")))
+        self.assertNotEqual(key, ScanCache.key("digest", notified_bucket().resource_content("Topic")))
+
+    def test_key_referenced_resources(self):
+        # A change to a resource Ref'd directly or through another resource changes the key, parameters aren't followed
+        template = notified_bucket()
+        changed = notified_bucket(topic_name="renamed")
+        key = ScanCache.key("digest", template.resource_content("Bucket"))
+
+        self.assertEqual(sorted(template.resource_content("Bucket")[2]), ["Key", "Topic"])
+        self.assertNotEqual(key, ScanCache.key("digest", changed.resource_content("Bucket")))
+        self.assertEqual(ScanCache.key("digest", template.resource_content("Key")), ScanCache.key("digest", changed.resource_content("Key")))
+
+    def test_key_circular_ref(self):
+        template = parse({
+            "First": {"Type": TOPIC, "Properties": {"Next": {"Ref": "Second"}}},
+            "Second": {"Type": TOPIC, "Properties": {"Next": {"Ref": "First"}}}})
+
+        self.assertEqual(sorted(template.resource_content("First")[2]), ["First", "Second"])
+
+    def test_memory(self):
+        scan_cache = ScanCache(max_size=1)
+        scan_cache.put("a", self.capability_match)
+
+        self.assertIs(scan_cache.get("a", self.capability_index), self.capability_match)
+
+        scan_cache.put("b", self.capability_match)
+
+        self.assertIsNone(scan_cache.get("a", self.capability_index))
+        self.assertEqual((scan_cache.hits, scan_cache.misses), (1, 1))
+
+    def test_disk(self):
+        ScanCache(max_size=0, directory=self.directory).put("ab", self.capability_match)
+        capability_match = ScanCache(max_size=0, directory=self.directory).get("ab", self.capability_index)
+
+        self.assertEqual(capability_match.present_edge_ids, self.capability_match.present_edge_ids)
+        self.assertEqual(capability_match.implements(), self.capability_match.implements())
+
+    def test_corrupt_disk_entry(self):
+        scan_cache = ScanCache(max_size=0, directory=self.directory)
+        scan_cache.put("ab", self.capability_match)
+
+        with open(os.path.join(self.directory, "ab", "ab.json"), "w") as file:
+            file.write("[1,")
+
+        self.assertIsNone(scan_cache.get("ab", self.capability_index))
+
+    def test_disk_pruning(self):
+        scan_cache = ScanCache(max_size=0, directory=self.directory, max_disk_size=10)
+
+        for position in range(11):
+            scan_cache.put(f"{position:02}", self.capability_match)
+
+        self.assertEqual(len(scan_cache._disk_paths()), 9)
+
+class CachedScanTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+
+    def test_hit_skips_graph(self):
+        first = notified_bucket().match_resource_capabilities("Bucket")
+
+        # Another template with the same bucket under another name, matched without expanding its properties
+        with mock.patch.object(CfnTemplate, "_add_relative_property_edges", autospec=True) as add_relative_property_edges:
+            second = notified_bucket(bucket_name="Renamed").match_resource_capabilities("Renamed")
+
+        add_relative_property_edges.assert_not_called()
+        self.assertIs(second, first)
+        self.assertEqual([capability.id for capability in second.implements()], ["encryption-at-rest"])
+
+    def test_referenced_resource_changed(self):
+        notified_bucket().match_resource_capabilities("Bucket")
+        notified_bucket(topic_name="renamed").match_resource_capabilities("Bucket")
+
+        self.assertEqual((get_scan_cache().hits, get_scan_cache().misses), (0, 2))
+
+if __name__ == "__main__":
+    unittest.main()
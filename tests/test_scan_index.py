@@ -0,0 +1,119 @@
+from __future__ import annotations
+from unittest import mock
+import os
+import shutil
+import tempfile
+import sys
+import unittest
+import graphene
+from src.queries import Query
+from src.scan_index import CapabilityCoverage, CoverageGrouping, IndexedResource, ScanIndex, StackTemplate
+from tests.fixtures import BUCKET, use_capability_artifact, write_capability_artifact
+import index_stacks
+import src.scan_index
+
+ENCRYPTED_BUCKET = '{"Resources": {"Bucket": {"Type": "AWS::S3::Bucket", "Properties": {"BucketEncryption": {}}}}}'
+PLAIN_BUCKET = '{"Resources": {"Bucket": {"Type": "AWS::S3::Bucket", "Properties": {}}, "Hook": {"Type": "Custom::Hook", "Properties": {}}}}'
+
+class ScanIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.artifact_path = os.path.join(self.directory, "capability_artifact.bin")
+        write_capability_artifact(self.artifact_path)
+        self.scan_index = ScanIndex(os.path.join(self.directory, "scan_index.sqlite"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def ingest(self, stacks):
+        return self.scan_index.ingest(stacks, processes=0, artifact_path=self.artifact_path)
+
+    def test_queries(self):
+        self.ingest([StackTemplate("encrypted", "111", ENCRYPTED_BUCKET), StackTemplate("plain", "222", PLAIN_BUCKET)])
+
+        self.assertEqual(self.scan_index.resources_lacking("encryption-at-rest"), [IndexedResource("plain", "222", "Bucket", BUCKET)])
+        self.assertEqual(self.scan_index.resources_lacking("encryption-at-rest", account="111"), [])
+        self.assertEqual(self.scan_index.coverage("encryption-at-rest"), [CapabilityCoverage("111", 1, 1), CapabilityCoverage("222", 0, 1)])
+        self.assertEqual(self.scan_index.coverage("versioning", CoverageGrouping.RESOURCE_TYPE), [CapabilityCoverage(BUCKET, 0, 2)])
+
+    def test_unchanged_stacks_are_skipped(self):
+        self.assertEqual(self.ingest([StackTemplate("encrypted", "111", ENCRYPTED_BUCKET)]).indexed, 1)
+        self.assertEqual(self.ingest([StackTemplate("encrypted", "111", ENCRYPTED_BUCKET)]).unchanged, 1)
+
+        result = self.ingest([StackTemplate("encrypted", "111", PLAIN_BUCKET)])
+
+        self.assertEqual((result.indexed, result.unchanged), (1, 0))
+        self.assertEqual(self.scan_index.coverage("encryption-at-rest"), [CapabilityCoverage("111", 0, 1)])
+
+    def test_failed_stacks_are_retried(self):
+        broken = StackTemplate("broken", "111", '{"Resources": ')
+
+        self.assertIn("broken", self.ingest([broken]).errors)
+        self.assertEqual(self.ingest([broken]).indexed, 1)
+        self.assertEqual(list(self.scan_index.errors()), ["broken"])
+
+        self.scan_index.remove(["broken"])
+
+        self.assertEqual(self.scan_index.errors(), {})
+
+class IndexStacksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        write_capability_artifact(os.path.join(self.directory, "capability_artifact.bin"))
+
+        # index_stacks.py reads the artifact from the working directory
+        previous_directory = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, previous_directory)
+
+    def index_stacks(self, *arguments: str):
+        # Without configuring logging for the rest of the tests
+        with mock.patch.object(sys, "argv", ["index_stacks.py", "--index", "scan_index.sqlite", "--account", "111", "--processes", "0", *arguments]), mock.patch("logging.basicConfig"), self.assertLogs("index_stacks"):
+            index_stacks.main()
+
+    def write_template(self, name: str, template: str) -> str:
+        with open(os.path.join(self.directory, name), "w") as file:
+            file.write(template)
+
+        return name
+
+    def test_exit_status(self):
+        self.index_stacks(self.write_template("encrypted.json", ENCRYPTED_BUCKET))
+
+        # A failing stack fails every later run, whether it's given again or not, until it's removed
+        with self.assertRaises(SystemExit) as context:
+            self.index_stacks(f"broken={self.write_template('broken.json', '{')}")
+
+        self.assertEqual(context.exception.code, 1)
+
+        with self.assertRaises(SystemExit):
+            self.index_stacks()
+
+        self.index_stacks("--remove", "broken")
+
+        self.assertEqual(list(ScanIndex("scan_index.sqlite").errors()), [])
+
+class ScanIndexQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.scan_index = ScanIndex(os.path.join(os.getcwd(), "scan_index.sqlite"))
+        self.scan_index.ingest([StackTemplate("plain", "222", PLAIN_BUCKET)], processes=0)
+        get_scan_index = mock.patch.object(src.scan_index, "get_scan_index", return_value=self.scan_index)
+        get_scan_index.start()
+        self.addCleanup(get_scan_index.stop)
+
+    def test_queries(self):
+        query = '{ resourcesLackingCapability(capabilityId: "encryption-at-rest") { stackId account logicalName resourceType } capabilityCoverage(capabilityId: "encryption-at-rest", groupBy: RESOURCE_TYPE) { key implemented total } }'
+        result = graphene.Schema(query=Query).execute(query)
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data, {
+            "resourcesLackingCapability": [{"stackId": "plain", "account": "222", "logicalName": "Bucket", "resourceType": BUCKET}],
+            "capabilityCoverage": [{"key": BUCKET, "implemented": 0, "total": 1}]})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from unittest import mock
+import json
+import os
+import signal
+import unittest
+from src.artifact import ARTIFACT_PATH
+from src.cfn_lint import _get_scan_pool, scan_templates
+from tests.fixtures import BUCKET, use_capability_artifact
+import src.cfn_lint
+
+ENCRYPTED_BUCKETS = json.dumps({"Resources": {"First": {"Type": BUCKET, "Properties": {"BucketEncryption": {"Rules": []}}}, "Second": {"Type": BUCKET, "Properties": {"Tags": []}}}})
+VERSIONED_BUCKET = json.dumps({"Resources": {"Bucket": {"Type": BUCKET, "Properties": {"VersioningConfiguration": {"Status": "Enabled"}}}}})
+MISSING_REF = json.dumps({"Resources": {"Bucket": {"Type": BUCKET, "Properties": {"Topic": {"Ref": "Missing"}}}}})
+
+def exit_worker(template, logical_names, artifact_path):
+    # Stands in for a worker killed while scanning
+    os._exit(1)
+
+def implemented(scan):
+    return [(logical_name, [capability.id for capability in capability_match.implements()]) for logical_name, capability_match in scan.resources]
+
+class ScanTemplatesTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        self.addCleanup(self.shutdown_pools)
+
+    def shutdown_pools(self):
+        _get_scan_pool(1, ARTIFACT_PATH).shutdown()
+        _get_scan_pool.cache_clear()
+
+    def assert_scans(self, scans):
+        self.assertEqual(implemented(scans[0]), [("First", ["encryption-at-rest"]), ("Second", [])])
+        self.assertEqual(implemented(scans[1]), [("Bucket", ["versioning"])])
+
+    def test_in_process(self):
+        scans = scan_templates([ENCRYPTED_BUCKETS, VERSIONED_BUCKET, "{", MISSING_REF], processes=0)
+
+        # Templates that can't be parsed or scanned only fail their own entry
+        self.assert_scans(scans)
+        self.assertTrue(scans[2].error.startswith("JSONDecodeError"))
+        self.assertIsNone(scans[3].resources)
+        self.assertTrue(scans[3].error.startswith("KeyError"))
+
+    def test_process_pool(self):
+        with mock.patch.object(src.cfn_lint, "RESOURCES_PER_TASK", 1):
+            scans = scan_templates([ENCRYPTED_BUCKETS, VERSIONED_BUCKET, "{", MISSING_REF], processes=1)
+
+        self.assert_scans(scans)
+        self.assertEqual([scan.error is None for scan in scans], [True, True, False, False])
+
+    def test_yaml(self):
+        # Split into tasks by the logical names of the parsed YAML, like JSON templates
+        yaml_template = f"Resources:\n  First:\n    Type: {BUCKET}\n    Properties:\n      BucketEncryption: {{Rules: []}}\n  Second:\n    Type: {BUCKET}\n    Properties:\n      BucketName: !Sub \"${{AWS::StackName}}\"\n"
+
+        with mock.patch.object(src.cfn_lint, "RESOURCES_PER_TASK", 1):
+            self.assertEqual(implemented(scan_templates([yaml_template], processes=1)[0]), [("First", ["encryption-at-rest"]), ("Second", [])])
+
+        self.assertEqual(implemented(scan_templates([yaml_template], processes=0)[0]), [("First", ["encryption-at-rest"]), ("Second", [])])
+
+    def test_killed_worker(self):
+        scan_templates([VERSIONED_BUCKET], processes=1)
+        pool = _get_scan_pool(1, ARTIFACT_PATH)
+
+        for process in list(pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+        # The broken pool is replaced rather than failing every later scan
+        self.assert_scans(scan_templates([ENCRYPTED_BUCKETS, VERSIONED_BUCKET], processes=1))
+        self.assertIsNot(_get_scan_pool(1, ARTIFACT_PATH), pool)
+
+    def test_worker_exits(self):
+        # Retried once in a new pool, then reported as the template's error
+        with mock.patch.object(src.cfn_lint, "_scan_template_resources", exit_worker), self.assertLogs("src.cfn_lint", "WARNING"):
+            scans = scan_templates([ENCRYPTED_BUCKETS, VERSIONED_BUCKET], processes=1)
+
+        self.assertEqual([scan.resources for scan in scans], [None, None])
+        self.assertTrue(all(scan.error.startswith("BrokenProcessPool") for scan in scans))
+        self.assert_scans(scan_templates([ENCRYPTED_BUCKETS, VERSIONED_BUCKET], processes=1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+from unittest import mock
+import asyncio
+import os
+import unittest
+from src.artifact import load_artifact
+from src.server import RequestLimitMiddleware, preload, serve
+from tests.fixtures import BUCKET, use_capability_artifact
+import src.metrics
+
+def http_scope():
+    return {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+class RequestLimitMiddlewareTest(unittest.TestCase):
+
+    def test_overloaded(self):
+        async def app(scope, receive, send):
+            await scope["release"].wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def request(middleware: RequestLimitMiddleware, scope):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await middleware(scope, None, send)
+            return messages[0]["status"], dict(messages[0]["headers"])
+
+        async def requests():
+            middleware = RequestLimitMiddleware(app, max_requests=1)
+            scope = {**http_scope(), "release": asyncio.Event()}
+            first = asyncio.ensure_future(request(middleware, scope))
+            await asyncio.sleep(0)
+
+            # The second request arrives while the first is still in flight
+            status, headers = await request(middleware, scope)
+            scope["release"].set()
+            return status, headers, (await first)[0], middleware.in_flight
+
+        with src.metrics.collect("test") as request_metrics:
+            status, headers, first_status, in_flight = asyncio.run(requests())
+
+        self.assertEqual((status, headers[b"retry-after"]), (503, b"1"))
+        self.assertEqual(first_status, 200)
+        self.assertEqual(in_flight, 0)
+        self.assertEqual(request_metrics.counts, {"requests_rejected": 1})
+
+class PreloadTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+
+    def test_preload(self):
+        with mock.patch("gc.freeze") as freeze:
+            preload()
+
+        self.assertEqual(freeze.call_count, 1)
+        self.assertEqual(list(load_artifact()._capability_indexes), [BUCKET])
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        for target in ("src.server.preload", "src.server._run_worker", "signal.signal", "time.sleep", "gc.disable", "gc.enable"):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop("METRICS_DIR", None)
+
+        src.metrics._metrics_dir.cache_clear()
+        self.addCleanup(src.metrics._metrics_dir.cache_clear)
+
+    def test_workers(self):
+        snapshots = []
+
+        def write_snapshot():
+            snapshots.append(os.listdir(os.environ["METRICS_DIR"]))
+
+        # Worker 101 dies and is replaced by 103, then there's no child left to wait for
+        with mock.patch("os.fork", side_effect=[101, 102, 103]) as fork, mock.patch("os.wait", side_effect=[(101, 256), ChildProcessError()]), mock.patch.object(src.metrics.registry, "write_snapshot", side_effect=write_snapshot):
+            with self.assertLogs("server") as logs:
+                serve(None, "127.0.0.1", 0, 2)
+
+        self.assertEqual(fork.call_count, 3)
+        self.assertIn("Worker 101 exited with status 256, restarting it", logs.output[-1])
+
+        # The workers were given a metrics directory, written to before forking and removed once they're gone
+        self.assertEqual(snapshots, [[]])
+        self.assertFalse(os.path.exists(os.environ["METRICS_DIR"]))
+
+    def test_metrics_dir_kept(self):
+        os.environ["METRICS_DIR"] = "/var/run/gomboc-metrics"
+
+        with mock.patch("os.fork", side_effect=[101, 102]), mock.patch("os.wait", side_effect=ChildProcessError()), mock.patch.object(src.metrics.registry, "write_snapshot"):
+            serve(None, "127.0.0.1", 0, 2)
+
+        self.assertEqual(os.environ["METRICS_DIR"], "/var/run/gomboc-metrics")
+
+if __name__ == "__main__":
+    unittest.main()
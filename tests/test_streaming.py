@@ -0,0 +1,62 @@
+from __future__ import annotations
+import json
+import unittest
+import graphene
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+from src.queries import Query
+from src.streaming import make_stream_handler
+from tests.fixtures import BUCKET, use_capability_artifact
+
+TEMPLATE = json.dumps({"Resources": {
+    "Encrypted": {"Type": BUCKET, "Properties": {"BucketEncryption": {"Rules": []}}},
+    "Broken": {"Type": BUCKET, "Properties": {"Topic": {"Ref": "Missing"}}},
+    "Versioned": {"Type": BUCKET, "Properties": {"VersioningConfiguration": {"Status": "Enabled"}}}}})
+QUERY = "query($template: String!) { scan: scanCloudformationTemplate(template: $template) { logicalName currentlyImplements { id } supportsButDoesNotCurrentlyImplement(limit: 1) { capability { id } } } }"
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+        app = Starlette()
+        app.add_route("/stream", make_stream_handler(graphene.Schema(query=Query)), methods=["POST"])
+        self.client = TestClient(app)
+
+    def stream(self, query: str, template: str = TEMPLATE):
+        return self.client.post("/stream", json={"query": query, "variables": {"template": template}})
+
+    def test_lines(self):
+        response = self.stream(QUERY)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+
+        # One line per resource, in template order, each the client's selection under its alias
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        self.assertEqual(lines[0], {"data": {"logicalName": "Encrypted", "currentlyImplements": [{"id": "encryption-at-rest"}], "supportsButDoesNotCurrentlyImplement": [{"capability": {"id": "versioning"}}]}})
+        self.assertEqual(lines[2]["data"]["logicalName"], "Versioned")
+        self.assertEqual(len(lines), 3)
+
+    def test_resource_error(self):
+        line = json.loads(self.stream(QUERY).text.splitlines()[1])
+
+        self.assertIsNone(line["data"])
+        self.assertEqual(line["errors"][0]["logicalName"], "Broken")
+        self.assertTrue(line["errors"][0]["message"].startswith("KeyError"))
+
+    def test_other_query(self):
+        response = self.stream("query { scanCacheStats { hits } }")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("can be streamed", response.json()["errors"][0])
+
+    def test_invalid_query(self):
+        self.assertEqual(self.stream("query { scanCloudformationTemplate }").status_code, 400)
+        self.assertEqual(self.client.post("/stream", data="not json").status_code, 400)
+
+    def test_invalid_template(self):
+        response = self.stream(QUERY, "{")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["errors"][0].startswith("JSONDecodeError"))
+
+if __name__ == "__main__":
+    unittest.main()
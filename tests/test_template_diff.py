@@ -0,0 +1,75 @@
+from __future__ import annotations
+from unittest import mock
+import json
+import unittest
+from src.cfn_lint import CfnTemplate
+from src.template_diff import ResourceChange, _affected_resources, diff_templates
+from tests.fixtures import BUCKET, use_capability_artifact
+
+def parse(resources, parameters=None) -> CfnTemplate:
+    return CfnTemplate.parse_raw(json.dumps({"Parameters": parameters or {}, "Resources": resources}))
+
+def stack(topic_name: str = "topic", bucket_properties=None, **extra_resources) -> CfnTemplate:
+    # A bucket Ref'ing a second one that Refs a third, and a bucket of its own. Buckets only, the one type the test
+    # artifact knows.
+    return parse({
+        "Bucket": {"Type": BUCKET, "Properties": {"NotificationConfiguration": {"TopicConfigurations": [{"Topic": {"Ref": "Topic"}}]}, **(bucket_properties or {})}},
+        "Topic": {"Type": BUCKET, "Properties": {"BucketName": topic_name, "LoggingConfiguration": {"DestinationBucketName": {"Ref": "Key"}}}},
+        "Key": {"Type": BUCKET, "Properties": {"Description": "key"}},
+        "Logs": {"Type": BUCKET, "Properties": {"Tags": []}},
+        **extra_resources})
+
+def diff_rows(diffs):
+    return [(diff.logical_name, diff.change, [capability.id for capability in diff.gained], [capability.id for capability in diff.lost]) for diff in diffs]
+
+class AffectedResourcesTest(unittest.TestCase):
+
+    def test_unchanged(self):
+        self.assertEqual(_affected_resources(stack(), stack()), set())
+
+    def test_dependents(self):
+        # Resources Ref'ing the changed one, directly or through another resource, are rescanned too
+        self.assertEqual(_affected_resources(stack(), stack(topic_name="renamed")), {"Topic", "Bucket"})
+
+        key_changed = stack()
+        key_changed.Resources["Key"].Properties["Description"] = "changed"
+
+        self.assertEqual(_affected_resources(stack(), key_changed), {"Key", "Topic", "Bucket"})
+
+    def test_added_and_removed(self):
+        added = stack(Extra={"Type": BUCKET, "Properties": {}})
+
+        self.assertEqual(_affected_resources(stack(), added), {"Extra"})
+        self.assertEqual(_affected_resources(added, stack()), {"Extra"})
+
+    def test_parameter(self):
+        # Whether {"Ref": "Name"} expands a resource depends on Name not being a parameter
+        resources = {"Bucket": {"Type": BUCKET, "Properties": {"Tags": {"Ref": "Name"}}}, "Logs": {"Type": BUCKET, "Properties": {}}}
+
+        self.assertEqual(_affected_resources(parse(resources, {"Name": {"Type": "String"}}), parse(resources)), {"Bucket"})
+
+class DiffTemplatesTest(unittest.TestCase):
+
+    def setUp(self):
+        use_capability_artifact(self)
+
+    def test_gained_and_lost(self):
+        encrypted = stack(bucket_properties={"BucketEncryption": {"Rules": []}})
+
+        self.assertEqual(diff_rows(diff_templates(stack(), encrypted)), [("Bucket", ResourceChange.MODIFIED, ["encryption-at-rest"], [])])
+        self.assertEqual(diff_rows(diff_templates(encrypted, stack())), [("Bucket", ResourceChange.MODIFIED, [], ["encryption-at-rest"])])
+
+    def test_added_and_removed(self):
+        added = stack(Versioned={"Type": BUCKET, "Properties": {"VersioningConfiguration": {"Status": "Enabled"}}})
+
+        self.assertEqual(diff_rows(diff_templates(stack(), added)), [("Versioned", ResourceChange.ADDED, ["versioning"], [])])
+        self.assertEqual(diff_rows(diff_templates(added, stack())), [("Versioned", ResourceChange.REMOVED, [], ["versioning"])])
+
+    def test_only_affected_scanned(self):
+        with mock.patch.object(CfnTemplate, "match_resource_capabilities", autospec=True, side_effect=CfnTemplate.match_resource_capabilities) as match_resource_capabilities:
+            self.assertEqual(diff_templates(stack(), stack(topic_name="renamed")), [])
+
+        self.assertEqual(sorted(call[0][1] for call in match_resource_capabilities.call_args_list), ["Bucket", "Bucket", "Topic", "Topic"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import json
+import unittest
+from src.cfn_lint import CfnTemplate
+from src.template_graph import TemplateGraph
+from tests.fixtures import BUCKET, capability_indexes
+
+TOPIC = "AWS::SNS::Topic"
+EDGES = [((True, BUCKET), (True, f"{BUCKET}-Tags")), ((True, BUCKET), (False, TOPIC))]
+
+class TemplateGraphTest(unittest.TestCase):
+
+    def test_view(self):
+        graph = TemplateGraph()
+        graph.add_resource("Bucket", EDGES + EDGES[:1])
+        view = graph.resource("Bucket")
+
+        # A read-only set of node pairs
+        self.assertEqual(len(view), 2)
+        self.assertEqual(set(view), set(EDGES))
+        self.assertEqual(view, set(EDGES))
+        self.assertIn(EDGES[1], view)
+        self.assertNotIn((EDGES[1][1], EDGES[1][0]), view)
+        self.assertNotIn(((True, "unknown"), (True, BUCKET)), view)
+        self.assertIsNone(graph.resource("Missing"))
+
+    def test_interned_once(self):
+        graph = TemplateGraph()
+        graph.add_resource("First", EDGES)
+        graph.add_resource("Second", EDGES[1:])
+
+        self.assertEqual(len(graph._nodes), 3)
+        self.assertEqual(graph.resource("First").packed_edges & graph.resource("Second").packed_edges, graph.resource("Second").packed_edges)
+
+class ResourceGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template = CfnTemplate.parse_raw(json.dumps({"Resources": {
+            "First": {"Type": BUCKET, "Properties": {"BucketEncryption": {"Rules": []}, "Topic": {"Ref": "Topic"}}},
+            "Second": {"Type": BUCKET, "Properties": {"Topic": {"Ref": "Topic"}}},
+            "Topic": {"Type": TOPIC, "Properties": {"TopicName": "topic"}}}}))
+
+    def test_shared(self):
+        # Every resource of the template is kept in one graph, built the first time it's looked at
+        first = self.template.resource_graph("First")
+
+        self.assertIs(self.template.resource_graph("Second").graph, first.graph)
+        self.assertIs(self.template.resource_graph("First").packed_edges, first.packed_edges)
+        self.assertIn(((True, f"{BUCKET}-Topic"), (False, TOPIC)), first)
+        self.assertIn(((True, f"{BUCKET}-Topic"), (True, f"{BUCKET}-Topic-TopicName")), first)
+
+    def test_matching(self):
+        capability_index = capability_indexes()[BUCKET]
+        resource_graph = self.template.resource_graph("First")
+
+        self.assertEqual(capability_index.present_edge_ids(resource_graph), capability_index.present_edge_ids(set(resource_graph)))
+        self.assertEqual(len(capability_index.present_edge_ids(resource_graph)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import json
+import unittest
+from src.cfn_lint import CfnTemplate
+from src.template_loader import load_template
+from tests.fixtures import BUCKET
+
+YAML_TEMPLATE = f"""
+AWSTemplateFormatVersion: 2010-09-09
+Resources:
+  Bucket:
+    Type: {BUCKET}
+    Properties:
+      BucketName: !Sub "${{AWS::StackName}}-bucket"
+      LifecycleConfiguration:
+        Rules:
+          - ExpirationInDays: 30
+            Status: !If [IsProduction, Enabled, Disabled]
+      NotificationConfiguration:
+        TopicConfigurations:
+          - Topic: !Ref Topic
+            Event: !Join ["", ["s3:", !Select [0, !Split [",", "ObjectCreated:*"]]]]
+  Topic:
+    Type: AWS::SNS::Topic
+    Properties:
+      KmsMasterKeyId: !GetAtt Key.Arn
+      Tags: !GetAtt [Key, Tags]
+"""
+
+class LoadTemplateTest(unittest.TestCase):
+
+    def test_short_forms(self):
+        resources = load_template(YAML_TEMPLATE)["Resources"]
+
+        self.assertEqual(resources["Bucket"]["Properties"]["BucketName"], {"Fn::Sub": "${AWS::StackName}-bucket"})
+        self.assertEqual(resources["Bucket"]["Properties"]["LifecycleConfiguration"]["Rules"][0], {"ExpirationInDays": 30, "Status": {"Fn::If": ["IsProduction", "Enabled", "Disabled"]}})
+        self.assertEqual(resources["Bucket"]["Properties"]["NotificationConfiguration"]["TopicConfigurations"][0], {
+            "Topic": {"Ref": "Topic"},
+            "Event": {"Fn::Join": ["", ["s3:", {"Fn::Select": [0, {"Fn::Split": [",", "ObjectCreated:*"]}]}]]}})
+        self.assertEqual(resources["Topic"]["Properties"], {"KmsMasterKeyId": {"Fn::GetAtt": ["Key", "Arn"]}, "Tags": {"Fn::GetAtt": ["Key", "Tags"]}})
+
+    def test_condition(self):
+        self.assertEqual(load_template("Conditions:\n  Both: !And [!Condition First, !Equals [a, b]]\n")["Conditions"]["Both"], {"Fn::And": [{"Condition": "First"}, {"Fn::Equals": ["a", "b"]}]})
+
+    def test_dates_kept(self):
+        self.assertEqual(load_template(YAML_TEMPLATE)["AWSTemplateFormatVersion"], "2010-09-09")
+
+    def test_json(self):
+        template = {"Resources": {"Bucket": {"Type": BUCKET, "Properties": {"Tags": []}}}}
+
+        self.assertEqual(load_template(json.dumps(template)), template)
+        self.assertEqual(load_template(json.dumps(template).encode()), template)
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Invalid YAML template"):
+            load_template("Resources: [")
+
+        with self.assertRaises(ValueError):
+            load_template("{")
+
+class ParseRawTest(unittest.TestCase):
+
+    def test_yaml_template(self):
+        template = CfnTemplate.parse_raw(YAML_TEMPLATE)
+        edges = set(template.resource_graph("Bucket"))
+
+        # Numbers are walked like strings, the Ref is expanded as in JSON templates
+        self.assertIn(((True, f"{BUCKET}-LifecycleConfiguration-Rules"), (True, f"{BUCKET}-LifecycleConfiguration-Rules-ExpirationInDays")), edges)
+        self.assertIn(((True, f"{BUCKET}-NotificationConfiguration-TopicConfigurations-Topic"), (False, "AWS::SNS::Topic")), edges)
+
+    def test_same_as_json(self):
+        template = load_template(YAML_TEMPLATE)
+
+        self.assertEqual(set(CfnTemplate.parse_raw(YAML_TEMPLATE).resource_graph("Bucket")), set(CfnTemplate.parse_raw(json.dumps(template)).resource_graph("Bucket")))
+
+    def test_invalid_structure(self):
+        with self.assertRaises(ValueError):
+            CfnTemplate.parse_raw("Resources:\n  Bucket:\n    Properties: {}\n")
+
+if __name__ == "__main__":
+    unittest.main()